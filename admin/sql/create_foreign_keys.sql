@@ -20,6 +20,21 @@ ALTER TABLE highlevel_meta
   FOREIGN KEY (id)
   REFERENCES highlevel (id);
 
+ALTER TABLE highlevel_document
+  ADD CONSTRAINT highlevel_document_fk_highlevel
+  FOREIGN KEY (id)
+  REFERENCES highlevel (id);
+
+ALTER TABLE highlevel_pending
+  ADD CONSTRAINT highlevel_pending_fk_lowlevel
+  FOREIGN KEY (id)
+  REFERENCES lowlevel (id);
+
+ALTER TABLE highlevel_lease
+  ADD CONSTRAINT highlevel_lease_fk_lowlevel
+  FOREIGN KEY (id)
+  REFERENCES lowlevel (id);
+
 ALTER TABLE highlevel_model
   ADD CONSTRAINT highlevel_model_fk_highlevel
   FOREIGN KEY (highlevel)
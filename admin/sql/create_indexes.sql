@@ -6,6 +6,8 @@ CREATE INDEX build_sha1_ndx_lowlevel ON lowlevel (build_sha1);
 CREATE INDEX submitted_ndx_lowlevel ON lowlevel (submitted);
 CREATE INDEX lossless_ndx_lowlevel ON lowlevel (lossless);
 CREATE INDEX gid_submission_offset_ndx_lowlevel ON lowlevel (gid, submission_offset);
+-- All of the columns used by db.data.get_many_submissions, so that it only reads the index
+CREATE INDEX gid_submissions_ndx_lowlevel ON lowlevel (gid, submission_offset, id, submitted, lossless, build_sha1, codec, bit_rate);
 
 CREATE UNIQUE INDEX data_sha256_ndx_lowlevel_json ON lowlevel_json (data_sha256);
 
@@ -22,6 +24,9 @@ CREATE INDEX model_ndx_highlevel_model ON highlevel_model (model);
 CREATE INDEX version_ndx_highlevel_model ON highlevel_model (version);
 CREATE INDEX highlevel_ndx_highlevel_model ON highlevel_model (highlevel);
 
+-- A version block is only stored once, see db.data.insert_version
+CREATE UNIQUE INDEX data_sha256_type_ndx_version ON version (data_sha256, type);
+
 CREATE UNIQUE INDEX lower_musicbrainz_id_ndx_user ON "user" (lower(musicbrainz_id));
 
 CREATE INDEX collected_ndx_statistics ON statistics (collected);
@@ -1,10 +1,14 @@
 BEGIN;
 
 ALTER TABLE lowlevel ADD CONSTRAINT lowlevel_pkey PRIMARY KEY (id);
+ALTER TABLE submission_offset_counter ADD CONSTRAINT submission_offset_counter_pkey PRIMARY KEY (gid);
 ALTER TABLE lowlevel_json ADD CONSTRAINT lowlevel_json_pkey PRIMARY KEY (id);
 ALTER TABLE highlevel ADD CONSTRAINT highlevel_pkey PRIMARY KEY (id);
 ALTER TABLE highlevel_meta ADD CONSTRAINT highlevel_meta_pkey PRIMARY KEY (id);
 ALTER TABLE highlevel_model ADD CONSTRAINT highlevel_model_pkey PRIMARY KEY (id);
+ALTER TABLE highlevel_document ADD CONSTRAINT highlevel_document_pkey PRIMARY KEY (id);
+ALTER TABLE highlevel_pending ADD CONSTRAINT highlevel_pending_pkey PRIMARY KEY (id);
+ALTER TABLE highlevel_lease ADD CONSTRAINT highlevel_lease_pkey PRIMARY KEY (id);
 ALTER TABLE model ADD CONSTRAINT model_pkey PRIMARY KEY (id);
 ALTER TABLE version ADD CONSTRAINT version_pkey PRIMARY KEY (id);
 ALTER TABLE statistics ADD CONSTRAINT statistics_pkey PRIMARY KEY (collected);
@@ -7,7 +7,15 @@ CREATE TABLE lowlevel (
   lossless          BOOLEAN                  DEFAULT 'n',
   submitted         TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
   gid_type          gid_type  NOT NULL,
-  submission_offset INTEGER   NOT NULL
+  submission_offset INTEGER   NOT NULL,
+  codec             TEXT,
+  bit_rate          INTEGER
+);
+
+-- The next submission_offset to use for each gid in lowlevel
+CREATE TABLE submission_offset_counter (
+  gid         UUID,
+  next_offset INTEGER NOT NULL
 );
 
 CREATE TABLE lowlevel_json (
@@ -30,6 +38,26 @@ CREATE TABLE highlevel_meta (
   data_sha256 CHAR(64) NOT NULL
 );
 
+-- The assembled high-level document of a submission, see db.data.write_high_level_documents
+CREATE TABLE highlevel_document (
+  id          INTEGER, -- FK to highlevel.id
+  data        JSONB    NOT NULL,
+  model_state TEXT     NOT NULL,
+  updated     TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Submissions which have no high-level data yet, see db.data.get_unprocessed_highlevel_documents
+CREATE TABLE highlevel_pending (
+  id          INTEGER -- FK to lowlevel.id
+);
+
+-- Submissions which a high-level extractor is working on, see db.data.claim_highlevel_documents
+CREATE TABLE highlevel_lease (
+  id          INTEGER, -- FK to lowlevel.id
+  worker      TEXT     NOT NULL,
+  expires     TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 CREATE TABLE highlevel_model (
   id          SERIAL,
   highlevel   INTEGER, -- FK to highlevel.id
@@ -4,6 +4,9 @@ ALTER TABLE lowlevel_json DROP CONSTRAINT IF EXISTS lowlevel_json_fk_lowlevel;
 ALTER TABLE lowlevel_json DROP CONSTRAINT IF EXISTS lowlevel_json_fk_version;
 ALTER TABLE highlevel     DROP CONSTRAINT IF EXISTS highlevel_fk_lowlevel;
 ALTER TABLE highlevel_meta DROP CONSTRAINT IF EXISTS highlevel_meta_fk_highlevel;
+ALTER TABLE highlevel_document DROP CONSTRAINT IF EXISTS highlevel_document_fk_highlevel;
+ALTER TABLE highlevel_pending DROP CONSTRAINT IF EXISTS highlevel_pending_fk_lowlevel;
+ALTER TABLE highlevel_lease DROP CONSTRAINT IF EXISTS highlevel_lease_fk_lowlevel;
 ALTER TABLE highlevel_model DROP CONSTRAINT IF EXISTS highlevel_model_fk_highlevel;
 ALTER TABLE highlevel_model DROP CONSTRAINT IF EXISTS highlevel_model_fk_version;
 ALTER TABLE highlevel_model DROP CONSTRAINT IF EXISTS highlevel_model_fk_model;
@@ -1,10 +1,14 @@
 BEGIN;
 
 ALTER TABLE lowlevel DROP CONSTRAINT IF EXISTS lowlevel_pkey;
+ALTER TABLE submission_offset_counter DROP CONSTRAINT IF EXISTS submission_offset_counter_pkey;
 ALTER TABLE lowlevel_json DROP CONSTRAINT IF EXISTS lowlevel_json_pkey;
 ALTER TABLE highlevel DROP CONSTRAINT IF EXISTS highlevel_pkey;
 ALTER TABLE highlevel_meta DROP CONSTRAINT IF EXISTS highlevel_meta_pkey;
 ALTER TABLE highlevel_model DROP CONSTRAINT IF EXISTS highlevel_model_pkey;
+ALTER TABLE highlevel_document DROP CONSTRAINT IF EXISTS highlevel_document_pkey;
+ALTER TABLE highlevel_pending DROP CONSTRAINT IF EXISTS highlevel_pending_pkey;
+ALTER TABLE highlevel_lease DROP CONSTRAINT IF EXISTS highlevel_lease_pkey;
 ALTER TABLE model DROP CONSTRAINT IF EXISTS model_pkey;
 ALTER TABLE version DROP CONSTRAINT IF EXISTS version_pkey;
 ALTER TABLE statistics DROP CONSTRAINT IF EXISTS statistics_pkey;
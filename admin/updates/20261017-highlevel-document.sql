@@ -0,0 +1,19 @@
+BEGIN;
+
+CREATE TABLE highlevel_document (
+  id          INTEGER, -- FK to highlevel.id
+  data        JSONB    NOT NULL,
+  model_state TEXT     NOT NULL,
+  updated     TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+ALTER TABLE highlevel_document ADD CONSTRAINT highlevel_document_pkey PRIMARY KEY (id);
+
+ALTER TABLE highlevel_document
+  ADD CONSTRAINT highlevel_document_fk_highlevel
+  FOREIGN KEY (id)
+  REFERENCES highlevel (id);
+
+COMMIT;
+
+-- Documents are written by `python manage.py highlevel rebuild_documents` after this update
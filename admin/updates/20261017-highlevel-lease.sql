@@ -0,0 +1,16 @@
+BEGIN;
+
+CREATE TABLE highlevel_lease (
+  id          INTEGER, -- FK to lowlevel.id
+  worker      TEXT     NOT NULL,
+  expires     TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+ALTER TABLE highlevel_lease ADD CONSTRAINT highlevel_lease_pkey PRIMARY KEY (id);
+
+ALTER TABLE highlevel_lease
+  ADD CONSTRAINT highlevel_lease_fk_lowlevel
+  FOREIGN KEY (id)
+  REFERENCES lowlevel (id);
+
+COMMIT;
@@ -0,0 +1,16 @@
+BEGIN;
+
+CREATE TABLE highlevel_pending (
+  id          INTEGER -- FK to lowlevel.id
+);
+
+ALTER TABLE highlevel_pending ADD CONSTRAINT highlevel_pending_pkey PRIMARY KEY (id);
+
+ALTER TABLE highlevel_pending
+  ADD CONSTRAINT highlevel_pending_fk_lowlevel
+  FOREIGN KEY (id)
+  REFERENCES lowlevel (id);
+
+COMMIT;
+
+-- The queue is filled with existing submissions by `python manage.py highlevel enqueue_pending` after this update
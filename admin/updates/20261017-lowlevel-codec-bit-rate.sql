@@ -0,0 +1,19 @@
+BEGIN;
+
+ALTER TABLE lowlevel ADD COLUMN codec TEXT;
+ALTER TABLE lowlevel ADD COLUMN bit_rate INTEGER;
+
+UPDATE lowlevel ll
+   SET codec = CASE WHEN jsonb_typeof(llj.data->'metadata'->'audio_properties'->'codec') = 'string'
+                    THEN llj.data->'metadata'->'audio_properties'->>'codec' END
+     , bit_rate = CASE WHEN jsonb_typeof(llj.data->'metadata'->'audio_properties'->'bit_rate') = 'number'
+                       THEN (llj.data->'metadata'->'audio_properties'->>'bit_rate')::numeric::integer END
+  FROM lowlevel_json llj
+ WHERE ll.id = llj.id;
+
+CREATE INDEX gid_submissions_ndx_lowlevel ON lowlevel (gid, submission_offset, id, submitted, lossless, build_sha1, codec, bit_rate);
+
+COMMIT;
+
+-- The update rewrites every row of lowlevel, so update the visibility map for index-only scans
+VACUUM ANALYZE lowlevel;
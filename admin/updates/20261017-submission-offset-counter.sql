@@ -0,0 +1,15 @@
+BEGIN;
+
+CREATE TABLE submission_offset_counter (
+  gid         UUID,
+  next_offset INTEGER NOT NULL
+);
+
+INSERT INTO submission_offset_counter (gid, next_offset)
+     SELECT gid, MAX(submission_offset) + 1
+       FROM lowlevel
+   GROUP BY gid;
+
+ALTER TABLE submission_offset_counter ADD CONSTRAINT submission_offset_counter_pkey PRIMARY KEY (gid);
+
+COMMIT;
@@ -0,0 +1,31 @@
+BEGIN;
+
+-- Point rows which use a duplicate version block at the first copy of it
+CREATE TEMPORARY TABLE version_duplicate ON COMMIT DROP AS
+     SELECT v.id
+          , first.id AS first_id
+       FROM version v
+       JOIN (  SELECT data_sha256, type, MIN(id) AS id
+                 FROM version
+             GROUP BY data_sha256, type) first
+         ON v.data_sha256 = first.data_sha256
+        AND v.type = first.type
+        AND v.id <> first.id;
+
+UPDATE lowlevel_json llj
+   SET version = vd.first_id
+  FROM version_duplicate vd
+ WHERE llj.version = vd.id;
+
+UPDATE highlevel_model hlm
+   SET version = vd.first_id
+  FROM version_duplicate vd
+ WHERE hlm.version = vd.id;
+
+DELETE FROM version v
+      USING version_duplicate vd
+      WHERE v.id = vd.id;
+
+CREATE UNIQUE INDEX data_sha256_type_ndx_version ON version (data_sha256, type);
+
+COMMIT;
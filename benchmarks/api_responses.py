@@ -0,0 +1,134 @@
+"""Benchmark of the CPU cost of building low-level and high-level API responses.
+
+Compares the two ways that the ``/low-level`` and ``/high-level`` endpoints
+can build a response body:
+
+* ``decode``: load the documents as Python objects with
+  :func:`db.data.load_many_low_level` / :func:`db.data.load_many_high_level`
+  and serialise them again with ``jsonify``. This is how every response was
+  built before the passthrough was added.
+* ``passthrough``: load the stored JSON text with
+  :func:`db.data.load_many_low_level_json` /
+  :func:`db.data.load_many_high_level_json` and put it into the response
+  without decoding it.
+
+The documents in db/test_data are written to the database configured in
+config.py (with a high-level document for each of them), so run it against a
+local development database only::
+
+    python -m benchmarks.api_responses --requests 200 --recordings 25
+"""
+from __future__ import print_function
+
+import copy
+import json
+import os
+import resource
+import time
+import uuid
+
+import click
+from flask import jsonify
+
+import db
+import db.data
+import db.document_cache
+import webserver
+from webserver.views.api.v1 import core
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(db.__file__)), 'test_data')
+
+BENCHMARK_MODEL = "benchmark_model"
+BENCHMARK_MODEL_VERSION = "v1"
+
+
+def cpu_time():
+    """User and system CPU time used by this process, in seconds."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def load_documents(count):
+    """Write `count` low-level documents with a high-level document each.
+
+    Returns:
+        a list of (mbid, offset) tuples of the written documents
+    """
+    templates = []
+    for name in sorted(os.listdir(TEST_DATA_PATH)):
+        if name.endswith(".json"):
+            with open(os.path.join(TEST_DATA_PATH, name)) as f:
+                templates.append(json.load(f))
+
+    if not any(model["model"] == BENCHMARK_MODEL for model in db.data.get_active_models()):
+        db.data.add_model(BENCHMARK_MODEL, BENCHMARK_MODEL_VERSION, db.data.STATUS_SHOW)
+
+    recordings = []
+    for i in range(count):
+        document = copy.deepcopy(templates[i % len(templates)])
+        mbid = str(uuid.uuid4())
+        document["metadata"]["tags"]["musicbrainz_recordingid"] = [mbid]
+        db.data.submit_low_level_data(mbid, document, "mbid")
+        with db.engine.connect() as connection:
+            ll_id = connection.execute("SELECT id FROM lowlevel WHERE gid = %s", (mbid,)).fetchone()[0]
+        highlevel = {
+            "highlevel": {BENCHMARK_MODEL: {"value": "a", "probability": 0.9,
+                                            "all": {"a": 0.9, "b": 0.1}}},
+            "metadata": {"audio_properties": document["metadata"]["audio_properties"],
+                         "version": {"highlevel": {"essentia": "benchmark"}}},
+        }
+        db.data.write_high_level(mbid, ll_id, highlevel, "benchmark")
+        recordings.append((mbid, 0))
+    return recordings
+
+
+def measure(app, build_response, recordings, requests):
+    """Build `requests` responses for `recordings`.
+
+    Returns:
+        a tuple (CPU milliseconds per request, wall clock milliseconds per request, response size in bytes)
+    """
+    with app.test_request_context():
+        size = len(build_response(recordings).get_data())
+        cpu_start = cpu_time()
+        start = time.time()
+        for _ in range(requests):
+            build_response(recordings).get_data()
+        elapsed = time.time() - start
+        cpu = cpu_time() - cpu_start
+    return cpu * 1000 / requests, elapsed * 1000 / requests, size
+
+
+METHODS = [
+    ("low-level decode", lambda recordings: jsonify(db.data.load_many_low_level(recordings))),
+    ("low-level passthrough",
+     lambda recordings: core._json_response(core._join_documents(db.data.load_many_low_level_json(recordings)))),
+    ("high-level decode", lambda recordings: jsonify(db.data.load_many_high_level(recordings))),
+    ("high-level passthrough",
+     lambda recordings: core._json_response(core._join_documents(db.data.load_many_high_level_json(recordings)))),
+]
+
+
+@click.command()
+@click.option("--requests", "-n", default=200, type=click.IntRange(1, None),
+              help="Number of responses to build with each method.")
+@click.option("--recordings", "-r", default=core.MAX_ITEMS_PER_BULK_REQUEST,
+              type=click.IntRange(1, core.MAX_ITEMS_PER_BULK_REQUEST),
+              help="Number of recordings in each response.")
+@click.option("--cache/--no-cache", default=False,
+              help="Read documents from the document cache instead of the database.")
+def main(requests, recordings, cache):
+    """Measure the CPU time used to build bulk API responses."""
+    app = webserver.create_app()
+    db.document_cache.init(enabled=cache)
+    recordings = load_documents(recordings)
+
+    click.echo("%d requests of %d recordings, document cache %s" % (
+        requests, len(recordings), "enabled" if cache else "disabled"))
+    for name, build_response in METHODS:
+        cpu, wall, size = measure(app, build_response, recordings, requests)
+        click.echo("  %-24s cpu %.2f ms/request, wall %.2f ms/request, %d bytes" % (name, cpu, wall, size))
+
+
+if __name__ == "__main__":
+    main()
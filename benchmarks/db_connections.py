@@ -0,0 +1,84 @@
+"""Benchmark of the database connections used to render a recording summary.
+
+The summary page (see :func:`webserver.views.data.summary`) loads a low-level
+and a high-level document, the active models and the number of submissions of
+a recording, each with its own :func:`db.connect`. This measures the number
+of new database connections and the time per page view:
+
+* ``unpooled``: a new connection for each :func:`db.connect` (the default
+  when SQLALCHEMY_POOL_SIZE is not set).
+* ``pooled``: connections are kept in a pool of SQLALCHEMY_POOL_SIZE
+  connections (``--pool-size``).
+
+Each is measured with and without a connection scope (see
+:func:`db.connection_scope`), which the web server starts for each request so
+that all of the queries of a page view use one connection.
+
+The documents in db/test_data are written to the database configured in
+config.py, so run it against a local development database only::
+
+    python -m benchmarks.db_connections --requests 200
+"""
+from __future__ import print_function
+
+import time
+
+import click
+
+import db
+import db.data
+import db.document_cache
+import webserver
+from benchmarks.api_responses import load_documents
+
+
+def page_view(mbid, scoped):
+    if scoped:
+        # As in a request to the web server
+        with db.connection_scope():
+            page_view(mbid, False)
+        return
+    db.data.get_summary_data(mbid)
+    db.data.count_lowlevel(mbid)
+
+
+def measure(recordings, requests, scoped):
+    """Render the data of `requests` summary pages.
+
+    Returns:
+        a tuple (new connections per page view, connection uses per page view, milliseconds per page view)
+    """
+    db.reset_pool_stats()
+    start = time.time()
+    for i in range(requests):
+        page_view(recordings[i % len(recordings)][0], scoped)
+    elapsed = time.time() - start
+    stats = db.get_pool_stats()
+    return (float(stats["connects"]) / requests, float(stats["checkouts"]) / requests,
+            elapsed * 1000 / requests)
+
+
+@click.command()
+@click.option("--requests", "-n", default=200, type=click.IntRange(1, None),
+              help="Number of page views with each configuration.")
+@click.option("--pool-size", "-p", default=5, type=click.IntRange(1, None),
+              help="Size of the connection pool.")
+@click.option("--pgbouncer", is_flag=True, help="SQLALCHEMY_DATABASE_URI points to a PgBouncer.")
+def main(requests, pool_size, pgbouncer):
+    """Measure the database connections opened to render summary pages."""
+    app = webserver.create_app()
+    db.document_cache.init(enabled=False)
+    recordings = load_documents(10)
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+
+    click.echo("%d page views" % requests)
+    for name, pool_args in [("unpooled", {}), ("pooled", {"pool_size": pool_size, "pgbouncer": pgbouncer})]:
+        db.init_db_engine(uri, **pool_args)
+        for scoped in (False, True):
+            connects, checkouts, wall = measure(recordings, requests, scoped)
+            click.echo("  %-10s %-9s %.2f connections opened, %.2f used, %.2f ms per page view"
+                       % (name, "scoped" if scoped else "unscoped", connects, checkouts, wall))
+
+
+if __name__ == "__main__":
+    main()
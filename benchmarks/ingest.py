@@ -0,0 +1,242 @@
+"""Load test of low-level submission.
+
+Submits many low-level documents to the database configured in config.py and
+reports the throughput, latency, number of database queries per document and
+number of rows written. Documents are either synthesised from the templates in
+db/test_data, with random MBIDs and audio properties and a configurable
+fraction of duplicate submissions, or replayed from a trace file. A trace is
+newline-delimited JSON with an ``mbid`` and a ``data`` key on each line, which
+is the format of the bulk submission endpoint and of the submission spool.
+
+Each target replays the documents from a number of threads:
+
+* ``api``: POST to /api/v1/<mbid>/low-level through the Flask test client
+* ``direct``: :func:`db.data.submit_low_level_data`
+
+This writes to the configured database, so run it against a local development
+database only::
+
+    python -m benchmarks.ingest --documents 2000 --concurrency 8 --duplicate-rate 0.2
+"""
+from __future__ import print_function
+
+import copy
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from Queue import Queue, Empty
+
+import click
+from brainzutils import cache, ratelimit
+from sqlalchemy import event
+
+import db
+import db.data
+import db.exceptions
+import webserver
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(db.__file__)), 'test_data')
+
+TARGETS = ["api", "direct"]
+
+# (codec, lossless, bit rate) of synthesised documents
+AUDIO_FORMATS = [
+    ("mp3", False, 128000),
+    ("mp3", False, 320000),
+    ("vorbis", False, 192000),
+    ("aac", False, 256000),
+    ("flac", True, 1411200),
+    ("alac", True, 1411200),
+]
+
+COUNTED_TABLES = ["lowlevel", "lowlevel_json", "version", "submission_offset_counter"]
+
+
+def load_templates():
+    templates = []
+    for name in sorted(os.listdir(TEST_DATA_PATH)):
+        if name.endswith(".json"):
+            with open(os.path.join(TEST_DATA_PATH, name)) as f:
+                templates.append(json.load(f))
+    return templates
+
+
+def synthesise_documents(count, duplicate_rate, rng):
+    """Make `count` (mbid, document json) submissions from the test data templates.
+
+    Each new document gets a random MBID and audio properties, so that it has a
+    different sha256 from all other documents. With probability `duplicate_rate`
+    a submission repeats an earlier one instead.
+    """
+    templates = load_templates()
+    submissions = []
+    for _ in range(count):
+        if submissions and rng.random() < duplicate_rate:
+            submissions.append(rng.choice(submissions))
+            continue
+        document = copy.deepcopy(rng.choice(templates))
+        mbid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        codec, lossless, bit_rate = rng.choice(AUDIO_FORMATS)
+        document["metadata"]["tags"]["musicbrainz_recordingid"] = [mbid]
+        document["metadata"]["audio_properties"].update({
+            "codec": codec,
+            "lossless": lossless,
+            "bit_rate": bit_rate,
+            "length": round(rng.uniform(30, 600), 6),
+            "md5_encoded": "%032x" % rng.getrandbits(128),
+        })
+        submissions.append((mbid, json.dumps(document)))
+    return submissions
+
+
+def read_trace(path):
+    """Read (mbid, document json) submissions from a trace file."""
+    submissions = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                submissions.append((item["mbid"], json.dumps(item["data"])))
+    return submissions
+
+
+class QueryCounter(object):
+    """Count the queries that are run on an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+
+def count_rows():
+    with db.engine.connect() as connection:
+        return {table: connection.execute("SELECT count(*) FROM %s" % table).fetchone()[0]
+                for table in COUNTED_TABLES}
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def make_submitter(target, app):
+    if target == "api":
+        client = app.test_client()
+
+        def submit(mbid, document_json):
+            response = client.post("/api/v1/%s/low-level" % mbid, data=document_json,
+                                   content_type="application/json")
+            return response.status_code < 400
+    else:
+        def submit(mbid, document_json):
+            try:
+                db.data.submit_low_level_data(mbid, json.loads(document_json), "mbid")
+            except db.exceptions.BadDataException:
+                return False
+            return True
+    return submit
+
+
+def replay(target, app, submissions, concurrency):
+    """Submit all documents to a target from `concurrency` threads.
+
+    Returns:
+        a tuple (elapsed seconds, sorted list of latencies in seconds, number of errors)
+    """
+    queue = Queue()
+    for submission in submissions:
+        queue.put(submission)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        submit = make_submitter(target, app)
+        with app.app_context():
+            while True:
+                try:
+                    mbid, document_json = queue.get_nowait()
+                except Empty:
+                    return
+                start = time.time()
+                ok = submit(mbid, document_json)
+                latency = time.time() - start
+                with lock:
+                    latencies.append(latency)
+                    if not ok:
+                        errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, sorted(latencies), errors[0]
+
+
+@click.command()
+@click.option("--documents", "-n", default=1000, type=click.IntRange(1, None),
+              help="Number of documents to synthesise for each target.")
+@click.option("--concurrency", "-c", default=4, type=click.IntRange(1, None),
+              help="Number of threads submitting documents.")
+@click.option("--duplicate-rate", "-d", default=0.1, type=float,
+              help="Fraction of synthesised submissions which repeat an earlier submission.")
+@click.option("--target", "-t", "targets", multiple=True, type=click.Choice(TARGETS),
+              help="Where to submit documents. Can be given more than once. Defaults to all targets.")
+@click.option("--trace", type=click.Path(exists=True),
+              help="Replay the submissions in this NDJSON file instead of synthesising documents.")
+@click.option("--seed", default=0, type=int, help="Random seed for synthesised documents.")
+def main(documents, concurrency, duplicate_rate, targets, trace, seed):
+    """Measure low-level submission throughput against the configured database."""
+    app = webserver.create_app()
+    queries = QueryCounter(db.engine)
+
+    # Don't let the rate limiter slow down the api target
+    limit_per_ip = cache.get(ratelimit.ratelimit_per_ip_key)
+    limit_window = cache.get(ratelimit.ratelimit_window_key)
+    ratelimit.set_rate_limits(10 ** 9, 10 ** 9, 60)
+
+    try:
+        for i, target in enumerate(targets or TARGETS):
+            if trace:
+                submissions = read_trace(trace)
+            else:
+                # New MBIDs for each target, so that one target doesn't see the documents of another as duplicates
+                submissions = synthesise_documents(documents, duplicate_rate, random.Random(seed + i))
+
+            rows_before = count_rows()
+            queries_before = queries.count
+            elapsed, latencies, errors = replay(target, app, submissions, concurrency)
+            query_count = queries.count - queries_before
+            rows_after = count_rows()
+
+            click.echo("%s: %d documents, %d threads, %d errors" % (target, len(submissions), concurrency, errors))
+            click.echo("  throughput: %.1f documents/s" % (len(submissions) / elapsed))
+            click.echo("  latency: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms" % (
+                percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000))
+            click.echo("  queries: %.2f per document" % (float(query_count) / len(submissions)))
+            click.echo("  rows written: %s" % ", ".join("%s %d" % (table, rows_after[table] - rows_before[table])
+                                                        for table in COUNTED_TABLES))
+    finally:
+        if limit_per_ip is not None and limit_window is not None:
+            ratelimit.set_rate_limits(limit_per_ip, limit_per_ip, limit_window)
+        else:
+            ratelimit.set_rate_limits(ratelimit.ratelimit_per_ip_default, ratelimit.ratelimit_per_ip_default,
+                                      ratelimit.ratelimit_window_default)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Micro-benchmark of low-level document validation.
+
+Compares :func:`db.data.prepare_low_level_data`, which validates, cleans and
+serializes a document in one pass, with the previous implementation, which
+made a deep copy of the tags in :func:`db.data.clean_metadata` and walked the
+document again in :func:`db.data.sanity_check_data`.
+
+Run with::
+
+    python -m benchmarks.validation
+"""
+from __future__ import print_function
+
+import copy
+import json
+import os
+import timeit
+from hashlib import sha256
+
+import click
+
+import db.data
+import db.exceptions
+
+TEST_DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(db.__file__)), 'test_data')
+
+
+def legacy_prepare_low_level_data(mbid, data):
+    """The validation path used before prepare_low_level_data was added."""
+    data = db.data.clean_metadata(data)
+    try:
+        if 'musicbrainz_trackid' in data['metadata']['tags']:
+            val = data['metadata']['tags']['musicbrainz_trackid']
+            del data['metadata']['tags']['musicbrainz_trackid']
+            data['metadata']['tags']['musicbrainz_recordingid'] = val
+        if data['metadata']['audio_properties']['lossless']:
+            data['metadata']['audio_properties']['lossless'] = True
+        else:
+            data['metadata']['audio_properties']['lossless'] = False
+    except KeyError:
+        pass
+    if db.data.sanity_check_data(data) is not None:
+        raise db.exceptions.BadDataException("Missing key")
+    if data['metadata']['tags']['musicbrainz_recordingid'][0].lower() != mbid.lower():
+        raise db.exceptions.BadDataException("Wrong mbid")
+    data_json = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return data, (data_json, sha256(data_json.encode("utf-8")).hexdigest())
+
+
+def load_test_documents():
+    """Load the low-level documents in db/test_data, keyed by mbid."""
+    documents = {}
+    for name in sorted(os.listdir(TEST_DATA_PATH)):
+        if name.endswith(".json"):
+            with open(os.path.join(TEST_DATA_PATH, name)) as f:
+                documents[name[:-len(".json")]] = json.load(f)
+    return documents
+
+
+@click.command()
+@click.option("--number", "-n", default=200, type=click.IntRange(1, None),
+              help="Number of times to validate each document.")
+def main(number):
+    """Time the validation of each test document with the old and new implementations."""
+    for mbid, document in load_test_documents().items():
+        # Both implementations change the document, so each run gets a fresh copy
+        copies = [copy.deepcopy(document) for _ in range(number * 2)]
+
+        old_result = legacy_prepare_low_level_data(mbid, copy.deepcopy(document))
+        new_result = db.data.prepare_low_level_data(mbid, copy.deepcopy(document))
+        assert old_result[1] == new_result[1], "Implementations give different results for %s" % mbid
+
+        old = timeit.timeit(lambda: legacy_prepare_low_level_data(mbid, copies.pop()), number=number)
+        new = timeit.timeit(lambda: db.data.prepare_low_level_data(mbid, copies.pop()), number=number)
+        print("%s (%d KB): old %.3f ms, new %.3f ms, %.2fx" % (
+            mbid, len(new_result[1][0]) // 1024, old * 1000 / number, new * 1000 / number, old / new))
+
+
+if __name__ == "__main__":
+    main()
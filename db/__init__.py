@@ -1,16 +1,250 @@
+import os
+import threading
+from contextlib import contextmanager
+
 import sqlalchemy
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.pool import NullPool
 
 # This value must be incremented after schema changes on replicated tables!
 SCHEMA_VERSION = 3
 
+# Defaults of the connection pool, see init_db_engine
+DEFAULT_POOL_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = -1
+# PgBouncer closes idle client connections, so don't keep them for too long
+DEFAULT_PGBOUNCER_POOL_RECYCLE = 5 * 60
+
+POOL_STATS_KEYS = ["connects", "checkouts", "checkins", "invalidations", "fork_discards"]
 
 engine = None
 
-def init_db_engine(connect_str):
+_pool_stats = {key: 0 for key in POOL_STATS_KEYS}
+_pool_stats_lock = threading.Lock()
+
+# The connection scope of each thread, see start_connection_scope
+_scope = threading.local()
+
+# Key in `connection.info` of the functions to call after a commit, see after_commit
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+
+def init_db_engine(connect_str, pool_size=None, max_overflow=DEFAULT_POOL_MAX_OVERFLOW,
+                   pool_timeout=DEFAULT_POOL_TIMEOUT, pool_recycle=None, pool_pre_ping=False, pgbouncer=False):
+    """Create the database engine of this process.
+
+    Args:
+        connect_str: the database URI
+        pool_size: the number of connections to keep open in this process. If None,
+            connections are not pooled, and each `engine.connect()` opens a new
+            connection to the database.
+        max_overflow: the number of connections which can be opened in addition to
+            `pool_size` when all of the pooled connections are in use
+        pool_timeout: the number of seconds to wait for a connection when `pool_size + max_overflow`
+            connections are in use
+        pool_recycle: close pooled connections which are older than this number of
+            seconds. -1 to keep connections forever.
+        pool_pre_ping: check that a pooled connection is still alive before it is used
+        pgbouncer: if the database URI points to a PgBouncer in transaction pooling mode.
+            A server connection is only assigned to a client connection for the duration
+            of a transaction, so connections are rolled back when they are returned to the
+            pool, and are pinged before use because PgBouncer closes idle client connections.
+            Session state (SET, advisory locks, prepared statements, cursors WITH HOLD) must
+            not be used on these connections.
+
+    Connections which were opened by a parent process are never used by a forked child
+    process (e.g. uWSGI workers if the app is loaded before forking), the child opens
+    its own connections instead.
+    """
     global engine
-    engine = create_engine(connect_str, poolclass=NullPool)
+    if engine is not None:
+        engine.dispose()
+    if pool_size is None:
+        engine = create_engine(connect_str, poolclass=NullPool)
+    else:
+        if pool_recycle is None:
+            pool_recycle = DEFAULT_PGBOUNCER_POOL_RECYCLE if pgbouncer else DEFAULT_POOL_RECYCLE
+        engine = create_engine(connect_str,
+                               pool_size=pool_size,
+                               max_overflow=max_overflow,
+                               pool_timeout=pool_timeout,
+                               pool_recycle=pool_recycle,
+                               pool_pre_ping=pool_pre_ping or pgbouncer,
+                               pool_reset_on_return="rollback")
+    _add_pool_listeners(engine)
+
+
+def _count(key):
+    with _pool_stats_lock:
+        _pool_stats[key] += 1
+
+
+def _add_pool_listeners(engine):
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        _count("connects")
+        connection_record.info["pid"] = os.getpid()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info["pid"] != os.getpid():
+            # This connection was opened by the parent process. Detach it without
+            # closing it (which would close it for the parent too), and open a new one.
+            _count("fork_discards")
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError("Connection belongs to pid %s, attempting to check out in pid %s"
+                                         % (connection_record.info["pid"], os.getpid()))
+        _count("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        _count("checkins")
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        _count("invalidations")
+
+
+def get_pool_stats():
+    """Get statistics of the connections of this process since the last call to :func:`reset_pool_stats`.
+
+    Returns:
+        a dictionary with the number of new database connections (`connects`), the number
+        of times that a connection was used (`checkouts`) and returned (`checkins`), the
+        number of connections which were discarded because they were broken (`invalidations`)
+        or opened by a parent process (`fork_discards`), and the current `pool` status
+    """
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["pool"] = engine.pool.status() if engine is not None else None
+    return stats
+
+
+def reset_pool_stats():
+    with _pool_stats_lock:
+        for key in POOL_STATS_KEYS:
+            _pool_stats[key] = 0
+
+
+def start_connection_scope():
+    """Share a single database connection between all functions which are called
+    by this thread until :func:`end_connection_scope` is called.
+
+    The connection is only opened when it is first used by :func:`connect` or
+    :func:`begin`. The web server starts a scope for each request.
+
+    The DB-API opens a transaction with the first statement on the connection, and
+    outside of :func:`begin` it is only ended when the scope ends. After its first
+    SELECT the connection is therefore idle in a transaction for the rest of the
+    request, including the whole body of a streamed (NDJSON) response. Behind a
+    PgBouncer in transaction pooling mode this keeps a server connection assigned
+    to the request for all that time.
+    """
+    _scope.active = True
+    _scope.connection = None
+
+
+def end_connection_scope():
+    """End the connection scope of this thread and close its connection.
+
+    Anything which was not committed is rolled back.
+    """
+    connection = getattr(_scope, "connection", None)
+    _scope.active = False
+    _scope.connection = None
+    if connection is not None:
+        connection.close()
+
+
+@contextmanager
+def connection_scope():
+    """Share a database connection in a block of code, see :func:`start_connection_scope`.
+
+    If this thread is already in a connection scope, that scope is used.
+    """
+    if getattr(_scope, "active", False):
+        yield
+        return
+    start_connection_scope()
+    try:
+        yield
+    finally:
+        end_connection_scope()
+
+
+def _get_scoped_connection():
+    if not getattr(_scope, "active", False):
+        return None
+    if _scope.connection is None:
+        _scope.connection = engine.connect()
+    return _scope.connection
+
+
+@contextmanager
+def connect():
+    """Get a database connection, like `engine.connect()`.
+
+    In a connection scope the connection of the scope is used, and it is not
+    closed at the end of the block.
+    """
+    connection = _get_scoped_connection()
+    if connection is None:
+        with engine.connect() as connection:
+            yield connection
+    else:
+        yield connection
+
+
+@contextmanager
+def _transaction(connection):
+    if connection.in_transaction():
+        with connection.begin_nested():
+            yield connection
+        return
+    try:
+        with connection.begin():
+            yield connection
+    except Exception:
+        connection.info.pop(_AFTER_COMMIT_KEY, None)
+        raise
+    for callback in connection.info.pop(_AFTER_COMMIT_KEY, []):
+        callback()
+
+
+@contextmanager
+def begin():
+    """Get a database connection in a transaction, like `engine.begin()`.
+
+    The transaction is committed at the end of the block, or rolled back if there
+    is an exception. In a connection scope the connection of the scope is used. If
+    it is already in a transaction, the block runs in a savepoint of that
+    transaction: an exception only rolls back the block, and nothing is committed
+    until the outer block ends. Use :func:`after_commit` for anything which must
+    only happen once the changes are committed.
+    """
+    connection = _get_scoped_connection()
+    if connection is None:
+        with engine.connect() as connection:
+            with _transaction(connection):
+                yield connection
+    else:
+        with _transaction(connection):
+            yield connection
+
+
+def after_commit(connection, callback):
+    """Call a function once the outermost :func:`begin` block of a connection is committed.
+
+    The function isn't called if that transaction is rolled back. It is still
+    called if only the savepoint of a nested block was rolled back.
+
+    Args:
+        connection: a connection returned by :func:`begin`
+        callback: a function without arguments
+    """
+    connection.info.setdefault(_AFTER_COMMIT_KEY, []).append(callback)
 
 
 def run_sql_script(sql_file_path):
@@ -18,7 +18,7 @@ def generate(owner_id):
     Returns:
         Value of the new key.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         value = _generate_key(KEY_LENGTH)
         connection.execute(sqlalchemy.text("""
             INSERT INTO api_key (value, owner)
@@ -41,7 +41,7 @@ def get_active(owner_id):
     Returns:
         List of active API keys.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT value
               FROM api_key
@@ -52,7 +52,7 @@ def get_active(owner_id):
 
 def revoke(value):
     """Revoke key with a given value."""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         connection.execute(sqlalchemy.text("""
             UPDATE api_key
                SET is_active = FALSE
@@ -62,7 +62,7 @@ def revoke(value):
 
 def revoke_all(owner_id):
     """Revoke all keys owned by a user."""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         connection.execute(sqlalchemy.text("""
             UPDATE api_key
                SET is_active = FALSE
@@ -82,7 +82,7 @@ def is_active(value):
     Raises:
         NoDataFoundException: Specified key was not found.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT is_active
               FROM api_key
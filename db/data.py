@@ -2,15 +2,23 @@ import copy
 import json
 import logging
 import os
+import threading
 import time
-from collections import defaultdict
+import uuid
+from collections import defaultdict, OrderedDict
 from hashlib import sha256
 
 import sqlalchemy.exc
-from sqlalchemy import text
+from brainzutils import cache
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 
 import db
+import db.document_cache
 import db.exceptions
+import db.model_registry
+import db.sha_filter
+import db.single_flight
 
 _whitelist_file = os.path.join(os.path.dirname(__file__), "tagwhitelist.json")
 _whitelist_tags = set(json.load(open(_whitelist_file)))
@@ -31,6 +39,9 @@ SANITY_CHECK_KEYS = [
     ['tonal'],
 ]
 
+# Sections of a low-level document which contain the descriptors
+DESCRIPTOR_SECTIONS = ['lowlevel', 'rhythm', 'tonal']
+
 STATUS_HIDDEN = 'hidden'
 STATUS_EVALUATION = 'evaluation'
 STATUS_SHOW = 'show'
@@ -40,6 +51,47 @@ VERSION_TYPE_HIGHLEVEL = 'highlevel'
 
 MODEL_STATUSES = [STATUS_HIDDEN, STATUS_EVALUATION, STATUS_SHOW]
 
+SUBMISSION_STATUS_OK = 'ok'
+SUBMISSION_STATUS_DUPLICATE = 'duplicate'
+SUBMISSION_STATUS_ERROR = 'error'
+# Submissions which have been added to the submission spool, see db.spool
+SUBMISSION_STATUS_QUEUED = 'queued'
+
+# The unique index on lowlevel_json.data_sha256
+LOWLEVEL_JSON_SHA256_INDEX = 'data_sha256_ndx_lowlevel_json'
+
+VERSION_CACHE_DEFAULT_SIZE = 1000
+VERSION_CACHE_NAMESPACE = "version-id"
+VERSION_CACHE_GENERATION_KEY = "generation"
+VERSION_CACHE_TIMEOUT = 24 * 60 * 60  # 1 day
+# How often (in seconds) a process checks if the shared version cache was cleared by another process
+VERSION_CACHE_GENERATION_CHECK_INTERVAL = 60
+
+# Number of recordings which the iter_* functions look up in one query
+ITER_CHUNK_SIZE = 1000
+# Number of rows which the iter_* functions read from the database at a time
+ITER_FETCH_SIZE = 50
+
+# Number of materialised high-level documents written in each transaction by rebuild_high_level_documents
+HIGH_LEVEL_DOCUMENT_BATCH_SIZE = 1000
+
+# Number of seconds that a high-level extractor may work on claimed submissions
+# before they can be claimed by another extractor, see claim_highlevel_documents
+HIGHLEVEL_LEASE_DURATION = 60 * 60
+
+# Number of lowlevel ids looked at in each transaction by enqueue_unprocessed_highlevel_documents
+HIGHLEVEL_PENDING_BATCH_SIZE = 10000
+
+# In-process cache of (data_sha256, version type) -> version.id, used by insert_version.
+# Entries are only added once the transaction that read or inserted the version has committed.
+_version_cache = OrderedDict()
+_version_cache_lock = threading.Lock()
+_version_cache_size = VERSION_CACHE_DEFAULT_SIZE
+_version_cache_shared = False
+_version_cache_generation = None
+_version_cache_generation_checked = 0
+_version_cache_stats = {"hits": 0, "shared_hits": 0, "misses": 0}
+
 
 # TODO: Util methods should not be in the database package
 
@@ -69,7 +121,7 @@ def get_failed_highlevel_submissions():
     Returns:
         (List[dict]): A list of dictionaries containing lowlevel id, mbid, submission offset
     """
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         query = text("""
                         SELECT ll.id
                              , ll.gid::text
@@ -92,10 +144,13 @@ def get_failed_highlevel_submissions():
 def remove_failed_highlevel_submissions():
     """Remove all highlevel rows with no matching highlevel_meta rows.
     These rows represent rows that failed highlevel processing. Removing the rows
-    will cause them to be processed again."""
+    and adding them to the queue of the high-level extractor will cause them to
+    be processed again."""
 
-    with db.engine.connect() as connection:
+    # A statement starting with WITH isn't autocommitted, so it needs a transaction
+    with db.begin() as connection:
         query = text("""
+               WITH removed AS (
                     DELETE
                       FROM highlevel
                      WHERE highlevel.id
@@ -105,6 +160,12 @@ def remove_failed_highlevel_submissions():
                              USING (id)
                              WHERE highlevel_meta.id is null
                            )
+                 RETURNING id
+                    )
+             INSERT INTO highlevel_pending (id)
+                  SELECT id
+                    FROM removed
+             ON CONFLICT DO NOTHING
                     """)
         connection.execute(query)
 
@@ -133,77 +194,345 @@ def clean_metadata(data):
     return data
 
 
-def submit_low_level_data(mbid, data, gid_type):
-    """Function for submitting low-level data.
+def _compile_required_keys(keys):
+    """Turn a list of key paths like SANITY_CHECK_KEYS into a tree of nested
+    OrderedDicts, so that each level of a document only needs to be looked at once."""
+    tree = OrderedDict()
+    for key in keys:
+        node = tree
+        for part in key:
+            node = node.setdefault(part, OrderedDict())
+    return tree
+
+
+_required_keys = _compile_required_keys(SANITY_CHECK_KEYS)
+
+
+def _find_missing_key(data, tree, path):
+    """Find the first key in `tree` which is missing from `data`, in the order of
+    SANITY_CHECK_KEYS. Keys which have children in the tree must be objects.
+
+    Returns:
+        the path to the missing key as a list, or None if all keys are present
+    Raises:
+        BadDataException: if a key which should contain other keys is not an object
+    """
+    for part, children in tree.items():
+        if part not in data:
+            missing = path + [part]
+            # Report the first required key inside the missing one
+            while children:
+                part, children = next(iter(children.items()))
+                missing.append(part)
+            return missing
+        if children:
+            if not isinstance(data[part], dict):
+                raise db.exceptions.BadDataException("Key '%s' must be an object." % ' : '.join(path + [part]))
+            missing = _find_missing_key(data[part], children, path + [part])
+            if missing is not None:
+                return missing
+    return None
+
+
+def validate_low_level_data(mbid, data):
+    """Clean and check low-level data before it is written to the database.
+
+    Tags that are not in the whitelist are removed, a submitted
+    musicbrainz_trackid tag is renamed to musicbrainz_recordingid, and the
+    lossless flag is converted to a boolean. All of the keys in
+    SANITY_CHECK_KEYS must exist, and the descriptor sections must be objects.
+    The data is changed in place, walking each level of the document once.
 
     Args:
         mbid: MusicBrainz ID of the recording that corresponds to the data
             that is being submitted.
         data: Low-level data about the recording.
-        gid_type: the ID type [musicbrainzid(mbid) or messybrainzid(msid)]
+    Returns:
+        The cleaned data.
+    Raises:
+        BadDataException: if a required key is missing or has the wrong type, or
+            the recording id in the data doesn't match `mbid`.
     """
     mbid = str(mbid)
-    data = clean_metadata(data)
-
-    try:
-        # If the user submitted a trackid key, rewrite to recording_id
-        if 'musicbrainz_trackid' in data['metadata']['tags']:
-            val = data['metadata']['tags']['musicbrainz_trackid']
-            del data['metadata']['tags']['musicbrainz_trackid']
-            data['metadata']['tags']['musicbrainz_recordingid'] = val
-
-        if data['metadata']['audio_properties']['lossless']:
-            data['metadata']['audio_properties']['lossless'] = True
-        else:
-            data['metadata']['audio_properties']['lossless'] = False
-
-    except KeyError:
-        pass
-
-    missing_key = sanity_check_data(data)
+    if not isinstance(data, dict):
+        raise db.exceptions.BadDataException("Submitted data must be an object.")
+
+    metadata = data.get('metadata')
+    if isinstance(metadata, dict):
+        tags = metadata.get('tags')
+        if isinstance(tags, dict):
+            # Build a new dictionary of whitelisted tags instead of copying and deleting
+            cleaned_tags = {tag: value for tag, value in tags.items() if tag.lower() in _whitelist_tags}
+            # If the user submitted a trackid key, rewrite to recording_id
+            if 'musicbrainz_trackid' in cleaned_tags:
+                cleaned_tags['musicbrainz_recordingid'] = cleaned_tags.pop('musicbrainz_trackid')
+            metadata['tags'] = cleaned_tags
+
+        audio_properties = metadata.get('audio_properties')
+        if isinstance(audio_properties, dict) and 'lossless' in audio_properties:
+            audio_properties['lossless'] = bool(audio_properties['lossless'])
+
+    missing_key = _find_missing_key(data, _required_keys, [])
     if missing_key is not None:
         raise db.exceptions.BadDataException(
             "Key '%s' was not found in submitted data." %
             ' : '.join(missing_key)
         )
 
+    for section in DESCRIPTOR_SECTIONS:
+        if not isinstance(data[section], dict):
+            raise db.exceptions.BadDataException("Key '%s' must be an object." % section)
+
     # Ensure the MBID form the URL matches the recording_id from the POST data
-    if data['metadata']['tags']['musicbrainz_recordingid'][0].lower() != mbid.lower():
+    recording_ids = data['metadata']['tags']['musicbrainz_recordingid']
+    if not isinstance(recording_ids, list) or not recording_ids or not isinstance(recording_ids[0], basestring):
+        raise db.exceptions.BadDataException("Tag 'musicbrainz_recordingid' must be a list of MBIDs.")
+    if recording_ids[0].lower() != mbid.lower():
         raise db.exceptions.BadDataException(
             "The musicbrainz_trackid/musicbrainz_recordingid in "
             "the submitted data does not match the MBID that is "
             "part of this resource URL."
         )
 
+    return data
+
+
+def serialize_low_level_data(data):
+    """Serialize low-level data in the canonical form that is stored in the database.
+
+    Returns:
+        a tuple (data_json, data_sha256)
+    """
+    data_json = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return data_json, sha256(data_json.encode("utf-8")).hexdigest()
+
+
+def prepare_low_level_data(mbid, data):
+    """Validate low-level data with :func:`validate_low_level_data` and serialize it.
+
+    Returns:
+        a tuple (data, (data_json, data_sha256)), which can be passed to :func:`write_low_level`
+    """
+    data = validate_low_level_data(mbid, data)
+    return data, serialize_low_level_data(data)
+
+
+def submit_low_level_data(mbid, data, gid_type):
+    """Function for submitting low-level data.
+
+    Args:
+        mbid: MusicBrainz ID of the recording that corresponds to the data
+            that is being submitted.
+        data: Low-level data about the recording.
+        gid_type: the ID type [musicbrainzid(mbid) or messybrainzid(msid)]
+    """
+    mbid = str(mbid)
+    data, serialized = prepare_low_level_data(mbid, data)
+
     # The data looks good, lets see about saving it
-    write_low_level(mbid, data, gid_type)
+    write_low_level(mbid, data, gid_type, serialized)
+
+
+def submit_many_low_level_data(submissions, gid_type):
+    """Validate and write many low-level submissions at once.
+
+    Every submission is validated individually, and all valid submissions
+    are then written to the database in a single transaction with
+    :func:`write_many_low_level`.
+
+    Args:
+        submissions: A list of (mbid, data) tuples.
+        gid_type: the ID type [musicbrainzid(mbid) or messybrainzid(msid)]
+
+    Returns:
+        A list with one status dictionary per submission, in the same order as
+        `submissions`. See :func:`write_many_low_level` for the format.
+        Submissions which fail validation have the status SUBMISSION_STATUS_ERROR
+        and a "message" describing the problem.
+    """
+    statuses = [None] * len(submissions)
+    valid = []
+    positions = []
+    for i, (mbid, data) in enumerate(submissions):
+        mbid = str(mbid).lower()
+        try:
+            data, serialized = prepare_low_level_data(mbid, data)
+        except db.exceptions.BadDataException as e:
+            statuses[i] = {"mbid": mbid, "status": SUBMISSION_STATUS_ERROR, "message": str(e)}
+            continue
+        except (KeyError, TypeError, AttributeError):
+            statuses[i] = {"mbid": mbid, "status": SUBMISSION_STATUS_ERROR, "message": "data is badly formed"}
+            continue
+        valid.append((mbid, data, serialized))
+        positions.append(i)
+
+    if valid:
+        for i, status in zip(positions, write_many_low_level(valid, gid_type)):
+            statuses[i] = status
+
+    return statuses
+
+
+def init_version_cache(size=VERSION_CACHE_DEFAULT_SIZE, shared=False):
+    """Configure the cache used by :func:`insert_version`.
+
+    Args:
+        size: the maximum number of versions to keep in memory in this process
+        shared: if True, also share version ids between processes in redis
+    """
+    global _version_cache_size, _version_cache_shared
+    _version_cache_size = size
+    _version_cache_shared = shared
+    clear_version_cache(local_only=True)
+
+
+def clear_version_cache(local_only=False):
+    """Remove all items from the version cache.
+
+    This must be called if rows are deleted from the `version` table. Unless
+    `local_only` is set, the shared cache is also cleared, and other processes
+    drop their in-memory cache within VERSION_CACHE_GENERATION_CHECK_INTERVAL seconds.
+    """
+    global _version_cache_generation, _version_cache_generation_checked
+    with _version_cache_lock:
+        _version_cache.clear()
+        _version_cache_generation = None
+        _version_cache_generation_checked = 0
+    if _version_cache_shared and not local_only:
+        cache.set(VERSION_CACHE_GENERATION_KEY, uuid.uuid4().hex, namespace=VERSION_CACHE_NAMESPACE)
+
+
+def get_version_cache_stats():
+    """Get the hit and miss counters of the version cache in this process.
+
+    Returns:
+        a dictionary {"hits": n, "shared_hits": n, "misses": n, "size": n} where hits
+        were found in memory, shared_hits were found in the shared cache, and misses
+        required a database query.
+    """
+    with _version_cache_lock:
+        stats = dict(_version_cache_stats)
+        stats["size"] = len(_version_cache)
+    return stats
+
+
+def _version_cache_key(data_sha256, version_type):
+    return "%s:%s" % (version_type, data_sha256)
+
+
+def _check_version_cache_generation():
+    """Drop the in-memory version cache if the shared cache was cleared by another process."""
+    global _version_cache_generation, _version_cache_generation_checked
+    now = time.time()
+    if now - _version_cache_generation_checked < VERSION_CACHE_GENERATION_CHECK_INTERVAL:
+        return
+    generation = cache.get(VERSION_CACHE_GENERATION_KEY, namespace=VERSION_CACHE_NAMESPACE)
+    with _version_cache_lock:
+        if generation != _version_cache_generation:
+            _version_cache.clear()
+            _version_cache_generation = generation
+        _version_cache_generation_checked = now
+
+
+def _get_cached_version_id(key):
+    if _version_cache_shared:
+        _check_version_cache_generation()
+    with _version_cache_lock:
+        version_id = _version_cache.pop(key, None)
+        if version_id is not None:
+            # Move to the end, so that the least recently used item is removed first
+            _version_cache[key] = version_id
+            _version_cache_stats["hits"] += 1
+            return version_id
+
+    if _version_cache_shared:
+        version_id = cache.get(key, namespace=VERSION_CACHE_NAMESPACE)
+        if version_id is not None:
+            _add_version_id_to_cache(key, version_id, shared=False)
+            with _version_cache_lock:
+                _version_cache_stats["shared_hits"] += 1
+            return version_id
+
+    with _version_cache_lock:
+        _version_cache_stats["misses"] += 1
+    return None
+
+
+def _add_version_id_to_cache(key, version_id, shared=True):
+    with _version_cache_lock:
+        _version_cache.pop(key, None)
+        _version_cache[key] = version_id
+        while len(_version_cache) > _version_cache_size:
+            _version_cache.popitem(last=False)
+    if shared and _version_cache_shared:
+        cache.set(key, version_id, time=VERSION_CACHE_TIMEOUT, namespace=VERSION_CACHE_NAMESPACE)
+
+
+@event.listens_for(Engine, "commit")
+def _on_commit_cache_versions(connection):
+    """Versions read or inserted in a transaction are only cached once it has committed,
+    so that the cache never contains the id of a row that was rolled back."""
+    pending = connection.info.pop("pending_version_ids", None)
+    if pending:
+        for key, version_id in pending.items():
+            _add_version_id_to_cache(key, version_id)
+
+
+@event.listens_for(Engine, "rollback")
+def _on_rollback_discard_versions(connection):
+    connection.info.pop("pending_version_ids", None)
+
+
+@event.listens_for(Engine, "rollback_savepoint")
+def _on_rollback_savepoint_discard_versions(connection, name, context):
+    # We don't know which versions were added after the savepoint, so discard them all
+    connection.info.pop("pending_version_ids", None)
 
 
 def insert_version(connection, data, version_type):
-    # TODO: Memoise sha -> id
+    """Get the id of a version block, inserting it if it doesn't exist yet.
+
+    Version ids are cached in memory (and optionally in redis, see
+    :func:`init_version_cache`) by the sha256 of the normalised version data,
+    so most calls don't need to query the database.
+    """
     norm_data = json.dumps(data, sort_keys=True, separators=(',', ':'))
     sha = sha256(norm_data).hexdigest()
-    query = text("""
-            SELECT id
-              FROM version
-             WHERE data_sha256=:data_sha256
-               AND type=:version_type""")
-    result = connection.execute(query, {"data_sha256": sha, "version_type": version_type})
-    row = result.fetchone()
-    if row:
-        return row[0]
+    key = _version_cache_key(sha, version_type)
 
+    version_id = _get_cached_version_id(key)
+    if version_id is not None:
+        return version_id
+
+    params = {"data": norm_data, "sha": sha, "version_type": version_type}
+    # Another process may insert the same version at the same time, so insert
+    # it unless it already exists, and look it up if nothing was inserted
     result = connection.execute(
         text("""INSERT INTO version (data, data_sha256, type)
-        VALUES (:data, :sha, :version_type)
-        RETURNING id"""),
-        {"data": norm_data, "sha": sha, "version_type": version_type}
+                     VALUES (:data, :sha, :version_type)
+                ON CONFLICT (data_sha256, type) DO NOTHING
+                  RETURNING id"""),
+        params
     )
     row = result.fetchone()
-    return row[0]
+    if row is None:
+        query = text("""
+                SELECT id
+                  FROM version
+                 WHERE data_sha256=:sha
+                   AND type=:version_type""")
+        row = connection.execute(query, params).fetchone()
+    version_id = row[0]
+
+    if connection.in_transaction():
+        connection.info.setdefault("pending_version_ids", {})[key] = version_id
+    else:
+        # Outside of a transaction the row has already been committed
+        _add_version_id_to_cache(key, version_id)
+    return version_id
 
 
-def write_low_level(mbid, data, is_mbid):
+def write_low_level(mbid, data, is_mbid, serialized=None):
     def _get_by_data_sha256(connection, data_sha256):
         query = text("""
             SELECT id
@@ -215,16 +544,19 @@ def write_low_level(mbid, data, is_mbid):
 
     def _insert_lowlevel(connection, mbid, build_sha1, is_lossless_submit, gid_type, submission_offset):
         """ Insert metadata into the lowlevel table and return its id """
+        codec, bit_rate = _get_codec_and_bit_rate(data)
         query = text("""
-            INSERT INTO lowlevel (gid, build_sha1, lossless, gid_type, submission_offset)
-                 VALUES (:mbid, :build_sha1, :lossless, :gid_type, :submission_offset)
+            INSERT INTO lowlevel (gid, build_sha1, lossless, gid_type, submission_offset, codec, bit_rate)
+                 VALUES (:mbid, :build_sha1, :lossless, :gid_type, :submission_offset, :codec, :bit_rate)
               RETURNING id
         """)
         result = connection.execute(query, {"mbid": mbid,
                                             "build_sha1": build_sha1,
                                             "lossless": is_lossless_submit,
                                             "gid_type": gid_type,
-                                            "submission_offset": submission_offset})
+                                            "submission_offset": submission_offset,
+                                            "codec": codec,
+                                            "bit_rate": bit_rate})
         return result.fetchone()[0]
 
     def _insert_lowlevel_json(connection, ll_id, data_json, data_sha256, version_id):
@@ -242,29 +574,233 @@ def write_low_level(mbid, data, is_mbid):
     is_lossless_submit = data['metadata']['audio_properties']['lossless']
     version = data['metadata']['version']
     build_sha1 = version['essentia_build_sha']
-    data_json = json.dumps(data, sort_keys=True, separators=(',', ':'))
-    data_sha256 = sha256(data_json.encode("utf-8")).hexdigest()
-    with db.engine.begin() as connection:
-        # See if we already have this data
-        existing = _get_by_data_sha256(connection, data_sha256)
-        if existing:
-            logging.info("Already have %s" % data_sha256)
-            return
+    data_json, data_sha256 = serialized or serialize_low_level_data(data)
+    try:
+        with db.begin() as connection:
+            # See if we already have this data. If the sha256 filter says that
+            # we don't, the unique index on data_sha256 catches any mistake.
+            if db.sha_filter.might_contain(data_sha256):
+                existing = _get_by_data_sha256(connection, data_sha256)
+                if existing:
+                    logging.info("Already have %s" % data_sha256)
+                    return False
+
+            try:
+                submission_offset = reserve_submission_offsets(connection, mbid)
+                ll_id = _insert_lowlevel(connection, mbid, build_sha1, is_lossless_submit, is_mbid, submission_offset)
+                version_id = insert_version(connection, version, VERSION_TYPE_LOWLEVEL)
+                _insert_lowlevel_json(connection, ll_id, data_json, data_sha256, version_id)
+                _add_highlevel_pending(connection, [ll_id])
+                logging.info("Saved %s" % mbid)
+            except sqlalchemy.exc.DataError as e:
+                raise db.exceptions.BadDataException(
+                    "data is badly formed")
+    except sqlalchemy.exc.IntegrityError as e:
+        if not _is_duplicate_data_sha256_error(e):
+            raise
+        logging.info("Already have %s" % data_sha256)
+        return False
+    db.sha_filter.add(data_sha256)
+    db.document_cache.delete_lowlevel_misses([(mbid, submission_offset)])
+    return True
 
+
+def _add_highlevel_pending(connection, ll_ids):
+    """Add new low-level submissions to the queue of the high-level extractor."""
+    query = text("""
+        INSERT INTO highlevel_pending (id)
+             SELECT unnest(CAST(:ids AS integer[]))
+        ON CONFLICT DO NOTHING
+    """)
+    connection.execute(query, {"ids": ll_ids})
+
+
+def _get_codec_and_bit_rate(data):
+    """Get the codec and bit rate of a low-level document, which are also stored in the
+    `lowlevel` table. Values which are missing or of the wrong type are None."""
+    audio_properties = data['metadata']['audio_properties']
+    codec = audio_properties.get('codec')
+    if not isinstance(codec, basestring):
+        codec = None
+    bit_rate = audio_properties.get('bit_rate')
+    if isinstance(bit_rate, bool) or not isinstance(bit_rate, (int, long, float)) \
+            or not -2 ** 31 <= bit_rate < 2 ** 31:
+        bit_rate = None
+    else:
+        bit_rate = int(bit_rate)
+    return codec, bit_rate
+
+
+def _is_duplicate_data_sha256_error(e):
+    """Check if an IntegrityError was caused by inserting a lowlevel_json row with a data_sha256 that already exists."""
+    diag = getattr(e.orig, "diag", None)
+    return diag is not None and diag.constraint_name == LOWLEVEL_JSON_SHA256_INDEX
+
+
+def write_many_low_level(submissions, gid_type):
+    """Write many validated low-level submissions in a single transaction.
+
+    Instead of running the queries of :func:`write_low_level` once for each
+    submission, duplicates are looked up, submission offsets are computed and
+    rows are inserted into `lowlevel` and `lowlevel_json` with one query each
+    for the whole batch. A version is only inserted once for each distinct
+    version block in the batch.
+
+    If the database rejects the batch because one of the documents is badly
+    formed, each submission is written on its own so that the other
+    submissions in the batch can still be saved.
+
+    Args:
+        submissions: A list of (mbid, data) tuples. The data must already have
+            been checked with :func:`validate_low_level_data`. If the data has also
+            been serialized, the items can be (mbid, data, (data_json, data_sha256))
+            tuples instead, as returned by :func:`prepare_low_level_data`.
+        gid_type: the ID type [musicbrainzid(mbid) or messybrainzid(msid)]
+
+    Returns:
+        A list with one dictionary per submission, in the same order as `submissions`:
+            {"mbid": mbid, "status": status}
+        where status is SUBMISSION_STATUS_OK if the submission was saved, or
+        SUBMISSION_STATUS_DUPLICATE if the exact same document already exists.
+        Submissions which are rejected by the database have the status
+        SUBMISSION_STATUS_ERROR and a "message" key.
+    """
+    documents = []
+    for submission in submissions:
+        mbid, data = submission[:2]
+        data_json, data_sha256 = submission[2] if len(submission) > 2 else serialize_low_level_data(data)
+        documents.append((str(mbid).lower(), data, data_json, data_sha256))
+
+    statuses = [{"mbid": mbid, "status": SUBMISSION_STATUS_DUPLICATE} for mbid, _, _, _ in documents]
+
+    try:
+        with db.begin() as connection:
+            existing = _get_existing_data_sha256(
+                connection, [d[3] for d in documents if db.sha_filter.might_contain(d[3])])
+
+            # Only the first copy of a document which is submitted more than once in the batch is written
+            to_write = []
+            for i, document in enumerate(documents):
+                if document[3] in existing:
+                    continue
+                existing.add(document[3])
+                to_write.append(i)
+            if not to_write:
+                return statuses
+
+            counts = defaultdict(int)
+            for i in to_write:
+                counts[documents[i][0]] += 1
+            next_offsets = reserve_many_submission_offsets(connection, counts)
+            offsets = []
+            for i in to_write:
+                mbid = documents[i][0]
+                offsets.append(next_offsets[mbid])
+                next_offsets[mbid] += 1
+
+            version_ids = {}
+            for i in to_write:
+                version = documents[i][1]['metadata']['version']
+                version_key = json.dumps(version, sort_keys=True)
+                if version_key not in version_ids:
+                    version_ids[version_key] = insert_version(connection, version, VERSION_TYPE_LOWLEVEL)
+
+            codecs_bit_rates = [_get_codec_and_bit_rate(documents[i][1]) for i in to_write]
+            ll_query = text("""
+                INSERT INTO lowlevel (gid, build_sha1, lossless, gid_type, submission_offset, codec, bit_rate)
+                     SELECT gid, build_sha1, lossless, :gid_type, submission_offset, codec, bit_rate
+                       FROM unnest(CAST(:gids AS uuid[]), CAST(:build_sha1s AS text[]),
+                                   CAST(:losslesses AS boolean[]), CAST(:offsets AS integer[]),
+                                   CAST(:codecs AS text[]), CAST(:bit_rates AS integer[]))
+                         AS t(gid, build_sha1, lossless, submission_offset, codec, bit_rate)
+                  RETURNING id, gid::text, submission_offset
+            """)
+            result = connection.execute(ll_query, {
+                "gid_type": gid_type,
+                "gids": [documents[i][0] for i in to_write],
+                "build_sha1s": [documents[i][1]['metadata']['version']['essentia_build_sha'] for i in to_write],
+                "losslesses": [documents[i][1]['metadata']['audio_properties']['lossless'] for i in to_write],
+                "offsets": offsets,
+                "codecs": [codec for codec, _ in codecs_bit_rates],
+                "bit_rates": [bit_rate for _, bit_rate in codecs_bit_rates],
+            })
+            ll_ids = {(row["gid"], row["submission_offset"]): row["id"] for row in result.fetchall()}
+
+            llj_query = text("""
+                INSERT INTO lowlevel_json (id, data, data_sha256, version)
+                     SELECT id, data, data_sha256, version
+                       FROM unnest(CAST(:ids AS integer[]), CAST(:datas AS jsonb[]),
+                                   CAST(:data_sha256s AS text[]), CAST(:versions AS integer[]))
+                         AS t(id, data, data_sha256, version)
+            """)
+            connection.execute(llj_query, {
+                "ids": [ll_ids[(documents[i][0], offset)] for i, offset in zip(to_write, offsets)],
+                "datas": [documents[i][2] for i in to_write],
+                "data_sha256s": [documents[i][3] for i in to_write],
+                "versions": [version_ids[json.dumps(documents[i][1]['metadata']['version'], sort_keys=True)]
+                             for i in to_write],
+            })
+            _add_highlevel_pending(connection, list(ll_ids.values()))
+    except sqlalchemy.exc.DataError:
+        # One or more of the documents can't be stored, write them one at a time
+        # to find out which ones
+        return _write_many_low_level_individually(submissions, gid_type)
+    except sqlalchemy.exc.IntegrityError as e:
+        # One of the documents was already in the database but not in the sha256 filter
+        if not _is_duplicate_data_sha256_error(e):
+            raise
+        return _write_many_low_level_individually(submissions, gid_type)
+
+    for i in to_write:
+        statuses[i]["status"] = SUBMISSION_STATUS_OK
+        db.sha_filter.add(documents[i][3])
+    db.document_cache.delete_lowlevel_misses([(documents[i][0], offset) for i, offset in zip(to_write, offsets)])
+    logging.info("Saved %d of %d submissions" % (len(to_write), len(documents)))
+    return statuses
+
+
+def _write_many_low_level_individually(submissions, gid_type):
+    """Write each submission with :func:`write_low_level`, returning a status for each
+    in the format of :func:`write_many_low_level`."""
+    statuses = []
+    for submission in submissions:
+        mbid = str(submission[0]).lower()
+        serialized = submission[2] if len(submission) > 2 else None
         try:
-            submission_offset = get_next_submission_offset(connection, mbid)
-            ll_id = _insert_lowlevel(connection, mbid, build_sha1, is_lossless_submit, is_mbid, submission_offset)
-            version_id = insert_version(connection, version, VERSION_TYPE_LOWLEVEL)
-            _insert_lowlevel_json(connection, ll_id, data_json, data_sha256, version_id)
-            logging.info("Saved %s" % mbid)
-        except sqlalchemy.exc.DataError as e:
-            raise db.exceptions.BadDataException(
-                "data is badly formed")
+            if write_low_level(mbid, submission[1], gid_type, serialized):
+                statuses.append({"mbid": mbid, "status": SUBMISSION_STATUS_OK})
+            else:
+                statuses.append({"mbid": mbid, "status": SUBMISSION_STATUS_DUPLICATE})
+        except db.exceptions.BadDataException as e:
+            statuses.append({"mbid": mbid, "status": SUBMISSION_STATUS_ERROR, "message": str(e)})
+    return statuses
+
+
+def _get_existing_data_sha256(connection, data_sha256s):
+    """Return the set of the given lowlevel_json data hashes which are already in the database."""
+    if not data_sha256s:
+        return set()
+    query = text("""
+        SELECT data_sha256
+          FROM lowlevel_json
+         WHERE data_sha256 IN :data_sha256s
+    """)
+    result = connection.execute(query, {"data_sha256s": tuple(data_sha256s)})
+    return set(row["data_sha256"] for row in result.fetchall())
 
 
 def get_next_submission_offset(connection, mbid):
-    """Get highest existing submission offset for mbid, then increment.
+    """Get the offset that the next submission for an mbid will have, without reserving it.
     If the mbid doesn't exist in the database, return an offset of 0"""
+    query = text("""
+        SELECT next_offset
+          FROM submission_offset_counter
+         WHERE gid = :mbid
+    """)
+    row = connection.execute(query, {"mbid": mbid}).fetchone()
+    if row:
+        return row["next_offset"]
+
     query = text("""
         SELECT MAX(submission_offset) as max_offset
           FROM lowlevel
@@ -280,10 +816,107 @@ def get_next_submission_offset(connection, mbid):
         return 0
 
 
+def reserve_submission_offsets(connection, mbid, count=1):
+    """Reserve `count` consecutive submission offsets for an mbid.
+
+    Offsets are allocated from the per-mbid counter in `submission_offset_counter`,
+    whose row is locked until the transaction of `connection` ends, so concurrent
+    submissions for the same mbid never get the same offset. If the transaction is
+    rolled back, the offsets are released again.
+
+    Returns:
+        the first reserved offset. The reserved offsets are first_offset .. first_offset + count - 1
+    """
+    query = text("""
+        UPDATE submission_offset_counter
+           SET next_offset = next_offset + :count
+         WHERE gid = :mbid
+     RETURNING next_offset - :count AS first_offset
+    """)
+    row = connection.execute(query, {"mbid": mbid, "count": count}).fetchone()
+    if row:
+        return row["first_offset"]
+
+    # The first submission for this mbid since the counter was introduced. Start the
+    # counter after any existing submissions. If another transaction creates the counter
+    # at the same time, we increment theirs instead.
+    query = text("""
+        INSERT INTO submission_offset_counter (gid, next_offset)
+             SELECT :mbid, COALESCE(MAX(submission_offset) + 1, 0) + :count
+               FROM lowlevel
+              WHERE gid = :mbid
+        ON CONFLICT (gid)
+          DO UPDATE SET next_offset = submission_offset_counter.next_offset + :count
+          RETURNING next_offset - :count AS first_offset
+    """)
+    return connection.execute(query, {"mbid": mbid, "count": count}).fetchone()["first_offset"]
+
+
+def reserve_many_submission_offsets(connection, counts):
+    """Reserve submission offsets for many mbids at once.
+
+    This is the same as calling :func:`reserve_submission_offsets` for each mbid,
+    but uses three queries for the whole set of mbids. Counters are created and
+    locked in the order of their mbids, so that concurrent transactions which
+    reserve offsets for overlapping sets of mbids don't deadlock.
+
+    Args:
+        counts: a dictionary {mbid: number of offsets to reserve}
+
+    Returns:
+        a dictionary {mbid: first reserved offset}
+    """
+    mbids = sorted(counts.keys())
+    params = {"mbids": mbids, "counts": [counts[mbid] for mbid in mbids]}
+
+    # Create counters for mbids that don't have one yet, starting after any existing submissions
+    query = text("""
+        INSERT INTO submission_offset_counter (gid, next_offset)
+             SELECT t.gid
+                  , COALESCE((SELECT MAX(submission_offset) + 1
+                                FROM lowlevel
+                               WHERE gid = t.gid), 0)
+               FROM unnest(CAST(:mbids AS uuid[])) AS t(gid)
+              WHERE NOT EXISTS (SELECT 1
+                                  FROM submission_offset_counter c
+                                 WHERE c.gid = t.gid)
+           ORDER BY t.gid
+        ON CONFLICT (gid) DO NOTHING
+    """)
+    connection.execute(query, params)
+
+    query = text("""
+        SELECT gid
+          FROM submission_offset_counter
+         WHERE gid = ANY(CAST(:mbids AS uuid[]))
+      ORDER BY gid
+           FOR UPDATE
+    """)
+    connection.execute(query, params)
+
+    query = text("""
+        UPDATE submission_offset_counter c
+           SET next_offset = c.next_offset + t.count
+          FROM unnest(CAST(:mbids AS uuid[]), CAST(:counts AS integer[])) AS t(gid, count)
+         WHERE c.gid = t.gid
+     RETURNING c.gid::text
+             , c.next_offset - t.count AS first_offset
+    """)
+    result = connection.execute(query, params)
+    return {row["gid"]: row["first_offset"] for row in result.fetchall()}
+
+
+def _invalidate_models():
+    # Only called once the change is committed (the caller may be in an outer
+    # transaction), so that other processes don't reload the old models
+    db.model_registry.invalidate()
+    db.document_cache.invalidate_models()
+
+
 def add_model(model_name, model_version, model_status=STATUS_HIDDEN):
     if model_status not in MODEL_STATUSES:
         raise Exception("model_status must be one of %s" % ",".join(MODEL_STATUSES))
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         query = text(
             """INSERT INTO model (model, model_version, status)
                     VALUES (:model_name, :model_version, :model_status)
@@ -293,38 +926,35 @@ def add_model(model_name, model_version, model_status=STATUS_HIDDEN):
                                     {"model_name": model_name,
                                      "model_version": model_version,
                                      "model_status": model_status})
-        return result.fetchone()[0]
+        model_id = result.fetchone()[0]
+        db.after_commit(connection, _invalidate_models)
+    return model_id
 
 
 def set_model_status(model_name, model_version, model_status):
     if model_status not in MODEL_STATUSES:
         raise Exception("model_status must be one of %s" % ",".join(MODEL_STATUSES))
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         query = text(
             """UPDATE model
                   SET status = :model_status
-                WHERE model_name = :model_name
+                WHERE model = :model_name
                   AND model_version = :model_version"""
         )
         connection.execute(query,
                            {"model_name": model_name,
                             "model_version": model_version,
                             "model_status": model_status})
+        db.after_commit(connection, _invalidate_models)
 
 
 def get_active_models():
-    with db.engine.begin() as connection:
-        query = text(
-            """SELECT *
-                 FROM model
-                WHERE status = :model_status""")
-        result = connection.execute(query,
-                                    {"model_status": STATUS_SHOW})
-        return [dict(row) for row in result.fetchall()]
+    """Get the models with the status `show`, from the model registry (see :mod:`db.model_registry`)."""
+    return db.model_registry.get_active_models()
 
 
 def _get_model_id(model_name, version):
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         query = text(
             """SELECT id
                  FROM model
@@ -357,6 +987,9 @@ def write_high_level_item(connection, model_name, model_version, ll_id, version_
                         "data_sha256": item_sha, "model": model_id,
                         "version": version_id})
 
+    # The materialised document of this submission no longer has all of its models
+    connection.execute(text("DELETE FROM highlevel_document WHERE id = :id"), {"id": ll_id})
+
 
 def write_high_level_meta(connection, ll_id, mbid, build_sha1, json_meta):
     check_query = text(
@@ -382,23 +1015,37 @@ def write_high_level_meta(connection, ll_id, mbid, build_sha1, json_meta):
         connection.execute(hl_meta, {"id": ll_id, "data": meta_norm_data, "data_sha256": sha})
 
 
-def write_high_level(mbid, ll_id, data, build_sha1):
+def write_high_level(mbid, ll_id, data, build_sha1, worker=None):
     """Write highlevel data to the database.
 
     This includes entries in the
       highlevel
       version
       highlevel_model
+      highlevel_document
     tables. If the exact version already exists it will be reused.
 
     If `data` is an empty dictionary, a highlevel table entry is still recorded
     so that this submission is no longer processed by the highlevel runner
+
+    Args:
+        worker: if set, the data of a high-level extractor which claimed the submission,
+            see :func:`claim_highlevel_documents`. It is not written if another worker
+            has the lease of the submission now, or if its models were already written.
+
+    Returns:
+        True if the data was written, False if it was skipped
     """
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
+        if worker is not None and not _can_write_high_level(connection, ll_id, worker):
+            return False
+
         json_meta = data.get("metadata", {})
         json_high = data.get("highlevel", {})
 
         write_high_level_meta(connection, ll_id, mbid, build_sha1, json_meta)
+        connection.execute(text("DELETE FROM highlevel_lease WHERE id = :id"), {"id": ll_id})
+        connection.execute(text("DELETE FROM highlevel_pending WHERE id = :id"), {"id": ll_id})
 
         if json_meta and json_high:
             hl_version = json_meta["version"]["highlevel"]
@@ -408,8 +1055,193 @@ def write_high_level(mbid, ll_id, data, build_sha1):
             for model_name, data in json_high.items():
                 write_high_level_item(connection, model_name, model_version, ll_id, version_id, data)
 
+            write_high_level_documents(connection, [ll_id])
+
+        if db.document_cache.is_enabled():
+            offset_query = text("""
+                SELECT submission_offset
+                  FROM lowlevel
+                 WHERE id = :id
+            """)
+            submission_offset = connection.execute(offset_query, {"id": ll_id}).fetchone()[0]
+
+    if db.document_cache.is_enabled():
+        # A new model may have been added to a document that is already cached
+        db.document_cache.delete_highlevel(mbid, submission_offset)
+    return True
+
+
+def _can_write_high_level(connection, ll_id, worker):
+    """Check if a worker can write the high-level data of a submission that it claimed.
+
+    The lease of the submission is locked until the end of the transaction, so
+    another worker can't claim it in the meantime.
+    """
+    lease_query = text("""
+        SELECT worker
+          FROM highlevel_lease
+         WHERE id = :id
+           FOR UPDATE
+    """)
+    row = connection.execute(lease_query, {"id": ll_id}).fetchone()
+    if row is not None and row["worker"] != worker:
+        return False
+    # A worker whose lease expired may have written its data before the lease was claimed again
+    model_query = text("""
+        SELECT 1
+          FROM highlevel_model
+         WHERE highlevel = :id
+         LIMIT 1
+    """)
+    return connection.execute(model_query, {"id": ll_id}).fetchone() is None
+
+
+def write_high_level_documents(connection, hlids):
+    """Write the materialised high-level documents of submissions.
+
+    The document of a submission is put together from its metadata and the
+    data and version of each active model (without class mapping, which is
+    done when the document is loaded), and stored in the `highlevel_document`
+    table with the current model state (see :func:`db.model_registry.get_model_state`).
+    A document is only used while the model state is the same, so documents
+    must be written again after the status of a model changes, see
+    `manage.py highlevel rebuild_documents`.
+
+    Args:
+        connection: a database connection
+        hlids: the ids of the high-level submissions to write
+
+    Returns:
+        the number of documents which were written
+    """
+    if not hlids:
+        return 0
+    models = db.model_registry.get_active_models_by_id()
+    query = text("""
+        INSERT INTO highlevel_document (id, data, model_state)
+             SELECT hl.id
+                  , jsonb_build_object('metadata', hlm.data,
+                                       'highlevel', COALESCE(models.highlevel, '{}'::jsonb))
+                  , :model_state
+               FROM highlevel hl
+               JOIN highlevel_meta hlm
+                 ON hl.id = hlm.id
+          LEFT JOIN LATERAL (
+                     SELECT jsonb_object_agg(m.model, hlmo.data || jsonb_build_object('version', v.data))
+                            AS highlevel
+                       FROM highlevel_model hlmo
+                       JOIN model m
+                         ON m.id = hlmo.model
+                       JOIN version v
+                         ON v.id = hlmo.version
+                      WHERE hlmo.highlevel = hl.id
+                        AND hlmo.model = ANY(CAST(:model_ids AS integer[]))
+                    ) models
+                 ON TRUE
+              WHERE hl.id IN :hlids
+        ON CONFLICT (id)
+          DO UPDATE SET data = EXCLUDED.data
+                      , model_state = EXCLUDED.model_state
+                      , updated = NOW()
+    """)
+    result = connection.execute(query, {"hlids": tuple(hlids),
+                                        "model_ids": list(models.keys()),
+                                        "model_state": db.model_registry.get_model_state()})
+    return result.rowcount
+
+
+def get_stale_high_level_document_ids(after=0, limit=1000):
+    """Get ids of high-level submissions which have no up-to-date materialised document.
+
+    Args:
+        after: only return ids greater than this
+        limit: the maximum number of ids to return
+
+    Returns:
+        a list of ids, in ascending order
+    """
+    with db.connect() as connection:
+        query = text("""
+            SELECT hl.id
+              FROM highlevel hl
+              JOIN highlevel_meta hlm
+                ON hl.id = hlm.id
+         LEFT JOIN highlevel_document hld
+                ON hl.id = hld.id
+             WHERE hl.id > :after
+               AND (hld.id IS NULL OR hld.model_state != :model_state)
+          ORDER BY hl.id
+             LIMIT :limit
+        """)
+        result = connection.execute(query, {"after": after, "limit": limit,
+                                            "model_state": db.model_registry.get_model_state()})
+        return [row["id"] for row in result.fetchall()]
+
+
+def rebuild_high_level_documents(batch_size=HIGH_LEVEL_DOCUMENT_BATCH_SIZE):
+    """Write the materialised high-level documents which are missing or not up to date.
+
+    Documents are written in batches, each in its own transaction, so this can be
+    run while submissions are being processed.
 
-def load_low_level(mbid, offset=0):
+    Args:
+        batch_size: the number of documents to write in each transaction
+
+    Yields:
+        the number of documents written in each batch
+    """
+    after = 0
+    while True:
+        hlids = get_stale_high_level_document_ids(after, batch_size)
+        if not hlids:
+            return
+        with db.begin() as connection:
+            count = write_high_level_documents(connection, hlids)
+        after = hlids[-1]
+        yield count
+
+
+def _get_high_level_documents(connection, recordings, data_column):
+    """Get the materialised high-level documents of recordings which are up to date.
+
+    Args:
+        connection: a database connection
+        recordings: A list of tuples (mbid, offset).
+        data_column: an SQL expression for the `data` column of the returned rows
+
+    Returns:
+        a dictionary {(mbid, offset): data}
+    """
+    query = text("""
+        SELECT ll.gid::text
+             , ll.submission_offset
+             , %s AS data
+          FROM lowlevel ll
+          JOIN highlevel_document hld
+            ON ll.id = hld.id
+         WHERE (ll.gid, ll.submission_offset)
+            IN :recordings
+           AND hld.model_state = :model_state
+    """ % data_column)
+    result = connection.execute(query, {"recordings": tuple(recordings),
+                                        "model_state": db.model_registry.get_model_state()})
+    return {(row["gid"], row["submission_offset"]): row["data"] for row in result.fetchall()}
+
+
+# Low-level documents as serialised JSON, for a tuple of (gid, submission_offset) tuples
+_LOW_LEVEL_JSON_QUERY = text("""
+    SELECT ll.gid::text,
+           ll.submission_offset,
+           llj.data::text,
+           llj.data_sha256
+      FROM lowlevel ll
+      JOIN lowlevel_json llj
+        ON ll.id = llj.id
+     WHERE (ll.gid, ll.submission_offset)
+        IN :recordings
+""")
+
+def load_low_level(mbid, offset=0, features=None):
     """Load lowlevel data with the given mbid as a dictionary.
     If no offset is given, return the first. If an offset is
     given (from 0), return the relevent item.
@@ -417,24 +1249,30 @@ def load_low_level(mbid, offset=0):
     Arguments:
         mbid (str): MBID to load
         offset (int): submission offset for this MBID, starting from 0
+        features (Optional[list]): only return these parts of the document, see :func:`load_many_low_level`
 
     Raises:
         NoDataFoundException: if this mbid doesn't exist or the offset is too high"""
 
     # in case it's a uuid
     mbid = str(mbid).lower()
-    result = load_many_low_level([(mbid, offset)])
+    result = load_many_low_level([(mbid, offset)], features)
     if not result:
         raise db.exceptions.NoDataFoundException
 
     return result[mbid][str(offset)]
 
 
-def load_many_low_level(recordings):
+def load_many_low_level(recordings, features=None):
     """Collect low-level JSON data for multiple recordings.
 
     Args:
         recordings: A list of tuples (mbid, offset).
+        features: If set, a list of paths in the document to return instead of the whole
+            document. Each path is a list of keys, for example ["rhythm", "bpm"]. The selection
+            is done in the database, so only the requested parts of the document are read.
+            Paths which don't exist in a document are left out. Keys must not be numbers,
+            selecting an item of a list isn't supported.
 
     Returns:
         A dictionary of mbids containing a dictionary of offsets. If an (mbid, offset) doesn't exist
@@ -447,26 +1285,185 @@ def load_many_low_level(recordings):
          "mbid-n": {"offset-1": lowlevel_data}
         }
 
+    Documents are read from the document cache if possible (see :mod:`db.document_cache`),
+    and documents which are loaded from the database are added to it.
+    """
+    if not features:
+        return {mbid: {offset: json.loads(data_json) for offset, data_json in documents.items()}
+                for mbid, documents in load_many_low_level_json(recordings).items()}
+
+    features = _remove_overlapping_features(features)
+    recordings_info = defaultdict(dict)
+    cached = db.document_cache.get_many_lowlevel(recordings)
+    for (mbid, offset), data_json in cached.items():
+        recordings_info[str(mbid).lower()][str(offset)] = _project_features(json.loads(data_json), features)
+    misses = db.document_cache.get_lowlevel_misses([recording for recording in recordings
+                                                    if recording not in cached])
+    recordings = [recording for recording in recordings if recording not in cached and recording not in misses]
+    if not recordings:
+        return dict(recordings_info)
+
+    for mbid, documents in _load_many_low_level_features(recordings, features).items():
+        recordings_info[mbid].update(documents)
+    return dict(recordings_info)
+
+
+def load_low_level_json(mbid, offset=0):
+    """Load a low-level document as serialised JSON, see :func:`load_low_level`.
+
+    Raises:
+        NoDataFoundException: if this mbid doesn't exist or the offset is too high
+    """
+    mbid = str(mbid).lower()
+    result = load_many_low_level_json([(mbid, offset)])
+    if not result:
+        raise db.exceptions.NoDataFoundException
+
+    return result[mbid][str(offset)]
+
+
+def load_low_level_json_by_id(ll_id):
+    """Load a low-level document as serialised JSON by the id of its submission.
+
+    Raises:
+        NoDataFoundException: if there is no submission with this id
+    """
+    with db.connect() as connection:
+        result = connection.execute(text("SELECT data::text FROM lowlevel_json WHERE id = :id"), {"id": ll_id})
+        row = result.fetchone()
+    if not row:
+        raise db.exceptions.NoDataFoundException
+    return row[0]
+
+
+def load_many_low_level_json(recordings):
+    """Collect low-level documents for multiple recordings as serialised JSON.
+
+    This is the same as :func:`load_many_low_level`, but the documents are
+    returned as they are stored (the text of the jsonb column, or the text
+    in the document cache) instead of being decoded.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+
+    Returns:
+        {"mbid-1": {"offset-1": "lowlevel json", ...}, ...}
+    """
+    recordings_info = defaultdict(dict)
+    cached = db.document_cache.get_many_lowlevel(recordings)
+    for (mbid, offset), data_json in cached.items():
+        recordings_info[str(mbid).lower()][str(offset)] = data_json
+    recordings = [recording for recording in recordings if recording not in cached]
+    generations = db.document_cache.get_lowlevel_generations(recordings)
+    misses = db.document_cache.get_lowlevel_misses(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in misses]
+    if not recordings:
+        return dict(recordings_info)
+
+    # Identical lookups which run at the same time share one query
+    loaded = db.single_flight.do(("ll", tuple(sorted(recordings))),
+                                 lambda: _load_and_cache_many_low_level_json(recordings, generations))
+    for (gid, submission_offset), data_json in loaded.items():
+        recordings_info[gid][str(submission_offset)] = data_json
+    return dict(recordings_info)
+
+
+def _load_and_cache_many_low_level_json(recordings, generations):
+    """Load low-level documents from the database and add them, and the
+    recordings which were not found, to the document cache.
+
+    Args:
+        generations: the generations of the recordings in the cache, see
+            :func:`db.document_cache.get_lowlevel_generations`
+
+    Returns:
+        a dictionary {(mbid, offset): serialised document}
+    """
+    with db.connect() as connection:
+        result = connection.execute(_LOW_LEVEL_JSON_QUERY, {'recordings': tuple(recordings)})
+        rows = result.fetchall()
+    loaded = {(row['gid'], row['submission_offset']): row['data'] for row in rows}
+
+    db.document_cache.set_many_lowlevel(loaded)
+    db.document_cache.set_many_lowlevel_sha256({(row['gid'], row['submission_offset']): row['data_sha256']
+                                                for row in rows})
+    db.document_cache.set_lowlevel_misses(_get_missing_recordings(recordings, loaded), generations)
+    return loaded
+
+
+def _get_missing_recordings(recordings, loaded):
+    """Get the recordings which are not in a dictionary {(mbid, offset): document} of loaded documents."""
+    return [(mbid, offset) for mbid, offset in recordings if (str(mbid).lower(), int(offset)) not in loaded]
+
+
+def _load_many_low_level_features(recordings, features):
+    """Load parts of low-level documents, see :func:`load_many_low_level`.
+
+    Each path is selected with the jsonb #> operator, so the rest of the document is not
+    sent from the database. The selected values are then put together into a document
+    with the same structure as the original.
     """
-    with db.engine.connect() as connection:
+    columns = []
+    params = {'recordings': tuple(recordings)}
+    for i, path in enumerate(features):
+        columns.append("llj.data #> CAST(:feature_%d AS text[]) AS feature_%d" % (i, i))
+        params["feature_%d" % i] = list(path)
+
+    with db.connect() as connection:
         query = text("""
             SELECT ll.gid::text,
                    ll.submission_offset::text,
-                   llj.data
+                   %s
               FROM lowlevel ll
               JOIN lowlevel_json llj
                 ON ll.id = llj.id
-             WHERE (ll.gid, ll.submission_offset) 
+             WHERE (ll.gid, ll.submission_offset)
                 IN :recordings
-        """)
-
-        result = connection.execute(query, {'recordings': tuple(recordings)})
+        """ % ",\n                   ".join(columns))
+        result = connection.execute(query, params)
 
         recordings_info = defaultdict(dict)
         for row in result.fetchall():
-            recordings_info[row['gid']][row['submission_offset']] = row['data']
-
-        return dict(recordings_info)
+            data = {}
+            for i, path in enumerate(features):
+                value = row["feature_%d" % i]
+                if value is not None:
+                    _set_path(data, path, value)
+            recordings_info[row['gid']][row['submission_offset']] = data
+        return recordings_info
+
+
+def _remove_overlapping_features(features):
+    """Remove paths which are inside another path in the list, keeping the order of the rest."""
+    features = [tuple(path) for path in features]
+    paths = set(features)
+    kept = []
+    for path in features:
+        if path in kept or any(path[:i] in paths for i in range(1, len(path))):
+            continue
+        kept.append(path)
+    return kept
+
+
+def _project_features(data, features):
+    """Select the given paths from a document, in the same way as :func:`_load_many_low_level_features`."""
+    projected = {}
+    for path in features:
+        value = data
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                break
+        if value is not None:
+            _set_path(projected, path, value)
+    return projected
+
+
+def _set_path(data, path, value):
+    """Set data[path[0]][path[1]]... to value, creating dictionaries as needed."""
+    for key in path[:-1]:
+        data = data.setdefault(key, {})
+    data[path[-1]] = value
 
 
 def map_highlevel_class_names(highlevel, mapping):
@@ -526,76 +1523,387 @@ def load_many_high_level(recordings, map_classes=False):
          "mbid-n": {"offset-1": {"metadata-1": metadata, "highlevel-1": highlevel}}
         }
 
+    Documents are read from the document cache if possible (see :mod:`db.document_cache`),
+    and documents which are loaded from the database are added to it.
     """
-    with db.engine.connect() as connection:
-        # Metadata
-        meta_query = text("""
-            SELECT hl.id
-                 , hlm.data
-                 , ll.gid::text
-                 , ll.submission_offset::text
-              FROM highlevel hl
-              JOIN highlevel_meta hlm
-                ON hl.id = hlm.id
-              JOIN lowlevel ll
-                ON ll.id = hl.id
+    recordings_info = defaultdict(dict)
+    generations = db.document_cache.get_highlevel_generations(recordings)
+    cached = db.document_cache.get_many_highlevel(recordings, map_classes, generations)
+    for (mbid, offset), data_json in cached.items():
+        recordings_info[str(mbid).lower()][str(offset)] = json.loads(data_json)
+    misses = db.document_cache.get_highlevel_misses(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in cached and recording not in misses]
+    if not recordings:
+        return dict(recordings_info)
+
+    documents = _load_many_high_level_documents(recordings, map_classes)
+    for (gid, submission_offset), document in documents.items():
+        recordings_info[gid][str(submission_offset)] = document
+
+    db.document_cache.set_many_highlevel({key: json.dumps(document) for key, document in documents.items()},
+                                         map_classes, generations)
+    db.document_cache.set_highlevel_misses(_get_missing_recordings(recordings, documents), generations)
+    return dict(recordings_info)
+
+
+def _load_many_high_level_documents(recordings, map_classes):
+    """Load high-level documents from the database, without the document cache.
+
+    Returns:
+        a dictionary {(mbid, offset): document}
+    """
+    with db.connect() as connection:
+        documents = _get_high_level_documents(connection, recordings, "hld.data")
+        missing = [recording for recording in recordings if recording not in documents]
+        if missing:
+            documents.update(_assemble_many_high_level(connection, missing))
+
+    if map_classes:
+        mappings = {model['model']: model['class_mapping']
+                    for model in db.model_registry.get_active_models_by_id().values() if model['class_mapping']}
+        for document in documents.values():
+            for model_name, data in document['highlevel'].items():
+                if model_name in mappings:
+                    map_highlevel_class_names(data, mappings[model_name])
+    return documents
+
+
+def _assemble_many_high_level(connection, recordings):
+    """Put high-level documents together from their metadata and the data of each active model.
+
+    This is used for submissions which have no up-to-date materialised document,
+    see :func:`write_high_level_documents`. Class names are not mapped.
+
+    Returns:
+        a dictionary {(mbid, offset): document}
+    """
+    meta_query = text("""
+        SELECT hl.id
+             , hlm.data
+             , ll.gid::text
+             , ll.submission_offset
+          FROM highlevel hl
+          JOIN highlevel_meta hlm
+            ON hl.id = hlm.id
+          JOIN lowlevel ll
+            ON ll.id = hl.id
+         WHERE (ll.gid, ll.submission_offset)
+            IN :recordings
+    """)
+    meta_rows = connection.execute(meta_query, {'recordings': tuple(recordings)}).fetchall()
+
+    documents = {}
+    by_id = {}
+    for row in meta_rows:
+        document = {'metadata': row['data'], 'highlevel': {}}
+        documents[(row['gid'], row['submission_offset'])] = document
+        by_id[row['id']] = document
+
+    # Model data. Model names and versions are read from the model registry
+    models = db.model_registry.get_active_models_by_id()
+    model_rows = _get_high_level_model_rows(connection, list(by_id.keys()), models, "data")
+    versions = db.model_registry.get_versions(row['version'] for row in model_rows)
+    for row in model_rows:
+        data = row['data']
+        data['version'] = json.loads(versions[row['version']])
+        by_id[row['highlevel']]['highlevel'][models[row['model']]['model']] = data
+    return documents
+
+
+def _get_high_level_model_rows(connection, hlids, models, data_column):
+    """Get the rows of highlevel_model for the given models of high-level documents.
+
+    Args:
+        connection: a database connection
+        hlids: the ids of the high-level documents
+        models: a dictionary {model id: model row} of the models to get
+        data_column: an SQL expression for the `data` column of the returned rows
+
+    Returns:
+        a list of rows with the columns highlevel, model, version and data
+    """
+    if not hlids or not models:
+        return []
+    query = text("""
+        SELECT highlevel
+             , model
+             , version
+             , %s AS data
+          FROM highlevel_model
+         WHERE highlevel IN :hlids
+           AND model = ANY(CAST(:model_ids AS integer[]))
+    """ % data_column)
+    return connection.execute(query, {'hlids': tuple(hlids), 'model_ids': list(models.keys())}).fetchall()
+
+
+def _load_many_high_level_json(connection, recordings):
+    """Load high-level documents from the database without decoding them.
+
+    Materialised documents are used if they are up to date. Other documents are
+    put together from the serialised metadata, model data and versions, see
+    :func:`load_many_high_level`.
+
+    Returns:
+        a dictionary {(mbid, offset): serialised document}
+    """
+    documents = _get_high_level_documents(connection, recordings, "hld.data::text")
+    missing = [recording for recording in recordings if recording not in documents]
+    if missing:
+        documents.update(_assemble_many_high_level_json(connection, missing))
+    return documents
+
+
+def _assemble_many_high_level_json(connection, recordings):
+    """Put serialised high-level documents together, see :func:`_assemble_many_high_level`.
+
+    Returns:
+        a dictionary {(mbid, offset): serialised document}
+    """
+    meta_query = text("""
+        SELECT hl.id
+             , hlm.data::text
+             , ll.gid::text
+             , ll.submission_offset
+          FROM highlevel hl
+          JOIN highlevel_meta hlm
+            ON hl.id = hlm.id
+          JOIN lowlevel ll
+            ON ll.id = hl.id
+         WHERE (ll.gid, ll.submission_offset)
+            IN :recordings
+    """)
+    meta_rows = connection.execute(meta_query, {'recordings': tuple(recordings)}).fetchall()
+
+    models = db.model_registry.get_active_models_by_id()
+    # A version key in the model data is replaced with the version of the model
+    model_rows = _get_high_level_model_rows(connection, [row['id'] for row in meta_rows], models,
+                                            "(data - 'version')::text")
+    versions = db.model_registry.get_versions(row['version'] for row in model_rows)
+    highlevel = defaultdict(list)
+    for row in model_rows:
+        data_json = row['data']
+        version_json = versions[row['version']]
+        if data_json == '{}':
+            data_json = '{"version": %s}' % version_json
+        else:
+            data_json = '%s, "version": %s}' % (data_json[:-1], version_json)
+        highlevel[row['highlevel']].append('%s: %s' % (json.dumps(models[row['model']]['model']), data_json))
+
+    return {(row['gid'], row['submission_offset']):
+            '{"metadata": %s, "highlevel": {%s}}' % (row['data'], ', '.join(sorted(highlevel[row['id']])))
+            for row in meta_rows}
+
+
+def load_high_level_json(mbid, offset=0):
+    """Load a high-level document as serialised JSON, see :func:`load_high_level`.
+
+    Raises:
+        NoDataFoundException: if this mbid doesn't exist or the offset is too high
+    """
+    mbid = str(mbid).lower()
+    result = load_many_high_level_json([(mbid, offset)])
+    if not result:
+        raise db.exceptions.NoDataFoundException
+
+    return result[mbid][str(offset)]
+
+
+def load_many_high_level_json(recordings):
+    """Collect high-level documents for multiple recordings as serialised JSON.
+
+    This is the same as :func:`load_many_high_level` without class mapping, but
+    each document is put together from the serialised data in the database, so
+    the documents are never decoded.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+
+    Returns:
+        {"mbid-1": {"offset-1": "highlevel json", ...}, ...}
+    """
+    recordings_info = defaultdict(dict)
+    generations = db.document_cache.get_highlevel_generations(recordings)
+    cached = db.document_cache.get_many_highlevel(recordings, False, generations)
+    for (mbid, offset), data_json in cached.items():
+        recordings_info[str(mbid).lower()][str(offset)] = data_json
+    recordings = [recording for recording in recordings if recording not in cached]
+    misses = db.document_cache.get_highlevel_misses(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in misses]
+    if not recordings:
+        return dict(recordings_info)
+
+    # Identical lookups which run at the same time share one query
+    loaded = db.single_flight.do(("hl", tuple(sorted(recordings))),
+                                 lambda: _load_and_cache_many_high_level_json(recordings, generations))
+    for (gid, submission_offset), data_json in loaded.items():
+        recordings_info[gid][str(submission_offset)] = data_json
+    return dict(recordings_info)
+
+
+def _load_and_cache_many_high_level_json(recordings, generations):
+    """Load high-level documents from the database and add them, and the
+    recordings which were not found, to the document cache.
+
+    Args:
+        generations: the generations of the documents in the cache, see
+            :func:`db.document_cache.get_highlevel_generations`
+
+    Returns:
+        a dictionary {(mbid, offset): serialised document}
+    """
+    with db.connect() as connection:
+        loaded = _load_many_high_level_json(connection, recordings)
+    db.document_cache.set_many_highlevel(loaded, False, generations)
+    db.document_cache.set_highlevel_misses(_get_missing_recordings(recordings, loaded), generations)
+    return loaded
+
+
+def get_low_level_sha256(mbid, offset=0):
+    """Get the sha256 of a stored low-level document, without loading the document.
+
+    Raises:
+        NoDataFoundException: if this mbid doesn't exist or the offset is too high
+    """
+    mbid = str(mbid).lower()
+    result = get_many_low_level_sha256([(mbid, offset)])
+    if not result:
+        raise db.exceptions.NoDataFoundException
+
+    return result[(mbid, offset)]
+
+
+def get_many_low_level_sha256(recordings):
+    """Get the sha256 of stored low-level documents, without loading the documents.
+
+    The sha256 is read from the document cache if possible (see :mod:`db.document_cache`),
+    and only the recordings which are not in it and are not known to be missing are
+    looked up in the database.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+
+    Returns:
+        a dictionary {(mbid, offset): sha256} of the recordings which exist
+    """
+    recordings = [(str(mbid).lower(), int(offset)) for mbid, offset in recordings]
+    sha256s = db.document_cache.get_many_lowlevel_sha256(recordings)
+    recordings = [recording for recording in recordings if recording not in sha256s]
+    generations = db.document_cache.get_lowlevel_generations(recordings)
+    misses = db.document_cache.get_lowlevel_misses(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in misses]
+    if not recordings:
+        return sha256s
+
+    with db.connect() as connection:
+        query = text("""
+            SELECT ll.gid::text
+                 , ll.submission_offset
+                 , llj.data_sha256
+              FROM lowlevel ll
+              JOIN lowlevel_json llj
+                ON ll.id = llj.id
              WHERE (ll.gid, ll.submission_offset)
                 IN :recordings
         """)
+        result = connection.execute(query, {'recordings': tuple(recordings)})
+        loaded = {(row['gid'], row['submission_offset']): row['data_sha256'] for row in result.fetchall()}
+    db.document_cache.set_many_lowlevel_sha256(loaded)
+    db.document_cache.set_lowlevel_misses(_get_missing_recordings(recordings, loaded), generations)
+    sha256s.update(loaded)
+    return sha256s
 
-        meta_result = connection.execute(meta_query, {'recordings': tuple(recordings)})
-        # Return empty dictionary if no metadata is found
-        if not meta_result.rowcount:
-            return {}
 
-        hlids = []
-        recordings_info = defaultdict(dict)
-        for row in meta_result.fetchall():
-            hlids.append(row['id'])
-            gid = row['gid']
-            submission_offset = row['submission_offset']
-            recordings_info[gid][submission_offset] = {'metadata': row['data'],
-                                                       'highlevel': {}}
-
-        # Model data
-        model_query = text("""
-            SELECT m.model
-                 , hlmo.data
-                 , version.data as version
-                 , ll.gid::text
-                 , ll.submission_offset::text
-                 , m.class_mapping
-              FROM highlevel_model hlmo
-              JOIN model m
-                ON m.id = hlmo.model
-              JOIN version
-                ON version.id = hlmo.version
-              JOIN lowlevel ll
-                ON ll.id = hlmo.highlevel
-             WHERE hlmo.highlevel IN :hlids
-               AND m.status = 'show'
-        """)
+def get_high_level_digest(mbid, offset=0, map_classes=False):
+    """Get a digest of a high-level document, see :func:`get_many_high_level_digest`.
+
+    Raises:
+        NoDataFoundException: if this mbid doesn't exist or the offset is too high
+    """
+    mbid = str(mbid).lower()
+    result = get_many_high_level_digest([(mbid, offset)], map_classes)
+    if not result:
+        raise db.exceptions.NoDataFoundException
 
-        model_result = connection.execute(model_query, {'hlids': tuple(hlids)})
-        for row in model_result.fetchall():
-            model = row['model']
-            data = row['data']
-            mapping = row['class_mapping']
-            if map_classes and mapping:
-                data = map_highlevel_class_names(data, mapping)
+    return result[(mbid, offset)]
 
-            data['version'] = row['version']
 
-            gid = row['gid']
-            submission_offset = row['submission_offset']
-            recordings_info[gid][submission_offset]['highlevel'][model] = data
+def get_many_high_level_digest(recordings, map_classes=False):
+    """Get digests of high-level documents, without loading the documents.
 
-        return dict(recordings_info)
+    A digest changes when the document returned by :func:`load_many_high_level`
+    changes: it is computed from the sha256 of the metadata and of the data of
+    each model with the status `show`, and the class mapping of these models if
+    `map_classes` is set.
+
+    The digest without the class mappings is read from the document cache if
+    possible (see :mod:`db.document_cache`), and only the recordings which are
+    not in it and are not known to be missing are looked up in the database.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+        map_classes (bool): if the digest is for documents with mapped class names
+
+    Returns:
+        a dictionary {(mbid, offset): digest} of the recordings which have a high-level document
+    """
+    recordings = [(str(mbid).lower(), int(offset)) for mbid, offset in recordings]
+    generations = db.document_cache.get_highlevel_generations(recordings)
+    digests = db.document_cache.get_many_highlevel_digest(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in digests]
+    misses = db.document_cache.get_highlevel_misses(recordings, generations)
+    recordings = [recording for recording in recordings if recording not in misses]
+    if recordings:
+        loaded = _load_many_high_level_digest(recordings)
+        db.document_cache.set_many_highlevel_digest(loaded, generations)
+        db.document_cache.set_highlevel_misses(_get_missing_recordings(recordings, loaded), generations)
+        digests.update(loaded)
+
+    # The class mappings of all active models, see db.model_registry.get_fingerprint
+    mapping_digest = db.model_registry.get_fingerprint() if map_classes else ''
+    return {recording: sha256(("%s|%s" % (digest, mapping_digest)).encode('utf-8')).hexdigest()
+            for recording, digest in digests.items()}
+
+
+def _load_many_high_level_digest(recordings):
+    """Compute the digests of high-level documents in the database, without class mappings.
+
+    Returns:
+        a dictionary {(mbid, offset): digest}
+    """
+    models = db.model_registry.get_active_models_by_id()
+    with db.connect() as connection:
+        query = text("""
+            SELECT ll.gid::text
+                 , ll.submission_offset
+                 , hlm.data_sha256
+                 , models.models
+              FROM highlevel hl
+              JOIN highlevel_meta hlm
+                ON hl.id = hlm.id
+              JOIN lowlevel ll
+                ON ll.id = hl.id
+         LEFT JOIN LATERAL (
+                    SELECT string_agg(hlmo.model || ':' || hlmo.version || ':' || hlmo.data_sha256,
+                                      ',' ORDER BY hlmo.model) AS models
+                      FROM highlevel_model hlmo
+                     WHERE hlmo.highlevel = hl.id
+                       AND hlmo.model = ANY(CAST(:model_ids AS integer[]))
+                   ) models
+                ON TRUE
+             WHERE (ll.gid, ll.submission_offset)
+                IN :recordings
+        """)
+        result = connection.execute(query, {'recordings': tuple(recordings), 'model_ids': list(models.keys())})
+        digests = {}
+        for row in result.fetchall():
+            parts = "%s|%s" % (row['data_sha256'], row['models'] or '')
+            digests[(row['gid'], row['submission_offset'])] = sha256(parts.encode('utf-8')).hexdigest()
+        return digests
 
 
 def count_lowlevel(mbid):
     """Count number of stored low-level submissions for a specified MBID."""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(
             """SELECT COUNT(*)
                  FROM lowlevel
@@ -608,7 +1916,7 @@ def count_lowlevel(mbid):
 def count_many_lowlevel(mbids):
     """Count number of stored low-level submissions for a specified set
     of MBID."""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = text(
             """SELECT gid
                     , COUNT(*)
@@ -619,15 +1927,163 @@ def count_many_lowlevel(mbids):
                 in connection.execute(query, {"mbids": tuple(mbids)})}
 
 
-def get_unprocessed_highlevel_documents_for_model(highlevel_model, within=None):
+def get_submissions(mbid):
+    """Get the submissions of a recording, see :func:`get_many_submissions`.
+
+    Raises:
+        NoDataFoundException: if there are no submissions for this mbid
+    """
+    mbid = str(mbid).lower()
+    result = get_many_submissions([mbid])
+    if not result:
+        raise db.exceptions.NoDataFoundException
+    return result[mbid]
+
+
+def get_many_submissions(mbids):
+    """Get information about the low-level submissions of recordings, without their documents.
+
+    The columns are all in an index of `lowlevel` (and the primary key of `highlevel_meta`),
+    so this is answered by index-only scans.
+
+    Args:
+        mbids: a list of MBIDs
+
+    Returns:
+        a dictionary {mbid: [submission, ...]} of the MBIDs which have submissions,
+        ordered by offset. Each submission is a dictionary with the keys offset,
+        submitted, lossless, build_sha1, codec, bit_rate, and highlevel (True
+        if the submission has a high-level document).
+    """
+    if not mbids:
+        return {}
+    with db.connect() as connection:
+        query = text("""
+            SELECT ll.gid::text
+                 , ll.submission_offset
+                 , ll.submitted
+                 , ll.lossless
+                 , ll.build_sha1
+                 , ll.codec
+                 , ll.bit_rate
+                 , EXISTS (SELECT 1 FROM highlevel_meta hlm WHERE hlm.id = ll.id) AS highlevel
+              FROM lowlevel ll
+             WHERE ll.gid IN :mbids
+          ORDER BY ll.gid, ll.submission_offset
+        """)
+        result = connection.execute(query, {"mbids": tuple(str(mbid).lower() for mbid in mbids)})
+        submissions = defaultdict(list)
+        for row in result.fetchall():
+            submission = dict(row)
+            submission["offset"] = submission.pop("submission_offset")
+            submissions[submission.pop("gid")].append(submission)
+        return dict(submissions)
+
+
+def _iter_rows(query, params_list):
+    """Run a query once for each set of parameters and yield the resulting rows.
+
+    Rows are read from a server-side cursor ITER_FETCH_SIZE at a time, so only
+    a few rows are in memory at once.
+    """
+    for params in params_list:
+        with db.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(query, params)
+            while True:
+                rows = result.fetchmany(ITER_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def iter_low_level_json(recordings, features=None):
+    """Yield low-level documents for any number of recordings.
+
+    Recordings are looked up ITER_CHUNK_SIZE at a time, so unlike
+    :func:`load_many_low_level_json` the documents are never all in memory.
+    Documents are read from the database only, the document cache isn't used.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+        features: only return these parts of each document, see :func:`load_many_low_level`
+
+    Returns:
+        a generator of (mbid, offset, serialised document) tuples, in no particular
+        order. Recordings which don't exist are left out.
+    """
+    if features:
+        features = _remove_overlapping_features(features)
+        for chunk in _chunks(recordings, ITER_CHUNK_SIZE):
+            for mbid, documents in _load_many_low_level_features(chunk, features).items():
+                for offset, data in documents.items():
+                    yield mbid, int(offset), json.dumps(data)
+        return
+
+    params_list = ({'recordings': tuple(chunk)} for chunk in _chunks(recordings, ITER_CHUNK_SIZE))
+    for row in _iter_rows(_LOW_LEVEL_JSON_QUERY, params_list):
+        yield row['gid'], row['submission_offset'], row['data']
+
+
+def iter_high_level_json(recordings, map_classes=False):
+    """Yield high-level documents for any number of recordings, see :func:`iter_low_level_json`.
+
+    High-level documents are small, so all of the documents of a chunk are loaded at once.
+    Like in :func:`iter_low_level_json` the document cache isn't used.
+
+    Args:
+        recordings: A list of tuples (mbid, offset).
+        map_classes (bool): if True, map class names to human readable values in the returned data
+    """
+    if map_classes:
+        for chunk in _chunks(recordings, ITER_CHUNK_SIZE):
+            for (mbid, offset), document in _load_many_high_level_documents(chunk, map_classes).items():
+                yield mbid, offset, json.dumps(document)
+        return
+
+    for chunk in _chunks(recordings, ITER_CHUNK_SIZE):
+        with db.connect() as connection:
+            documents = _load_many_high_level_json(connection, chunk)
+        for (mbid, offset), data_json in documents.items():
+            yield mbid, offset, data_json
+
+
+def iter_count_lowlevel(mbids):
+    """Yield the number of low-level submissions for any number of MBIDs.
+
+    Returns:
+        a generator of (mbid, count) tuples. MBIDs without submissions are left out.
+    """
+    query = text(
+        """SELECT gid::text
+                , COUNT(*)
+             FROM lowlevel
+            WHERE gid IN :mbids
+         GROUP BY gid""")
+    params_list = ({'mbids': tuple(chunk)} for chunk in _chunks(mbids, ITER_CHUNK_SIZE))
+    for row in _iter_rows(query, params_list):
+        yield row[0], int(row[1])
+
+
+def get_unprocessed_highlevel_documents_for_model(highlevel_model, within=None, after=0):
     """Fetch up to 100 low-level documents which have no associated
     high level data for the given module_id.
+
+    Documents are returned in order of lowlevel.id, starting after `after`, so that
+    a caller can page through them without scanning the documents it has already
+    seen again: pass the largest id of the previous batch, and 0 to start over.
+
     if `within` is set, only return mbids that are in this list"""
 
     within_query = ""
     if within:
-        within_query = "AND ll.mbid IN :within"
-    with db.engine.connect() as connection:
+        within_query = "AND ll.gid IN :within"
+    with db.connect() as connection:
         query = text(
             """SELECT ll.gid::text
                     , llj.data::text
@@ -635,14 +2091,15 @@ def get_unprocessed_highlevel_documents_for_model(highlevel_model, within=None):
                  FROM lowlevel AS ll
                  JOIN lowlevel_json AS llj
                    ON llj.id = ll.id
-            LEFT JOIN (SELECT id, highlevel
-                         FROM highlevel_model
-                        WHERE model=:highlevel_model) AS hlm
-                   ON ll.id = hlm.highlevel
-                WHERE hlm.id IS NULL
+                WHERE ll.id > :after
+                  AND NOT EXISTS (SELECT 1
+                                    FROM highlevel_model AS hlm
+                                   WHERE hlm.highlevel = ll.id
+                                     AND hlm.model = :highlevel_model)
                       %s
+             ORDER BY ll.id
                 LIMIT 100""" % within_query)
-        params = {"highlevel_model": highlevel_model}
+        params = {"highlevel_model": highlevel_model, "after": after}
         if within:
             params["within"] = tuple(within)
         result = connection.execute(query, params)
@@ -651,24 +2108,181 @@ def get_unprocessed_highlevel_documents_for_model(highlevel_model, within=None):
 
 
 def get_unprocessed_highlevel_documents():
-    """Fetch up to 100 low-level documents which have no associated high level data."""
-    with db.engine.connect() as connection:
+    """Fetch up to 100 low-level documents which have no associated high level data.
+
+    Submissions are added to the `highlevel_pending` queue when they are written
+    and removed from it when their high-level data is written, so the oldest
+    documents are read from the start of its primary key instead of searching
+    `lowlevel` for rows which have no `highlevel` row. Submissions which are
+    added to the database in another way, such as by importing a dump, must be
+    added to the queue with :func:`enqueue_unprocessed_highlevel_documents`.
+    """
+    with db.connect() as connection:
         query = text(
             """SELECT ll.gid::text
                 , llj.data::text
                 , ll.id
-             FROM lowlevel AS ll
+             FROM highlevel_pending AS pending
+             JOIN lowlevel AS ll
+               ON ll.id = pending.id
              JOIN lowlevel_json AS llj
                ON llj.id = ll.id
-        LEFT JOIN highlevel AS hl
-               ON ll.id = hl.id
-            WHERE hl.mbid IS NULL
+         ORDER BY pending.id
             LIMIT 100""")
         result = connection.execute(query)
         docs = result.fetchall()
         return docs
 
 
+def enqueue_unprocessed_highlevel_documents(batch_size=HIGHLEVEL_PENDING_BATCH_SIZE):
+    """Add all low-level submissions which have no high-level data to the
+    `highlevel_pending` queue, see :func:`get_unprocessed_highlevel_documents`.
+
+    The `lowlevel` table is read in ranges of ids, each in its own transaction,
+    so this can be run while submissions are being made.
+
+    Args:
+        batch_size: the number of lowlevel ids to look at in each transaction
+
+    Yields:
+        (number of submissions added to the queue, largest id looked at) for each batch
+    """
+    with db.connect() as connection:
+        last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM lowlevel").fetchone()[0]
+    query = text("""
+        INSERT INTO highlevel_pending (id)
+             SELECT ll.id
+               FROM lowlevel AS ll
+          LEFT JOIN highlevel AS hl
+                 ON hl.id = ll.id
+              WHERE ll.id > :after
+                AND ll.id <= :upto
+                AND hl.id IS NULL
+        ON CONFLICT DO NOTHING
+    """)
+    after = 0
+    while after < last_id:
+        upto = min(after + batch_size, last_id)
+        with db.begin() as connection:
+            count = connection.execute(query, {"after": after, "upto": upto}).rowcount
+        after = upto
+        yield count, after
+
+
+def claim_highlevel_documents(worker, limit=100, lease_duration=HIGHLEVEL_LEASE_DURATION):
+    """Claim low-level documents which have no high-level data, so that no other
+    high-level extractor works on them.
+
+    Documents are taken from the `highlevel_pending` queue in the order in which
+    they were submitted, see :func:`get_unprocessed_highlevel_documents`.
+
+    A claimed submission has a lease in the `highlevel_lease` table, which is removed
+    when its high-level data is written by :func:`write_high_level` or when the worker
+    calls :func:`release_highlevel_documents`. A worker which takes longer than
+    `lease_duration` extends its leases with :func:`renew_highlevel_leases`. If a worker
+    stops without doing either, its submissions can be claimed by another worker once
+    the lease expires.
+
+    Workers which claim at the same time skip the submissions that are being claimed
+    by each other instead of waiting for them, so any number of workers can share
+    the submissions without processing the same one twice.
+
+    Args:
+        worker: an identifier of the worker, e.g. its host name and process id
+        limit: the largest number of documents to claim
+        lease_duration: the number of seconds before another worker can claim the documents
+
+    Returns:
+        a list of (mbid, lowlevel.id) tuples, ordered by id. The documents are loaded
+        with :func:`load_low_level_json_by_id` when the worker is ready to process them.
+    """
+    with db.begin() as connection:
+        # The lock on the queue row makes concurrent workers skip it while it is being
+        # claimed, and the WHERE clause of the conflict handler makes the claim fail if
+        # another worker committed a lease for it after this statement started
+        query = text("""
+            WITH claimable AS (
+                SELECT pending.id
+                  FROM highlevel_pending AS pending
+             LEFT JOIN highlevel_lease AS lease
+                    ON lease.id = pending.id
+                 WHERE lease.id IS NULL
+                    OR lease.expires < NOW()
+              ORDER BY pending.id
+                 LIMIT :limit
+                   FOR NO KEY UPDATE OF pending SKIP LOCKED
+            ), claimed AS (
+                INSERT INTO highlevel_lease (id, worker, expires)
+                     SELECT id, :worker, NOW() + make_interval(secs => :lease_duration)
+                       FROM claimable
+                ON CONFLICT (id)
+                  DO UPDATE SET worker = EXCLUDED.worker
+                              , expires = EXCLUDED.expires
+                          WHERE highlevel_lease.expires < NOW()
+                  RETURNING id
+            )
+            SELECT ll.gid::text
+                 , ll.id
+              FROM claimed
+              JOIN lowlevel AS ll
+                ON ll.id = claimed.id
+          ORDER BY ll.id
+        """)
+        result = connection.execute(query, {"worker": worker, "limit": limit, "lease_duration": lease_duration})
+        return [(row["gid"], row["id"]) for row in result.fetchall()]
+
+
+def renew_highlevel_leases(worker, ll_ids, lease_duration=HIGHLEVEL_LEASE_DURATION):
+    """Extend the leases of a worker on submissions that it hasn't finished yet,
+    so that they are not claimed by other workers, see :func:`claim_highlevel_documents`.
+
+    Args:
+        worker: the identifier of the worker
+        ll_ids: the ids of the submissions
+        lease_duration: the number of seconds from now before the leases expire
+
+    Returns:
+        the set of the ids whose lease is still held by this worker. The other
+        leases expired and were claimed by another worker, or removed when
+        their high-level data was written.
+    """
+    if not ll_ids:
+        return set()
+    with db.begin() as connection:
+        query = text("""
+            UPDATE highlevel_lease
+               SET expires = NOW() + make_interval(secs => :lease_duration)
+             WHERE worker = :worker
+               AND id IN :ids
+         RETURNING id
+        """)
+        result = connection.execute(query, {"worker": worker, "ids": tuple(ll_ids),
+                                            "lease_duration": lease_duration})
+        return set(row["id"] for row in result.fetchall())
+
+
+def release_highlevel_documents(worker, ll_ids=None):
+    """Remove the leases of a worker, so that other workers can claim its submissions
+    straight away, see :func:`claim_highlevel_documents`.
+
+    Args:
+        worker: the identifier of the worker
+        ll_ids: if set, only release the leases of these submissions
+
+    Returns:
+        the number of leases which were removed
+    """
+    if ll_ids is not None and not ll_ids:
+        return 0
+    query = "DELETE FROM highlevel_lease WHERE worker = :worker"
+    params = {"worker": worker}
+    if ll_ids is not None:
+        query += " AND id IN :ids"
+        params["ids"] = tuple(ll_ids)
+    with db.begin() as connection:
+        return connection.execute(text(query), params).rowcount
+
+
 def get_summary_data(mbid, offset=0):
     """Fetches the low-level and high-level features from for the specified MBID.
 
@@ -33,7 +33,7 @@ def create_from_dict(dictionary, author_id):
     """
     dataset_validator.validate(dictionary)
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         if "description" not in dictionary:
             dictionary["description"] = None
 
@@ -102,7 +102,7 @@ def update_dataset_meta(dataset_id, meta):
     # Only do an update if we have items to update
     if params:
         params["id"] = dataset_id
-        with db.engine.begin() as connection:
+        with db.begin() as connection:
             connection.execute(query, params)
 
 
@@ -110,7 +110,7 @@ def update(dataset_id, dictionary, author_id):
     # TODO(roman): Make author_id argument optional (keep old author if None).
     dataset_validator.validate(dictionary)
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         if "description" not in dictionary:
             dictionary["description"] = None
 
@@ -142,7 +142,7 @@ def get(id):
         Dictionary with dataset details if it has been found, None
         otherwise.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(
             "SELECT id::text, name, description, author, created, public, last_edited "
             "FROM dataset "
@@ -164,7 +164,7 @@ def get_public_datasets(status):
     else:
         raise ValueError("Unknown status")
 
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = text("""
             SELECT dataset.id::text
                  , dataset.name
@@ -192,7 +192,7 @@ def get_public_datasets(status):
 
 
 def _get_classes(dataset_id):
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = text("""SELECT id::text
                              , name
                              , description
@@ -211,7 +211,7 @@ def _get_classes(dataset_id):
 
 
 def _get_recordings_in_class(class_id):
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute("SELECT mbid::text FROM dataset_class_member WHERE class = %s",
                                     (class_id,))
         recordings = []
@@ -226,7 +226,7 @@ def get_by_user_id(user_id, public_only=True):
     Returns:
         List of dictionaries with dataset details.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         where = "WHERE author = %s"
         if public_only:
             where += " AND public = TRUE"
@@ -241,7 +241,7 @@ def get_by_user_id(user_id, public_only=True):
 
 def delete(id):
     """Delete dataset with a specified ID."""
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         connection.execute("DELETE FROM dataset WHERE id = %s", (str(id),))
 
 
@@ -280,7 +280,7 @@ def create_snapshot(dataset_id):
                         "recordings": c["recordings"],
                     } for c in dataset["classes"]],
     }
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             INSERT INTO dataset_snapshot (id, dataset_id, data)
                  VALUES (uuid_generate_v4(), :dataset_id, :data)
@@ -306,7 +306,7 @@ def get_snapshot(id):
             "data": <actual content of a snapshot (see `create_snapshot` function)>
         }
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT id::text
                  , dataset_id::text
@@ -343,7 +343,7 @@ def get_snapshots_for_dataset(dataset_id):
     Returns:
         List of snapshots as dictionaries.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT id::text
                  , dataset_id::text
@@ -395,7 +395,7 @@ def add_recordings(dataset_id, class_name, recordings):
         NoDataFoundException if the dataset doesn't exist or if the class doesn't exist in the dataset
     """
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         clsid = _get_classid_for_dataset(connection, dataset_id, class_name)
         for mbid in recordings:
             connection.execute(sqlalchemy.text("""
@@ -412,7 +412,7 @@ def add_recordings(dataset_id, class_name, recordings):
 def delete_recordings(dataset_id, class_name, recordings):
     """Delete recordings from a dataset class"""
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         clsid = _get_classid_for_dataset(connection, dataset_id, class_name)
         for mbid in recordings:
             connection.execute(sqlalchemy.text("""
@@ -438,7 +438,7 @@ def add_class(dataset_id, class_data):
                "recordings": [list of recording ids (optional)}
     """
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         if "description" not in class_data:
             class_data["description"] = None
         connection.execute(sqlalchemy.text("""
@@ -465,7 +465,7 @@ def delete_class(dataset_id, class_data):
               {"name": "Classname"}
     """
 
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         query = sqlalchemy.text("""
             DELETE FROM dataset_class
                   WHERE name = :class_name
@@ -505,7 +505,7 @@ def update_class(dataset_id, class_name, class_data):
             """ % setstr)
 
     if params:
-        with db.engine.begin() as connection:
+        with db.begin() as connection:
             clsid = _get_classid_for_dataset(connection, dataset_id, class_name)
             params["id"] = clsid
 
@@ -520,7 +520,7 @@ def check_recording_in_dataset(dataset_id, mbid):
     Returns:
         True if an MBID appears anywhere in a dataset, False otherwise
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT dataset_class.id
               FROM dataset_class
@@ -63,7 +63,7 @@ def evaluate_dataset(dataset_id, normalize, eval_location, filter_type=None):
     Returns:
         ID of the newly created evaluation job.
     """
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         if _job_exists(connection, dataset_id):
             raise JobExistsException
 
@@ -82,7 +82,7 @@ def job_exists(dataset_id):
     Returns:
         True if there's a pending or running job, False otherwise.
     """
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         return _job_exists(connection, dataset_id)
 
 
@@ -150,7 +150,7 @@ def get_next_pending_job():
     Returns:
          The next job to process
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = text(
             """SELECT %s
                  FROM dataset_eval_jobs
@@ -176,7 +176,7 @@ def get_job(job_id):
     Returns:
         The evaluation job with the specified id
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = text(
             """SELECT %s
                  FROM dataset_eval_jobs
@@ -198,7 +198,7 @@ def get_jobs_for_dataset(dataset_id):
         List of evaluation jobs (dicts) for the dataset. Ordered by creation
         time (oldest job first)
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT dataset_eval_jobs.*
               FROM dataset_eval_jobs
@@ -210,7 +210,7 @@ def get_jobs_for_dataset(dataset_id):
 
 
 def set_job_result(job_id, result):
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         connection.execute(
             "UPDATE dataset_eval_jobs "
             "SET (result, updated) = (%s, current_timestamp) "
@@ -227,7 +227,7 @@ def add_sets_to_job(job_id, training, testing):
         training: Dictionary of the training set for the job
         testing : Dictionary of the test set
     """
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         training_id = add_dataset_eval_set(connection, training)
         testing_id = add_dataset_eval_set(connection, testing)
         query = text(
@@ -255,7 +255,7 @@ def set_job_status(job_id, status, status_msg=None):
                       STATUS_DONE,
                       STATUS_FAILED]:
         raise IncorrectJobStatusException
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         connection.execute(
             "UPDATE dataset_eval_jobs "
             "SET (status, status_msg, updated) = (%s, %s, current_timestamp) "
@@ -265,7 +265,7 @@ def set_job_status(job_id, status, status_msg=None):
 
 
 def delete_job(job_id):
-    with db.engine.begin() as connection:
+    with db.begin() as connection:
         result = connection.execute("""
             SELECT snapshot_id::text
                  , status
@@ -287,7 +287,7 @@ def delete_job(job_id):
 
 
 def get_dataset_eval_set(id):
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(
             "SELECT id, data "
             "FROM dataset_eval_sets "
@@ -342,7 +342,7 @@ def get_remote_pending_jobs_for_user(user_id):
       user_id: the id of the user to get the jobs for
     """
 
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = sqlalchemy.text("""
                      SELECT dataset_eval_jobs.id::text,
                             dataset.name,
@@ -0,0 +1,451 @@
+"""Read-through cache of low-level and high-level documents in redis.
+
+A low-level document is never changed after it has been written, so once a
+(gid, submission_offset) document has been loaded from the database its
+serialised JSON is kept in redis and later requests don't need to query
+PostgreSQL. High-level documents can change when a new model is computed for
+a submission, when the status of a model changes (only models with the status
+`show` are included) or when the class mapping of a model changes:
+
+* When a new model is written for a submission, :func:`db.data.write_high_level`
+  calls :func:`delete_highlevel`. This changes the write generation of that
+  submission, which is part of the keys of its cached high-level document,
+  digest and miss. A request which read the old generation before the model
+  was written can only add the old document under the old key, which is never
+  read again. Code which loads high-level documents from the database gets the
+  generations with :func:`get_highlevel_generations` first, and passes them to
+  the functions which add the documents to the cache.
+* When models change, :func:`invalidate_models` is called. This changes a
+  token which is part of the key of every high-level document, so all
+  high-level documents are loaded from the database again. Class mappings are
+  edited directly in the database, so run `manage.py invalidate_highlevel_cache`
+  after changing them.
+
+Processes check for a new token every TOKEN_CHECK_INTERVAL seconds, so it can
+take that long for a change in another process to be visible.
+
+Many lookups are for recordings which have no data. If a (gid, submission_offset)
+is not found in the database, this is also kept in the cache, for a shorter time
+(the negative timeout). Offsets are given out in order, so a new submission
+only has to remove the entry for its own offset, see
+:func:`delete_lowlevel_misses`. Like high-level documents, low-level misses
+have a write generation which is changed when the submission is written, so a
+request which didn't find the submission just before it was written can't
+remember the miss after it was removed. A missing high-level document is removed from
+the cache when it is written, with :func:`delete_highlevel`.
+
+The sha256 of each low-level document and the digest of each high-level
+document (see :func:`db.data.get_many_high_level_digest`) are cached next to
+the documents, so that the ETag of a response can be made without querying
+the database.
+"""
+import threading
+import time
+import uuid
+
+from brainzutils import cache
+
+NAMESPACE = "document"
+GENERATION_KEY = "generation"
+MODEL_TOKEN_KEY = "model-token"
+
+DEFAULT_TIMEOUT = 24 * 60 * 60  # 1 day
+DEFAULT_NEGATIVE_TIMEOUT = 60
+# The write generation of a document which was never written since it was first cached
+INITIAL_DOCUMENT_GENERATION = "0"
+# How often (in seconds) a process checks if the tokens were changed by another process
+TOKEN_CHECK_INTERVAL = 5
+
+_config = {"enabled": False, "timeout": DEFAULT_TIMEOUT, "negative_timeout": DEFAULT_NEGATIVE_TIMEOUT}
+_tokens = {GENERATION_KEY: None, MODEL_TOKEN_KEY: None}
+_tokens_checked = [0]
+_tokens_lock = threading.Lock()
+_stats = {"negative_hits": 0, "negative_sets": 0}
+
+
+def init(enabled=False, timeout=DEFAULT_TIMEOUT, negative_timeout=DEFAULT_NEGATIVE_TIMEOUT):
+    """Configure the document cache of this process.
+
+    Args:
+        enabled: if False, nothing is read from or written to the cache
+        timeout: the number of seconds that a document is kept in the cache
+        negative_timeout: the number of seconds that a document which doesn't exist
+            is remembered. 0 to not remember missing documents.
+    """
+    _config.update({"enabled": enabled, "timeout": timeout, "negative_timeout": negative_timeout})
+    with _tokens_lock:
+        _tokens_checked[0] = 0
+
+
+def is_enabled():
+    return _config["enabled"]
+
+
+def _get_tokens():
+    """Get the current cache generation and model token, creating them if needed."""
+    now = time.time()
+    with _tokens_lock:
+        if now - _tokens_checked[0] < TOKEN_CHECK_INTERVAL:
+            return _tokens[GENERATION_KEY], _tokens[MODEL_TOKEN_KEY]
+
+    tokens = cache.get_many([GENERATION_KEY, MODEL_TOKEN_KEY], namespace=NAMESPACE)
+    for key in (GENERATION_KEY, MODEL_TOKEN_KEY):
+        if not tokens.get(key):
+            tokens[key] = _set_token(key)
+    with _tokens_lock:
+        _tokens.update(tokens)
+        _tokens_checked[0] = now
+        return _tokens[GENERATION_KEY], _tokens[MODEL_TOKEN_KEY]
+
+
+def _set_token(key):
+    token = uuid.uuid4().hex[:8]
+    cache.set(key, token, namespace=NAMESPACE)
+    with _tokens_lock:
+        _tokens[key] = token
+    return token
+
+
+def clear():
+    """Remove all documents from the cache."""
+    _set_token(GENERATION_KEY)
+
+
+def invalidate_models():
+    """Remove all high-level documents from the cache, because models have changed."""
+    _set_token(MODEL_TOKEN_KEY)
+
+
+def _lowlevel_key(generation, mbid, offset):
+    return "ll:%s:%s:%s" % (generation, str(mbid).lower(), offset)
+
+
+def _highlevel_key(generation, model_token, doc_generation, mbid, offset, map_classes):
+    return "hl:%s:%s:%s:%s:%s:%d" % (generation, model_token, doc_generation, str(mbid).lower(), offset,
+                                     bool(map_classes))
+
+
+def _highlevel_generation_key(generation, mbid, offset):
+    return "hl-gen:%s:%s:%s" % (generation, str(mbid).lower(), offset)
+
+
+def _lowlevel_sha256_key(generation, mbid, offset):
+    return "ll-sha:%s:%s:%s" % (generation, str(mbid).lower(), offset)
+
+
+def _highlevel_digest_key(generation, model_token, doc_generation, mbid, offset):
+    # The digest doesn't include the class mappings, they are added by db.data
+    return "hl-digest:%s:%s:%s:%s:%s" % (generation, model_token, doc_generation, str(mbid).lower(), offset)
+
+
+def _lowlevel_generation_key(generation, mbid, offset):
+    return "ll-gen:%s:%s:%s" % (generation, str(mbid).lower(), offset)
+
+
+def _lowlevel_miss_key(generation, doc_generation, mbid, offset):
+    return "ll-miss:%s:%s:%s:%s" % (generation, doc_generation, str(mbid).lower(), offset)
+
+
+def _highlevel_miss_key(generation, doc_generation, mbid, offset):
+    # Whether a high-level document exists doesn't depend on the models
+    return "hl-miss:%s:%s:%s:%s" % (generation, doc_generation, str(mbid).lower(), offset)
+
+
+def _get_doc_generation(generations, mbid, offset):
+    return generations.get((str(mbid).lower(), int(offset)), INITIAL_DOCUMENT_GENERATION)
+
+
+def _get_many(recordings, make_key):
+    if not _config["enabled"] or not recordings:
+        return {}
+    keys = {make_key(mbid, offset): (mbid, offset) for mbid, offset in recordings}
+    found = cache.get_many(list(keys.keys()), namespace=NAMESPACE)
+    return {keys[key]: value for key, value in found.items() if value is not None}
+
+
+def _set_many(values, make_key):
+    if not _config["enabled"] or not values:
+        return
+    cache.set_many({make_key(mbid, offset): value for (mbid, offset), value in values.items()},
+                   time=_config["timeout"], namespace=NAMESPACE)
+
+
+def get_many_lowlevel(recordings):
+    """Get cached low-level documents.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+
+    Returns:
+        a dictionary {(mbid, offset): serialised document} of the recordings which are in the cache
+    """
+    if not _config["enabled"]:
+        return {}
+    generation, _ = _get_tokens()
+    return _get_many(recordings, lambda mbid, offset: _lowlevel_key(generation, mbid, offset))
+
+
+def set_many_lowlevel(documents):
+    """Add low-level documents to the cache.
+
+    Args:
+        documents: a dictionary {(mbid, offset): serialised document}
+    """
+    if not _config["enabled"]:
+        return
+    generation, _ = _get_tokens()
+    _set_many(documents, lambda mbid, offset: _lowlevel_key(generation, mbid, offset))
+
+
+def get_highlevel_generations(recordings):
+    """Get the write generations of high-level documents, see :func:`delete_highlevel`.
+
+    Get them before loading documents from the database, and pass them to the
+    functions which add the documents to the cache, so that a document which
+    was changed while it was being loaded isn't cached.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+
+    Returns:
+        a dictionary {(lower-case mbid, offset): generation}
+    """
+    if not _config["enabled"] or not recordings:
+        return {}
+    generation, _ = _get_tokens()
+    return _get_generations(recordings, lambda mbid, offset: _highlevel_generation_key(generation, mbid, offset))
+
+
+def _get_generations(recordings, make_key):
+    found = _get_many(recordings, make_key)
+    return {(str(mbid).lower(), int(offset)): found.get((mbid, offset), INITIAL_DOCUMENT_GENERATION)
+            for mbid, offset in recordings}
+
+
+def _set_generations(recordings, make_key, timeout):
+    """Give documents a new write generation, which is kept for `timeout` seconds."""
+    token = uuid.uuid4().hex[:8]
+    cache.set_many({make_key(mbid, offset): token for mbid, offset in recordings},
+                   time=timeout, namespace=NAMESPACE)
+
+
+def get_many_highlevel(recordings, map_classes, generations=None):
+    """Get cached high-level documents, see :func:`get_many_lowlevel`.
+
+    Args:
+        map_classes: if the documents have human readable class names
+        generations: the generations from :func:`get_highlevel_generations`. If not set,
+            they are read from the cache.
+    """
+    if not _config["enabled"]:
+        return {}
+    generation, model_token = _get_tokens()
+    if generations is None:
+        generations = get_highlevel_generations(recordings)
+    return _get_many(recordings, lambda mbid, offset: _highlevel_key(
+        generation, model_token, _get_doc_generation(generations, mbid, offset), mbid, offset, map_classes))
+
+
+def set_many_highlevel(documents, map_classes, generations):
+    """Add high-level documents to the cache, see :func:`set_many_lowlevel`.
+
+    Args:
+        generations: the generations from :func:`get_highlevel_generations`, read
+            before the documents were loaded from the database
+    """
+    if not _config["enabled"]:
+        return
+    generation, model_token = _get_tokens()
+    _set_many(documents, lambda mbid, offset: _highlevel_key(
+        generation, model_token, _get_doc_generation(generations, mbid, offset), mbid, offset, map_classes))
+
+
+def get_many_lowlevel_sha256(recordings):
+    """Get the cached sha256 of low-level documents.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+
+    Returns:
+        a dictionary {(mbid, offset): sha256} of the recordings which are in the cache
+    """
+    if not _config["enabled"]:
+        return {}
+    generation, _ = _get_tokens()
+    return _get_many(recordings, lambda mbid, offset: _lowlevel_sha256_key(generation, mbid, offset))
+
+
+def set_many_lowlevel_sha256(sha256s):
+    """Add the sha256 of low-level documents to the cache.
+
+    Args:
+        sha256s: a dictionary {(mbid, offset): sha256}
+    """
+    if not _config["enabled"]:
+        return
+    generation, _ = _get_tokens()
+    _set_many(sha256s, lambda mbid, offset: _lowlevel_sha256_key(generation, mbid, offset))
+
+
+def get_many_highlevel_digest(recordings, generations=None):
+    """Get the cached digests of high-level documents, see :func:`get_many_lowlevel_sha256`
+    and :func:`get_many_highlevel`."""
+    if not _config["enabled"]:
+        return {}
+    generation, model_token = _get_tokens()
+    if generations is None:
+        generations = get_highlevel_generations(recordings)
+    return _get_many(recordings, lambda mbid, offset: _highlevel_digest_key(
+        generation, model_token, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def set_many_highlevel_digest(digests, generations):
+    """Add the digests of high-level documents to the cache, see :func:`set_many_lowlevel_sha256`
+    and :func:`set_many_highlevel`."""
+    if not _config["enabled"]:
+        return
+    generation, model_token = _get_tokens()
+    _set_many(digests, lambda mbid, offset: _highlevel_digest_key(
+        generation, model_token, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def delete_highlevel(mbid, offset):
+    """Remove the high-level document of a submission and its digest from the cache,
+    and the information that it has no high-level document.
+
+    This changes the write generation of the submission, so the cache entries of the
+    previous generation are not read again.
+    """
+    if not _config["enabled"]:
+        return
+    generation, _ = _get_tokens()
+    # The generation must be kept longer than the documents cached with the previous one
+    _set_generations([(mbid, offset)], lambda mbid, offset: _highlevel_generation_key(generation, mbid, offset),
+                     2 * _config["timeout"])
+
+
+def _get_misses(recordings, make_key):
+    if not _config["enabled"] or not _config["negative_timeout"] or not recordings:
+        return set()
+    misses = set(_get_many(recordings, make_key))
+    if misses:
+        with _tokens_lock:
+            _stats["negative_hits"] += len(misses)
+    return misses
+
+
+def _set_misses(recordings, make_key):
+    if not _config["enabled"] or not _config["negative_timeout"] or not recordings:
+        return
+    cache.set_many({make_key(mbid, offset): 1 for mbid, offset in recordings},
+                   time=_config["negative_timeout"], namespace=NAMESPACE)
+    with _tokens_lock:
+        _stats["negative_sets"] += len(recordings)
+
+
+def get_lowlevel_generations(recordings):
+    """Get the write generations of low-level submissions, see :func:`delete_lowlevel_misses`
+    and :func:`get_highlevel_generations`.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+
+    Returns:
+        a dictionary {(lower-case mbid, offset): generation}
+    """
+    if not _config["enabled"] or not _config["negative_timeout"] or not recordings:
+        return {}
+    generation, _ = _get_tokens()
+    return _get_generations(recordings, lambda mbid, offset: _lowlevel_generation_key(generation, mbid, offset))
+
+
+def get_lowlevel_misses(recordings, generations=None):
+    """Get the recordings which are known to have no low-level document.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+        generations: the generations from :func:`get_lowlevel_generations`. If not set,
+            they are read from the cache.
+
+    Returns:
+        a set of (mbid, offset) tuples
+    """
+    if not _config["enabled"] or not _config["negative_timeout"]:
+        return set()
+    generation, _ = _get_tokens()
+    if generations is None:
+        generations = get_lowlevel_generations(recordings)
+    return _get_misses(recordings, lambda mbid, offset: _lowlevel_miss_key(
+        generation, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def set_lowlevel_misses(recordings, generations):
+    """Remember that recordings have no low-level document, for the negative timeout.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+        generations: the generations from :func:`get_lowlevel_generations`, read
+            before the recordings were looked up in the database
+    """
+    if not _config["enabled"]:
+        return
+    generation, _ = _get_tokens()
+    _set_misses(recordings, lambda mbid, offset: _lowlevel_miss_key(
+        generation, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def delete_lowlevel_misses(recordings):
+    """Forget that recordings have no low-level document, because they were just submitted.
+
+    This changes the write generation of the recordings, so a miss which is added
+    by a request that looked them up before they were written is not read.
+
+    Args:
+        recordings: a list of (mbid, offset) tuples
+    """
+    if not _config["enabled"] or not _config["negative_timeout"] or not recordings:
+        return
+    generation, _ = _get_tokens()
+    # The generation must be kept longer than the misses added with the previous one
+    _set_generations(recordings, lambda mbid, offset: _lowlevel_generation_key(generation, mbid, offset),
+                     2 * _config["negative_timeout"])
+
+
+def get_highlevel_misses(recordings, generations=None):
+    """Get the recordings which are known to have no high-level document, see
+    :func:`get_lowlevel_misses` and :func:`get_many_highlevel`."""
+    if not _config["enabled"]:
+        return set()
+    generation, _ = _get_tokens()
+    if generations is None:
+        generations = get_highlevel_generations(recordings)
+    return _get_misses(recordings, lambda mbid, offset: _highlevel_miss_key(
+        generation, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def set_highlevel_misses(recordings, generations):
+    """Remember that recordings have no high-level document, see :func:`set_lowlevel_misses`
+    and :func:`set_many_highlevel`."""
+    if not _config["enabled"]:
+        return
+    generation, _ = _get_tokens()
+    _set_misses(recordings, lambda mbid, offset: _highlevel_miss_key(
+        generation, _get_doc_generation(generations, mbid, offset), mbid, offset))
+
+
+def get_stats():
+    """Get the counters of missing documents in this process.
+
+    Returns:
+        a dictionary {"negative_hits": n, "negative_sets": n} where negative_hits is the
+        number of lookups which were answered from the cache because the document doesn't
+        exist, and negative_sets is the number of missing documents which were added to the cache.
+    """
+    with _tokens_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _tokens_lock:
+        for key in _stats:
+            _stats[key] = 0
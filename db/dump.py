@@ -13,6 +13,7 @@ from flask import current_app
 
 import utils.path
 import db
+import db.model_registry
 import logging
 import os
 import shutil
@@ -678,16 +679,23 @@ def dump_highlevel_json(location, incremental=False, dump_id=None):
             else:
                 where = ""
 
+            # Materialised documents are used if they are up to date, see db.data.write_high_level_documents
             result = connection.execute(sqlalchemy.text("""
                     SELECT hl.id AS id
                          , hl.mbid AS mbid
                          , hlm.data AS metadata
+                         , hld.data AS document
                       FROM highlevel hl
                  LEFT JOIN highlevel_meta hlm
                         ON hl.id = hlm.id
+                 LEFT JOIN highlevel_document hld
+                        ON hl.id = hld.id
+                       AND hld.model_state = :model_state
                         {where_clause}
                   ORDER BY hl.mbid
-                """.format(where_clause=where)))
+                """.format(where_clause=where)), {
+                    'model_state': db.model_registry.get_model_state(),
+                })
 
             with db.engine.connect() as connection_inner:
                 temp_dir = tempfile.mkdtemp()
@@ -699,27 +707,31 @@ def dump_highlevel_json(location, incremental=False, dump_id=None):
                     if not data_list:
                         break
 
-                    # get data for the all the hlids in the current chunk
-                    result_inner = connection_inner.execute(sqlalchemy.text("""
-                            SELECT m.model AS model
-                                 , hlmo.data AS model_data
-                                 , version.data AS version
-                                 , hlmo.highlevel AS id
-                              FROM highlevel_model hlmo
-                              JOIN model m
-                                ON m.id = hlmo.model
-                              JOIN version
-                                ON version.id = hlmo.version
-                             WHERE hlmo.highlevel IN :ids
-                               AND m.status = 'show'
-                        """), {
-                            'ids': tuple(i['id'] for i in data_list)
-                        })
-
+                    # get data for the all the hlids in the current chunk which have no document
+                    missing_ids = tuple(i['id'] for i in data_list if i['document'] is None)
+                    if missing_ids:
+                        result_inner = connection_inner.execute(sqlalchemy.text("""
+                                SELECT m.model AS model
+                                     , hlmo.data AS model_data
+                                     , version.data AS version
+                                     , hlmo.highlevel AS id
+                                  FROM highlevel_model hlmo
+                                  JOIN model m
+                                    ON m.id = hlmo.model
+                                  JOIN version
+                                    ON version.id = hlmo.version
+                                 WHERE hlmo.highlevel IN :ids
+                                   AND m.status = 'show'
+                            """), {
+                                'ids': missing_ids
+                            })
+                        model_rows = result_inner.fetchall()
+                    else:
+                        model_rows = []
 
                     # consolidate the different models for each hlid into dicts
                     highlevel_models = defaultdict(dict)
-                    for row in result_inner.fetchall():
+                    for row in model_rows:
                         model, model_data, version, hlid = row['model'], row['model_data'], row['version'], row['id']
                         model_data['version'] = version
                         highlevel_models[hlid][model] = model_data
@@ -729,10 +741,12 @@ def dump_highlevel_json(location, incremental=False, dump_id=None):
                     for row in data_list:
                         mbid = str(row['mbid'])
                         hlid = row['id']
-                        hl_data = {
-                            'metadata': row['metadata'],
-                            'highlevel': highlevel_models[hlid],
-                        }
+                        hl_data = row['document']
+                        if hl_data is None:
+                            hl_data = {
+                                'metadata': row['metadata'],
+                                'highlevel': highlevel_models[hlid],
+                            }
 
                         json_filename = '{mbid}-{no}.json'.format(mbid=mbid, no=mbid_occurences[mbid])
                         dump_tempfile = os.path.join(temp_dir, json_filename)
@@ -0,0 +1,208 @@
+"""Snapshot of the MBIDs of all recordings which have low-level data.
+
+Clients which sync a large library need to know which of their recordings are
+in AcousticBrainz. Instead of asking for each of them, they can download a
+snapshot of all MBIDs, or send thousands of MBIDs in one request to
+``POST /api/v1/exists``, which is answered from the snapshot in memory.
+
+A snapshot is a file with a header and the distinct values of `lowlevel.gid`
+as 16 bytes each, sorted in byte order::
+
+    8 bytes   magic, "ABMBID01"
+    8 bytes   number of MBIDs, big-endian
+    8 bytes   largest `lowlevel.id` when the snapshot was built, big-endian
+    16 bytes  for each MBID
+
+It is built by `manage.py mbid_snapshot build`, which should be run
+periodically. Each process maps the file into memory the first time it is used
+(so the pages are shared between the processes of a server) and loads it
+again within CHECK_INTERVAL seconds of it being replaced. Recordings submitted
+after the snapshot was built are looked up in the database by
+:func:`get_existing`.
+"""
+import datetime
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+
+import pytz
+from sqlalchemy import text
+
+import db
+
+SNAPSHOT_MAGIC = b"ABMBID01"
+SNAPSHOT_HEADER = struct.Struct("!8sQQ")
+MBID_SIZE = 16
+
+SCAN_BATCH_SIZE = 10000
+# Number of MBIDs which get_existing looks up in one query
+LOOKUP_CHUNK_SIZE = 1000
+
+# How often (in seconds) a process checks if the snapshot file was replaced
+CHECK_INTERVAL = 60
+
+_config = {"snapshot_path": None}
+_state = {"snapshot": None, "mtime": None, "checked": 0}
+_lock = threading.Lock()
+
+
+class MbidSnapshot(object):
+    """A sorted list of MBIDs which is searched without being decoded."""
+
+    def __init__(self, data, count, last_lowlevel_id, built=None):
+        """
+        Args:
+            data: the MBIDs as a buffer of `count` sorted 16 byte values
+            count: the number of MBIDs
+            last_lowlevel_id: the largest `lowlevel.id` which is included
+            built: the time when the snapshot was written, as a datetime
+        """
+        self.data = data
+        self.count = count
+        self.last_lowlevel_id = last_lowlevel_id
+        self.built = built
+
+    def __contains__(self, mbid):
+        key = uuid.UUID(mbid).bytes
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.data[mid * MBID_SIZE:(mid + 1) * MBID_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self.data[lo * MBID_SIZE:(lo + 1) * MBID_SIZE] == key
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield str(uuid.UUID(bytes=bytes(self.data[i * MBID_SIZE:(i + 1) * MBID_SIZE])))
+
+    @classmethod
+    def load(cls, path):
+        """Map a snapshot file into memory."""
+        with open(path, "rb") as f:
+            header = f.read(SNAPSHOT_HEADER.size)
+            if len(header) != SNAPSHOT_HEADER.size:
+                raise ValueError("%s is not an MBID snapshot" % path)
+            magic, count, last_lowlevel_id = SNAPSHOT_HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("%s is not an MBID snapshot" % path)
+            if os.fstat(f.fileno()).st_size != SNAPSHOT_HEADER.size + count * MBID_SIZE:
+                raise ValueError("Snapshot %s is truncated" % path)
+            if count:
+                data = buffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), SNAPSHOT_HEADER.size)
+            else:
+                data = b""
+        built = datetime.datetime.fromtimestamp(os.path.getmtime(path), pytz.utc)
+        return cls(data, count, last_lowlevel_id, built)
+
+
+def build(path):
+    """Write a snapshot of the MBIDs in `lowlevel` to a file. The file is replaced atomically.
+
+    Returns:
+        the number of MBIDs in the snapshot
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    count = 0
+    with db.engine.connect() as connection:
+        last_lowlevel_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM lowlevel").fetchone()[0]
+        # uuid values are ordered by their bytes, so they don't need to be sorted again
+        result = connection.execution_options(stream_results=True).execute(
+            text("""SELECT DISTINCT gid
+                      FROM lowlevel
+                     WHERE id <= :last_lowlevel_id
+                  ORDER BY gid"""), {"last_lowlevel_id": last_lowlevel_id})
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, last_lowlevel_id))
+            while True:
+                rows = result.fetchmany(SCAN_BATCH_SIZE)
+                if not rows:
+                    break
+                f.write(b"".join(uuid.UUID(str(row[0])).bytes for row in rows))
+                count += len(rows)
+            f.seek(0)
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, last_lowlevel_id))
+    os.rename(tmp_path, path)
+    return count
+
+
+def init(snapshot_path=None):
+    """Configure the snapshot of this process.
+
+    Args:
+        snapshot_path: the snapshot file written by :func:`build`. If it's not set or the
+            file doesn't exist, :func:`get_existing` looks up all MBIDs in the database.
+    """
+    with _lock:
+        _config["snapshot_path"] = snapshot_path
+        _state.update({"snapshot": None, "mtime": None, "checked": 0})
+
+
+def get_snapshot_path():
+    return _config["snapshot_path"]
+
+
+def get_snapshot():
+    """Get the snapshot of this process, loading it if the file was replaced.
+
+    Returns:
+        an :class:`MbidSnapshot`, or None if there is no snapshot
+    """
+    path = _config["snapshot_path"]
+    if not path:
+        return None
+    now = time.time()
+    with _lock:
+        if now - _state["checked"] < CHECK_INTERVAL:
+            return _state["snapshot"]
+        _state["checked"] = now
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if mtime != _state["mtime"]:
+            _state["snapshot"] = MbidSnapshot.load(path) if mtime is not None else None
+            _state["mtime"] = mtime
+            if _state["snapshot"] is not None:
+                logging.info("Loaded MBID snapshot with %d MBIDs from %s" % (_state["snapshot"].count, path))
+        return _state["snapshot"]
+
+
+def get_existing(mbids):
+    """Find out which recordings have low-level data.
+
+    MBIDs which are not in the snapshot are looked up in the rows of `lowlevel`
+    added since it was built. Without a snapshot, all of them are looked up in
+    the database.
+
+    Args:
+        mbids: a list of lower-case recording MBIDs
+
+    Returns:
+        the set of the MBIDs which have low-level data
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        found, missing, last_lowlevel_id = set(), set(mbids), 0
+    else:
+        found = set(mbid for mbid in mbids if mbid in snapshot)
+        missing, last_lowlevel_id = set(mbids) - found, snapshot.last_lowlevel_id
+    if missing:
+        query = text("""
+            SELECT DISTINCT gid::text
+              FROM lowlevel
+             WHERE id > :last_lowlevel_id
+               AND gid = ANY(CAST(:mbids AS uuid[]))
+        """)
+        with db.connect() as connection:
+            missing = sorted(missing)
+            for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+                result = connection.execute(query, {"last_lowlevel_id": last_lowlevel_id, "mbids": chunk})
+                found.update(row[0] for row in result.fetchall())
+    return found
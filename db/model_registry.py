@@ -0,0 +1,202 @@
+"""In-process registry of high-level models and versions.
+
+High-level documents are put together from rows of `highlevel_model`, which
+refer to a row of the `model` table (for the name, status and class mapping of
+the model) and of the `version` table. There are only a few models and
+high-level versions, so instead of joining these tables in every high-level
+query they are kept in memory in each process.
+
+Versions never change, so a version is loaded the first time it is used and
+then kept. Models can change, so they are reloaded:
+
+* in this process, right after :func:`invalidate` is called. This is done by
+  :func:`db.data.add_model` and :func:`db.data.set_model_status`.
+* in other processes, within CHECK_INTERVAL seconds of a call to
+  :func:`invalidate`, if the registry is shared (see :func:`init`). Class
+  mappings are edited directly in the database, so run
+  `manage.py invalidate_highlevel_cache` after changing them.
+* in any case, when they were loaded more than MAX_AGE seconds ago.
+"""
+import json
+import threading
+import time
+import uuid
+from hashlib import sha256
+
+from brainzutils import cache
+from sqlalchemy import text
+
+import db
+
+NAMESPACE = "model-registry"
+GENERATION_KEY = "generation"
+
+# How often (in seconds) a process checks if the models were changed by another process
+CHECK_INTERVAL = 5
+# Models are reloaded if they are older than this (in seconds)
+MAX_AGE = 5 * 60
+
+STATUS_SHOW = 'show'
+
+_config = {"shared": False}
+_lock = threading.Lock()
+# invalidations counts the changes to the models which this process knows about, so
+# that models which were loaded before a change are not stored after it
+_state = {"models": None, "fingerprint": None, "model_state": None, "loaded": 0, "checked": 0, "generation": None,
+          "invalidations": 0}
+_versions = {}
+
+
+def init(shared=False):
+    """Configure the registry of this process.
+
+    Args:
+        shared: if True, a change to the models in another process is noticed
+            within CHECK_INTERVAL seconds. This needs the redis cache.
+    """
+    _config["shared"] = shared
+    clear()
+
+
+def clear():
+    """Remove all models and versions from the registry of this process."""
+    with _lock:
+        _state.update({"models": None, "fingerprint": None, "model_state": None,
+                       "loaded": 0, "checked": 0, "generation": None})
+        _state["invalidations"] += 1
+        _versions.clear()
+
+
+def invalidate():
+    """Reload the models, because they have changed.
+
+    If the registry is shared, other processes also reload their models.
+    """
+    generation = uuid.uuid4().hex
+    if _config["shared"]:
+        cache.set(GENERATION_KEY, generation, namespace=NAMESPACE)
+    with _lock:
+        _state.update({"models": None, "generation": generation})
+        _state["invalidations"] += 1
+
+
+def _is_stale(now):
+    if _state["models"] is None or now - _state["loaded"] > MAX_AGE:
+        return True
+    if _config["shared"] and now - _state["checked"] >= CHECK_INTERVAL:
+        generation = cache.get(GENERATION_KEY, namespace=NAMESPACE)
+        _state["checked"] = now
+        if generation != _state["generation"]:
+            _state["generation"] = generation
+            _state["invalidations"] += 1
+            return True
+    return False
+
+
+def _load_models():
+    with db.connect() as connection:
+        result = connection.execute(text("SELECT * FROM model ORDER BY id"))
+        return {row["id"]: dict(row) for row in result.fetchall()}
+
+
+def _fingerprint(models):
+    """A digest of the active models and their class mappings."""
+    active = [(model_id, model["class_mapping"]) for model_id, model in sorted(models.items())
+              if model["status"] == STATUS_SHOW]
+    return sha256(json.dumps(active, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _model_state(models):
+    """A digest of the ids of the active models."""
+    active = [model_id for model_id, model in sorted(models.items()) if model["status"] == STATUS_SHOW]
+    return sha256(json.dumps(active).encode("utf-8")).hexdigest()
+
+
+def _get_models():
+    now = time.time()
+    with _lock:
+        if not _is_stale(now):
+            return _state["models"]
+        invalidations = _state["invalidations"]
+    models = _load_models()
+    with _lock:
+        # If the models were invalidated while they were loaded, they may be older than
+        # the change. They are returned to this caller, and loaded again by the next one.
+        if _state["invalidations"] == invalidations:
+            _state.update({"models": models, "fingerprint": _fingerprint(models),
+                           "model_state": _model_state(models), "loaded": now})
+    return models
+
+
+def get_models():
+    """Get all models.
+
+    Returns:
+        a dictionary {model id: model row}. The rows must not be changed.
+    """
+    return _get_models()
+
+
+def get_active_models():
+    """Get the models with the status `show`, ordered by id.
+
+    Returns:
+        a list of model rows, as dictionaries which the caller can change
+    """
+    return [dict(model) for model_id, model in sorted(_get_models().items())
+            if model["status"] == STATUS_SHOW]
+
+
+def get_active_models_by_id():
+    """Get the models with the status `show`.
+
+    Returns:
+        a dictionary {model id: model row}. The rows must not be changed.
+    """
+    return {model_id: model for model_id, model in _get_models().items() if model["status"] == STATUS_SHOW}
+
+
+def get_fingerprint():
+    """Get a digest which changes when the active models or their class mappings change."""
+    models = _get_models()
+    with _lock:
+        if _state["models"] is models:
+            return _state["fingerprint"]
+    return _fingerprint(models)
+
+
+def get_model_state():
+    """Get a digest which changes when the set of active models changes.
+
+    Unlike :func:`get_fingerprint` this doesn't depend on class mappings. It is
+    stored with materialised high-level documents, see :func:`db.data.write_high_level_documents`.
+    """
+    models = _get_models()
+    with _lock:
+        if _state["models"] is models:
+            return _state["model_state"]
+    return _model_state(models)
+
+
+def get_versions(version_ids):
+    """Get the data of versions, loading the ones which are not in the registry yet.
+
+    Args:
+        version_ids: a list of ids of rows in the `version` table
+
+    Returns:
+        a dictionary {version id: serialised version data}
+    """
+    version_ids = set(version_ids)
+    with _lock:
+        found = {version_id: _versions[version_id] for version_id in version_ids if version_id in _versions}
+    missing = version_ids - set(found)
+    if missing:
+        with db.connect() as connection:
+            result = connection.execute(text("SELECT id, data::text FROM version WHERE id IN :ids"),
+                                        {"ids": tuple(missing)})
+            loaded = {row["id"]: row["data"] for row in result.fetchall()}
+        with _lock:
+            _versions.update(loaded)
+        found.update(loaded)
+    return found
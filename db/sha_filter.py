@@ -0,0 +1,206 @@
+"""Membership filter over the sha256 hashes of low-level documents.
+
+Many clients submit the same files more than once. To avoid a database query
+for every submission just to find out that it is new, each process keeps a
+Bloom filter of the `data_sha256` values in `lowlevel_json`. If the filter says
+that a hash is not present, the submission is written without first looking
+for an existing copy. If the filter says that a hash may be present, the
+database is checked as before.
+
+The filter is built from a scan of `lowlevel_json` or loaded from a snapshot
+file (see `manage.py sha_filter`) by :func:`load` when the web server starts,
+and every document written by the process is added to it. It is never built
+while a request is handled, and other users of the app (e.g. `manage.py`
+commands) don't load it; until it is loaded, every hash may be present.
+Documents written by other processes after the filter was built are not in
+the filter, so a "not present" answer can be wrong. This is safe because `lowlevel_json.data_sha256` has a
+unique index: the insert of a document that already exists fails, and is
+treated as a duplicate by :func:`db.data.write_low_level`.
+"""
+import logging
+import math
+import os
+import struct
+import threading
+from hashlib import sha256
+
+from sqlalchemy import text
+
+import db
+
+DEFAULT_CAPACITY = 10000000
+DEFAULT_ERROR_RATE = 0.01
+
+# A sha256 hex digest is split into 8 slices of 32 bits, one for each hash function
+MAX_HASHES = 8
+
+SNAPSHOT_MAGIC = b"ABSHAF01"
+SNAPSHOT_HEADER = struct.Struct("!8sQIQ")
+
+SCAN_BATCH_SIZE = 10000
+
+_config = {"enabled": False, "snapshot_path": None, "capacity": None, "error_rate": DEFAULT_ERROR_RATE}
+_filter = None
+_filter_lock = threading.Lock()
+
+
+class ShaFilter(object):
+    """A Bloom filter of sha256 hex digests."""
+
+    def __init__(self, num_bits, num_hashes, count=0, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """Create an empty filter which has the given false positive rate when it
+        contains `capacity` items."""
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_hashes = int(round(float(num_bits) / capacity * math.log(2)))
+        return cls(num_bits, min(max(num_hashes, 1), MAX_HASHES))
+
+    def _positions(self, data_sha256):
+        return [int(data_sha256[i * 8:(i + 1) * 8], 16) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, data_sha256):
+        with self._lock:
+            for position in self._positions(data_sha256):
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, data_sha256):
+        for position in self._positions(data_sha256):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_false_positive_rate(self):
+        """The expected false positive rate for the number of items added to the filter."""
+        return (1 - math.exp(-float(self.num_hashes) * self.count / self.num_bits)) ** self.num_hashes
+
+    def measure_false_positive_rate(self, samples=100000):
+        """Measure the false positive rate by looking up hashes which were never added."""
+        positives = 0
+        for i in range(samples):
+            if sha256(os.urandom(16)).hexdigest() in self:
+                positives += 1
+        return float(positives) / samples
+
+    def save(self, path):
+        """Write the filter to a snapshot file. The file is replaced atomically."""
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with self._lock:
+            with open(tmp_path, "wb") as f:
+                f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self.num_bits, self.num_hashes, self.count))
+                f.write(self.bits)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a filter from a snapshot file written by :meth:`save`."""
+        with open(path, "rb") as f:
+            magic, num_bits, num_hashes, count = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("%s is not a sha256 filter snapshot" % path)
+            bits = bytearray(f.read())
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError("Snapshot %s is truncated" % path)
+        return cls(num_bits, num_hashes, count, bits)
+
+
+def build(capacity=None, error_rate=DEFAULT_ERROR_RATE):
+    """Build a filter containing the hashes of all documents in `lowlevel_json`.
+
+    Args:
+        capacity: the number of items the filter is sized for. By default, twice the
+            estimated number of rows in `lowlevel_json`, and at least DEFAULT_CAPACITY.
+        error_rate: the false positive rate of the filter when it is full
+    """
+    with db.engine.connect() as connection:
+        if capacity is None:
+            result = connection.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = 'lowlevel_json'")
+            row = result.fetchone()
+            capacity = max(DEFAULT_CAPACITY, 2 * (row[0] if row else 0))
+        sha_filter = ShaFilter.for_capacity(capacity, error_rate)
+
+        result = connection.execution_options(stream_results=True).execute(
+            text("SELECT data_sha256 FROM lowlevel_json"))
+        while True:
+            rows = result.fetchmany(SCAN_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                sha_filter.add(row[0])
+    return sha_filter
+
+
+def init(enabled=False, snapshot_path=None, capacity=None, error_rate=DEFAULT_ERROR_RATE):
+    """Configure the filter of this process.
+
+    The filter isn't loaded or built until :func:`load` is called.
+
+    Args:
+        enabled: if False, :func:`might_contain` always returns True
+        snapshot_path: a snapshot to load instead of scanning the database, if it exists
+        capacity, error_rate: the size of the filter when it is built from the database (see :func:`build`)
+    """
+    global _filter
+    with _filter_lock:
+        _config.update({"enabled": enabled, "snapshot_path": snapshot_path,
+                        "capacity": capacity, "error_rate": error_rate})
+        _filter = None
+
+
+def load():
+    """Load the filter of this process from its snapshot, or build it from the
+    database if there is no snapshot. Nothing is done if the filter is not enabled.
+
+    The web server calls this when it starts (see :func:`webserver.load_sha_filter`),
+    before it forks its worker processes, so that they share the memory of the filter.
+    """
+    global _filter
+    if not _config["enabled"]:
+        return
+    with _filter_lock:
+        snapshot_path = _config["snapshot_path"]
+        if snapshot_path and os.path.exists(snapshot_path):
+            _filter = ShaFilter.load(snapshot_path)
+            logging.info("Loaded sha256 filter with %d items from %s" % (_filter.count, snapshot_path))
+        else:
+            _filter = build(_config["capacity"], _config["error_rate"])
+            logging.info("Built sha256 filter with %d items" % _filter.count)
+
+
+def get_filter():
+    """Get the filter of this process.
+
+    Returns:
+        a :class:`ShaFilter`, or None if the filter is not enabled or was not loaded
+        with :func:`load` yet
+    """
+    if not _config["enabled"]:
+        return None
+    return _filter
+
+
+def might_contain(data_sha256):
+    """Check if a document with this hash may already be in the database.
+
+    Returns:
+        False if the document is definitely not in the filter, otherwise True
+    """
+    sha_filter = get_filter()
+    if sha_filter is None:
+        return True
+    return data_sha256 in sha_filter
+
+
+def add(data_sha256):
+    """Add the hash of a document written to the database to the filter."""
+    sha_filter = get_filter()
+    if sha_filter is not None:
+        sha_filter.add(data_sha256)
@@ -0,0 +1,84 @@
+"""Coalescing of identical concurrent database loads.
+
+If several threads of a process ask for the same thing at the same time (for
+example a crawler which sends the same lookup many times in parallel), only the
+first one runs the query and the others wait for its result::
+
+    documents = db.single_flight.do(("ll", tuple(recordings)), lambda: load(recordings))
+
+The result is shared between all of the waiting threads, so it must not be
+changed by them. Loads are only coalesced between the threads of a process, so
+this helps when the web server runs with more than one thread per process.
+"""
+import threading
+
+_lock = threading.Lock()
+_calls = {}
+_stats = {"calls": 0, "shared": 0}
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def do(key, load):
+    """Call `load`, unless a call with the same key is already running in another thread.
+
+    Args:
+        key: a hashable identifier of the result of `load`
+        load: a function without arguments
+
+    Returns:
+        the result of `load`, from this call or from the running call
+
+    Raises:
+        the exception raised by `load`, in all threads which waited for it
+    """
+    with _lock:
+        call = _calls.get(key)
+        if call is None:
+            call = _calls[key] = _Call()
+            _stats["calls"] += 1
+            leader = True
+        else:
+            _stats["shared"] += 1
+            leader = False
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = load()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+
+
+def get_stats():
+    """Get the counters of this process.
+
+    Returns:
+        a dictionary {"calls": n, "shared": n} where calls is the number of loads
+        which were run, and shared is the number of calls which waited for the result
+        of a load in another thread instead of running it.
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,261 @@
+"""Durable on-disk spool for low-level submissions.
+
+When the webserver is configured with a spool directory, validated
+submissions are appended to a segment file on local disk instead of being
+written to the database during the request. A separate worker
+(`manage.py spool drain`) writes the spooled submissions to the database in
+large batches with :func:`db.data.write_many_low_level`, which keeps the
+deduplication by sha256 and the submission offsets of normal submissions.
+
+Submissions are appended to the *active* segment, one JSON document per line.
+Writers hold an exclusive lock on the segment while appending and fsync it
+before returning, so a submission is on disk when the client gets a response.
+The drain worker *seals* the active segment by renaming it (under the same
+lock), and only ever reads sealed segments. A drain worker holds an exclusive
+lock on a sealed segment while it drains it, so that several workers can drain
+the same spool without writing a segment twice. A segment is deleted once all
+of its submissions are in the database. If the worker stops while draining a
+segment its lock is released, the whole segment is written again by the next
+worker, and the submissions that were already written are skipped as duplicates.
+"""
+import errno
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+
+import db.data
+
+ACTIVE_SEGMENT_NAME = "active.ndjson"
+SEGMENT_SUFFIX = ".segment"
+REJECTED_FILE_NAME = "rejected.ndjson"
+
+DEFAULT_DRAIN_BATCH_SIZE = 100
+
+
+def append(spool_dir, mbid, data, gid_type):
+    """Append a single validated submission to the spool."""
+    append_many(spool_dir, [(mbid, data)], gid_type)
+
+
+def append_many(spool_dir, submissions, gid_type):
+    """Append validated submissions to the spool.
+
+    All submissions are written to disk and synced before this function returns.
+
+    Args:
+        spool_dir: the spool directory
+        submissions: a list of (mbid, data) tuples. The data must already have
+            been checked with :func:`db.data.validate_low_level_data`.
+        gid_type: the ID type [musicbrainzid(mbid) or messybrainzid(msid)]
+    """
+    lines = []
+    for mbid, data in submissions:
+        lines.append(json.dumps({"mbid": str(mbid), "gid_type": gid_type, "data": data},
+                                separators=(',', ':')) + "\n")
+
+    fd = _open_active_segment(spool_dir)
+    try:
+        os.write(fd, "".join(lines).encode("utf-8"))
+        os.fsync(fd)
+    finally:
+        # Closing the file also releases the lock
+        os.close(fd)
+
+
+def _open_active_segment(spool_dir):
+    """Open the active segment for appending and lock it.
+
+    Returns:
+        a file descriptor which must be closed by the caller to release the lock
+    """
+    path = os.path.join(spool_dir, ACTIVE_SEGMENT_NAME)
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # The drain worker may have sealed the segment while we were waiting for the lock,
+        # in which case we have to open the new active segment
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                os.close(fd)
+                raise
+        os.close(fd)
+
+
+def seal_active_segment(spool_dir):
+    """Seal the active segment so that it can be drained.
+
+    Returns:
+        the path of the sealed segment, or None if there were no new submissions
+    """
+    path = os.path.join(spool_dir, ACTIVE_SEGMENT_NAME)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_size == 0:
+            return None
+        # Millisecond timestamps are zero-padded so that segments sort in the order they were sealed
+        sealed = os.path.join(spool_dir, "%015d-%s%s" % (int(time.time() * 1000), uuid.uuid4().hex, SEGMENT_SUFFIX))
+        os.rename(path, sealed)
+        return sealed
+    finally:
+        os.close(fd)
+
+
+def list_sealed_segments(spool_dir):
+    """Get the paths of all sealed segments, oldest first."""
+    names = sorted(name for name in os.listdir(spool_dir) if name.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(spool_dir, name) for name in names]
+
+
+def read_segment(path):
+    """Read the submissions in a segment.
+
+    Lines which can't be parsed (for example, a partial line written while the
+    machine crashed) are logged and skipped.
+
+    Yields:
+        dictionaries with the keys mbid, gid_type and data
+    """
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning("Skipping bad line %d in spool segment %s" % (line_number, path))
+
+
+def _lock_sealed_segment(path):
+    """Lock a sealed segment for draining, unless another worker has locked it.
+
+    Returns:
+        a file descriptor which must be closed by the caller to release the lock, or
+        None if the segment is being drained by another worker or was already drained
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        os.close(fd)
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    # Another worker may have drained and deleted the segment between our open and lock
+    if os.fstat(fd).st_nlink == 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def drain_segment(spool_dir, path, batch_size=DEFAULT_DRAIN_BATCH_SIZE):
+    """Write all submissions in a sealed segment to the database, and then delete it.
+
+    Submissions which are rejected by the database are appended to the rejected file
+    in the spool directory.
+
+    Returns:
+        a dictionary with the number of submissions for each status, or None if the
+        segment is being drained by another worker
+    """
+    fd = _lock_sealed_segment(path)
+    if fd is None:
+        return None
+
+    try:
+        counts = {db.data.SUBMISSION_STATUS_OK: 0,
+                  db.data.SUBMISSION_STATUS_DUPLICATE: 0,
+                  db.data.SUBMISSION_STATUS_ERROR: 0}
+        batch = []
+        for item in read_segment(path):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                _write_batch(spool_dir, batch, counts)
+                batch = []
+        if batch:
+            _write_batch(spool_dir, batch, counts)
+
+        # The segment is deleted before the lock is released, so no other worker can drain it again
+        os.unlink(path)
+        return counts
+    finally:
+        os.close(fd)
+
+
+def _write_batch(spool_dir, batch, counts):
+    # Items in a batch are written in order, one write per gid type
+    gid_types = []
+    for item in batch:
+        if item["gid_type"] not in gid_types:
+            gid_types.append(item["gid_type"])
+
+    for gid_type in gid_types:
+        items = [item for item in batch if item["gid_type"] == gid_type]
+        statuses = db.data.write_many_low_level([(item["mbid"], item["data"]) for item in items], gid_type)
+        rejected = []
+        for item, status in zip(items, statuses):
+            counts[status["status"]] += 1
+            if status["status"] == db.data.SUBMISSION_STATUS_ERROR:
+                logging.warning("Spooled submission for %s was rejected: %s" % (item["mbid"], status["message"]))
+                rejected.append(json.dumps(item, separators=(',', ':')) + "\n")
+        if rejected:
+            with open(os.path.join(spool_dir, REJECTED_FILE_NAME), "a") as f:
+                f.writelines(rejected)
+
+
+def drain(spool_dir, batch_size=DEFAULT_DRAIN_BATCH_SIZE):
+    """Seal the active segment and write all sealed segments to the database.
+
+    Segments which are being drained by another worker are skipped.
+
+    Returns:
+        a dictionary with the number of submissions for each status
+    """
+    seal_active_segment(spool_dir)
+    counts = {db.data.SUBMISSION_STATUS_OK: 0,
+              db.data.SUBMISSION_STATUS_DUPLICATE: 0,
+              db.data.SUBMISSION_STATUS_ERROR: 0}
+    for path in list_sealed_segments(spool_dir):
+        segment_counts = drain_segment(spool_dir, path, batch_size)
+        if segment_counts is None:
+            continue
+        for status, count in segment_counts.items():
+            counts[status] += count
+    return counts
+
+
+def get_status(spool_dir):
+    """Get the number of segments and spooled submissions waiting to be drained.
+
+    Returns:
+        a dictionary {"segments": n, "submissions": n, "bytes": n}, including the active segment
+    """
+    paths = list_sealed_segments(spool_dir)
+    active = os.path.join(spool_dir, ACTIVE_SEGMENT_NAME)
+    if os.path.exists(active):
+        paths.append(active)
+
+    submissions = 0
+    size = 0
+    for path in paths:
+        size += os.path.getsize(path)
+        with open(path) as f:
+            submissions += sum(1 for line in f if line.strip())
+    return {"segments": len(paths), "submissions": submissions, "bytes": size}
@@ -50,7 +50,7 @@ def get_last_submitted_recordings():
     cache_key = "last-submitted-recordings"
     last_submissions = cache.get(cache_key)
     if not last_submissions:
-        with db.engine.connect() as connection:
+        with db.connect() as connection:
             # We are getting results with of offset of 10 rows because we'd
             # prefer to show recordings for which we already calculated
             # high-level data. This might not be the best way to do that.
@@ -89,7 +89,7 @@ def compute_stats(to_date):
         to_date: the date to compute statistics up to
     """
 
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         stats_date = _get_most_recent_stats_date(connection)
         if not stats_date:
             # If there have been no statistics, we start from the
@@ -126,7 +126,7 @@ def _write_stats(connection, date, stats):
 def add_stats_to_cache():
     """Compute the most recent statistics and add them to cache"""
     now = datetime.datetime.now(pytz.utc)
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         stats = _count_submissions_to_date(connection, now)
         cache.set(STATS_CACHE_KEY, stats,
                   time=STATS_CACHE_TIMEOUT, namespace=STATS_CACHE_NAMESPACE)
@@ -198,7 +198,7 @@ def load_statistics_data(limit=None):
         args["limit"] = int(limit)
         qtext += " LIMIT :limit"
     query = text(qtext)
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         stats_result = connection.execute(query, args)
         # We order by DESC in order to use the `limit` parameter, but
         # we actually need the stats in increasing order.
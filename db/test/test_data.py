@@ -7,6 +7,7 @@ import sqlalchemy
 
 import db.data
 import db.exceptions
+import db.model_registry
 from db.testing import DatabaseTestCase, TEST_DATA_PATH, gid_types
 
 
@@ -22,60 +23,136 @@ class DataDBTestCase(DatabaseTestCase):
         self.test_lowlevel_data_json_two = open(os.path.join(TEST_DATA_PATH, self.test_mbid_two + '.json')).read()
         self.test_lowlevel_data_two = json.loads(self.test_lowlevel_data_json_two)
 
-    @mock.patch("db.data.sanity_check_data")
     @mock.patch("db.data.write_low_level")
-    @mock.patch("db.data.clean_metadata")
-    def test_submit_low_level_data(self, clean, write, sanity):
+    def test_submit_low_level_data(self, write):
         """Submission with valid data"""
-        clean.side_effect = lambda x: x
-        sanity.return_value = None
-
         db.data.submit_low_level_data(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
-        write.assert_called_with(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        serialized = db.data.serialize_low_level_data(self.test_lowlevel_data)
+        write.assert_called_with(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID, serialized)
+        self.assertEqual(serialized[0], json.dumps(self.test_lowlevel_data, sort_keys=True, separators=(',', ':')))
 
-    @mock.patch("db.data.sanity_check_data")
     @mock.patch("db.data.write_low_level")
-    @mock.patch("db.data.clean_metadata")
-    def test_submit_low_level_data_rewrite_keys(self, clean, write, sanity):
+    def test_submit_low_level_data_rewrite_keys(self, write):
         """submit rewrites trackid -> recordingid, and sets lossless to a boolean"""
-        clean.side_effect = lambda x: x
-        sanity.return_value = None
+        input = copy.deepcopy(self.test_lowlevel_data)
+        input["metadata"]["tags"]["musicbrainz_trackid"] = input["metadata"]["tags"].pop("musicbrainz_recordingid")
+        input["metadata"]["audio_properties"]["lossless"] = 1
+        input["metadata"]["tags"]["unknown_tag"] = ["Hello! I am an unknown tag!"]
 
-        input = {"metadata": {"tags": {"musicbrainz_trackid": [self.test_mbid]}, "audio_properties": {"lossless": 1}}}
-        output = {
-            "metadata": {"tags": {"musicbrainz_recordingid": [self.test_mbid]}, "audio_properties": {"lossless": True}}}
+        output = copy.deepcopy(self.test_lowlevel_data)
+        output["metadata"]["audio_properties"]["lossless"] = True
 
-        db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
-        write.assert_called_with(self.test_mbid, output, gid_types.GID_TYPE_MBID)
+        db.data.submit_low_level_data(self.test_mbid, copy.deepcopy(input), gid_types.GID_TYPE_MBID)
+        write.assert_called_with(self.test_mbid, output, gid_types.GID_TYPE_MBID,
+                                 db.data.serialize_low_level_data(output))
 
-        input = {"metadata": {"tags": {"musicbrainz_trackid": [self.test_mbid]}, "audio_properties": {"lossless": 1}}}
-        db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MSID)
-        write.assert_called_with(self.test_mbid, output, gid_types.GID_TYPE_MSID)
+        db.data.submit_low_level_data(self.test_mbid, copy.deepcopy(input), gid_types.GID_TYPE_MSID)
+        write.assert_called_with(self.test_mbid, output, gid_types.GID_TYPE_MSID,
+                                 db.data.serialize_low_level_data(output))
 
-    @mock.patch("db.data.sanity_check_data")
     @mock.patch("db.data.write_low_level")
-    @mock.patch("db.data.clean_metadata")
-    def test_submit_low_level_data_bad_mbid(self, clean, write, sanity):
+    def test_submit_low_level_data_bad_mbid(self, write):
         """Check that hl write raises an error if the provided mbid is different to what is in the metadata"""
-        clean.side_effect = lambda x: x
-        sanity.return_value = None
+        input = copy.deepcopy(self.test_lowlevel_data)
+        input["metadata"]["tags"]["musicbrainz_recordingid"] = ["not-the-recording-mbid"]
 
-        input = {"metadata": {"tags": {"musicbrainz_recordingid": ["not-the-recording-mbid"]},
-                              "audio_properties": {"lossless": False}}}
+        with self.assertRaises(db.exceptions.BadDataException):
+            db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
 
+        input["metadata"]["tags"]["musicbrainz_recordingid"] = self.test_mbid
         with self.assertRaises(db.exceptions.BadDataException):
             db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
+        write.assert_not_called()
 
-    @mock.patch("db.data.sanity_check_data")
     @mock.patch("db.data.write_low_level")
-    @mock.patch("db.data.clean_metadata")
-    def test_submit_low_level_data_missing_keys(self, clean, write, sanity):
+    def test_submit_low_level_data_missing_keys(self, write):
         """Check that hl write raises an error if some required keys are missing"""
-        clean.side_effect = lambda x: x
-        sanity.return_value = ["missing", "key"]
+        input = copy.deepcopy(self.test_lowlevel_data)
+        del input["metadata"]["version"]["essentia_git_sha"]
+        with self.assertRaisesRegexp(db.exceptions.BadDataException, "metadata : version : essentia_git_sha"):
+            db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
+
+        # If a section is missing, the first required key in it is reported
+        input = copy.deepcopy(self.test_lowlevel_data)
+        del input["metadata"]["audio_properties"]
+        with self.assertRaisesRegexp(db.exceptions.BadDataException, "metadata : audio_properties : length"):
+            db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
+        write.assert_not_called()
+
+    @mock.patch("db.data.write_low_level")
+    def test_submit_low_level_data_wrong_types(self, write):
+        """Sections of the document which contain other keys must be objects"""
+        input = copy.deepcopy(self.test_lowlevel_data)
+        input["rhythm"] = [1, 2, 3]
+        with self.assertRaisesRegexp(db.exceptions.BadDataException, "Key 'rhythm' must be an object"):
+            db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
+
+        input = copy.deepcopy(self.test_lowlevel_data)
+        input["metadata"]["tags"] = "tags"
+        with self.assertRaisesRegexp(db.exceptions.BadDataException, "Key 'metadata : tags' must be an object"):
+            db.data.submit_low_level_data(self.test_mbid, input, gid_types.GID_TYPE_MBID)
 
         with self.assertRaises(db.exceptions.BadDataException):
-            db.data.submit_low_level_data(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+            db.data.submit_low_level_data(self.test_mbid, [], gid_types.GID_TYPE_MBID)
+        write.assert_not_called()
+
+    def test_submit_many_low_level_data(self):
+        """Valid submissions are written, and invalid ones get an error status"""
+        bad_data = copy.deepcopy(self.test_lowlevel_data)
+        del bad_data["metadata"]["tags"]["file_name"]
+
+        statuses = db.data.submit_many_low_level_data(
+            [(self.test_mbid, copy.deepcopy(self.test_lowlevel_data)),
+             (self.test_mbid, bad_data),
+             (self.test_mbid_two, copy.deepcopy(self.test_lowlevel_data_two))],
+            gid_types.GID_TYPE_MBID)
+
+        self.assertEqual([s["status"] for s in statuses], [db.data.SUBMISSION_STATUS_OK,
+                                                           db.data.SUBMISSION_STATUS_ERROR,
+                                                           db.data.SUBMISSION_STATUS_OK])
+        self.assertEqual(statuses[1]["message"], "Key 'metadata : tags : file_name' was not found in submitted data.")
+        self.assertEqual(1, db.data.count_lowlevel(self.test_mbid))
+        self.assertEqual(1, db.data.count_lowlevel(self.test_mbid_two))
+
+    def test_write_many_low_level(self):
+        """A batch is written with the same offsets and deduplication as single submissions"""
+        one = {"data": "one",
+               "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        two = {"data": "two",
+               "metadata": {"audio_properties": {"lossless": False}, "version": {"essentia_build_sha": "x"}}}
+        three = {"data": "three",
+                 "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "y"}}}
+        db.data.write_low_level(self.test_mbid, one, gid_types.GID_TYPE_MBID)
+
+        statuses = db.data.write_many_low_level([(self.test_mbid, one),
+                                                 (self.test_mbid, two),
+                                                 (self.test_mbid, two),
+                                                 (self.test_mbid_two, three)], gid_types.GID_TYPE_MBID)
+        self.assertEqual([s["status"] for s in statuses], [db.data.SUBMISSION_STATUS_DUPLICATE,
+                                                           db.data.SUBMISSION_STATUS_OK,
+                                                           db.data.SUBMISSION_STATUS_DUPLICATE,
+                                                           db.data.SUBMISSION_STATUS_OK])
+
+        self.assertEqual(one, db.data.load_low_level(self.test_mbid, 0))
+        self.assertEqual(two, db.data.load_low_level(self.test_mbid, 1))
+        self.assertEqual(three, db.data.load_low_level(self.test_mbid_two, 0))
+        with db.engine.connect() as connection:
+            result = connection.execute("SELECT lossless FROM lowlevel WHERE gid = %s ORDER BY submission_offset",
+                                        (self.test_mbid,))
+            self.assertEqual([True, False], [r[0] for r in result])
+
+    def test_write_many_low_level_invalid_data(self):
+        """If one document in a batch is rejected by the database, the others are still saved"""
+        one = {"data": "one",
+               "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        bad = {"data": u"\uc544\uc774\uc720 (IU)\udc93",
+               "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+
+        statuses = db.data.write_many_low_level([(self.test_mbid, bad), (self.test_mbid, one)],
+                                                gid_types.GID_TYPE_MBID)
+        self.assertEqual([s["status"] for s in statuses], [db.data.SUBMISSION_STATUS_ERROR,
+                                                           db.data.SUBMISSION_STATUS_OK])
+        self.assertEqual(one, db.data.load_low_level(self.test_mbid, 0))
 
     def test_get_next_submission_offset(self):
         # Check that next max offset is returned
@@ -100,6 +177,82 @@ class DataDBTestCase(DatabaseTestCase):
             db.data.write_low_level(self.test_mbid_two, three, gid_types.GID_TYPE_MBID)
             self.assertEqual(1, db.data.get_next_submission_offset(connection, self.test_mbid_two))
 
+    def test_reserve_submission_offsets(self):
+        with db.engine.begin() as connection:
+            self.assertEqual(0, db.data.reserve_submission_offsets(connection, self.test_mbid))
+            self.assertEqual(1, db.data.reserve_submission_offsets(connection, self.test_mbid, count=3))
+            self.assertEqual(4, db.data.reserve_submission_offsets(connection, self.test_mbid))
+            self.assertEqual(5, db.data.get_next_submission_offset(connection, self.test_mbid))
+
+        # Offsets reserved in a transaction which is rolled back are reused
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        self.assertEqual(5, db.data.reserve_submission_offsets(connection, self.test_mbid))
+        transaction.rollback()
+        connection.close()
+        with db.engine.begin() as connection:
+            self.assertEqual(5, db.data.reserve_submission_offsets(connection, self.test_mbid))
+
+    def test_reserve_submission_offsets_existing_submissions(self):
+        """An mbid with submissions but no counter (e.g. from a data dump) starts after the existing offsets"""
+        with db.engine.begin() as connection:
+            connection.execute("""INSERT INTO lowlevel (gid, build_sha1, lossless, gid_type, submission_offset)
+                                       VALUES (%s, 'x', 't', 'mbid', 0), (%s, 'x', 't', 'mbid', 1)""",
+                               (self.test_mbid, self.test_mbid))
+            self.assertEqual(2, db.data.reserve_submission_offsets(connection, self.test_mbid))
+
+    def test_reserve_many_submission_offsets(self):
+        with db.engine.begin() as connection:
+            connection.execute("""INSERT INTO lowlevel (gid, build_sha1, lossless, gid_type, submission_offset)
+                                       VALUES (%s, 'x', 't', 'mbid', 0)""", (self.test_mbid,))
+            offsets = db.data.reserve_many_submission_offsets(connection, {self.test_mbid: 2, self.test_mbid_two: 3})
+            self.assertEqual(offsets, {self.test_mbid: 1, self.test_mbid_two: 0})
+            offsets = db.data.reserve_many_submission_offsets(connection, {self.test_mbid: 1, self.test_mbid_two: 1})
+            self.assertEqual(offsets, {self.test_mbid: 3, self.test_mbid_two: 3})
+
+    def test_insert_version_cache(self):
+        """A version id is cached after the transaction that inserted it commits"""
+        version = {"essentia": "2.1-beta2", "essentia_build_sha": "x"}
+        before = db.data.get_version_cache_stats()
+        with db.engine.begin() as connection:
+            version_id = db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL)
+        stats = db.data.get_version_cache_stats()
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+        with db.engine.begin() as connection:
+            self.assertEqual(version_id, db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL))
+            # The same data with another type is a different version
+            hl_version_id = db.data.insert_version(connection, version, db.data.VERSION_TYPE_HIGHLEVEL)
+            self.assertNotEqual(version_id, hl_version_id)
+        self.assertEqual(db.data.get_version_cache_stats()["hits"] - stats["hits"], 1)
+
+    def test_insert_version_cache_rollback(self):
+        """A version inserted in a transaction that is rolled back isn't cached"""
+        version = {"essentia": "2.1-beta2", "essentia_build_sha": "x"}
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL)
+        transaction.rollback()
+        connection.close()
+        self.assertEqual(db.data.get_version_cache_stats()["size"], 0)
+
+        with db.engine.begin() as connection:
+            version_id = db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL)
+            result = connection.execute("SELECT id FROM version")
+            self.assertEqual([version_id], [r[0] for r in result])
+
+    def test_insert_version_existing(self):
+        """A version which another process has already inserted is only stored once"""
+        version = {"essentia": "2.1-beta2", "essentia_build_sha": "x"}
+        with db.engine.begin() as connection:
+            version_id = db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL)
+        db.data.clear_version_cache(local_only=True)
+
+        with db.engine.begin() as connection:
+            self.assertEqual(version_id, db.data.insert_version(connection, version, db.data.VERSION_TYPE_LOWLEVEL))
+            self.assertEqual(1, connection.execute("SELECT COUNT(*) FROM version").scalar())
+
     def test_write_load_low_level(self):
         """Writing and loading a dict returns the same data"""
         one = {"data": "one",
@@ -185,6 +338,72 @@ class DataDBTestCase(DatabaseTestCase):
 
         self.assertEqual(ll_expected, db.data.load_many_low_level(list(recordings)))
 
+        # The serialised documents are the same documents
+        ll_json = db.data.load_many_low_level_json(list(recordings))
+        self.assertEqual(ll_expected, {mbid: {offset: json.loads(data_json) for offset, data_json in offsets.items()}
+                                       for mbid, offsets in ll_json.items()})
+
+    def test_load_many_low_level_features(self):
+        ll = {"rhythm": {"bpm": 120, "beats_count": 10}, "lowlevel": {"mfcc": {"mean": [1, 2], "cov": [3]}},
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+
+        features = [["rhythm", "bpm"], ["lowlevel", "mfcc", "mean"], ["tonal", "key_key"],
+                    ["lowlevel", "mfcc"], ["lowlevel", "mfcc", "cov"]]
+        expected = {"rhythm": {"bpm": 120}, "lowlevel": {"mfcc": {"mean": [1, 2], "cov": [3]}}}
+        self.assertEqual({self.test_mbid: {"0": expected}},
+                         db.data.load_many_low_level([(self.test_mbid, 0)], features))
+
+        # The same parts of a document are selected from a cached document
+        self.assertEqual(expected, db.data._project_features(ll, db.data._remove_overlapping_features(features)))
+        self.assertEqual({"lowlevel": {"mfcc": {"mean": [1, 2]}}},
+                         db.data.load_low_level(self.test_mbid, 0, [["lowlevel", "mfcc", "mean"]]))
+        self.assertEqual({"lowlevel": {"mfcc": {"mean": [1, 2]}}},
+                         db.data._project_features(ll, [["lowlevel", "mfcc", "mean"]]))
+
+    def test_iter_low_level_json(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        db.data.write_low_level(self.test_mbid_two, self.test_lowlevel_data_two, gid_types.GID_TYPE_MBID)
+        recordings = [(self.test_mbid, 0), (self.test_mbid, 1), (self.test_mbid_two, 0)]
+        expected = db.data.load_many_low_level_json(recordings)
+
+        with mock.patch("db.data.ITER_CHUNK_SIZE", 2), mock.patch("db.data.ITER_FETCH_SIZE", 1):
+            documents = list(db.data.iter_low_level_json(recordings))
+        self.assertEqual(2, len(documents))
+        self.assertEqual(expected, {mbid: {str(offset): data_json} for mbid, offset, data_json in documents})
+
+        self.assertEqual([(self.test_mbid, 1), (self.test_mbid_two, 1)],
+                         sorted(db.data.iter_count_lowlevel([self.test_mbid, self.test_mbid_two])))
+
+    def test_get_low_level_sha256(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        with db.engine.connect() as connection:
+            data_sha256 = connection.execute("SELECT data_sha256 FROM lowlevel_json").fetchone()[0]
+        self.assertEqual(data_sha256, db.data.get_low_level_sha256(self.test_mbid))
+        self.assertEqual({(self.test_mbid, 0): data_sha256},
+                         db.data.get_many_low_level_sha256([(self.test_mbid, 0), (self.test_mbid, 1)]))
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.get_low_level_sha256(self.test_mbid, 1)
+
+    def test_get_high_level_digest(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id_from_mbid(self.test_mbid)[0]
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.get_high_level_digest(self.test_mbid)
+
+        db.data.add_model("model1", "v1", "show")
+        db.data.add_model("model2", "v1", "hidden")
+        ver = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        db.data.write_high_level(self.test_mbid, ll_id, {"highlevel": {"model1": {"x": "y"}, "model2": {"a": "b"}},
+                                                         "metadata": {"version": {"highlevel": ver}}}, "sha")
+        digest = db.data.get_high_level_digest(self.test_mbid)
+        self.assertEqual(digest, db.data.get_high_level_digest(self.test_mbid))
+        self.assertNotEqual(digest, db.data.get_high_level_digest(self.test_mbid, map_classes=True))
+
+        # Showing another model changes the document
+        db.data.set_model_status("model2", "v1", db.data.STATUS_SHOW)
+        self.assertNotEqual(digest, db.data.get_high_level_digest(self.test_mbid))
+
     def test_load_many_low_level_none(self):
         """If offset is too high or there are no submissions for the mbid, it is skipped."""
 
@@ -257,6 +476,66 @@ class DataDBTestCase(DatabaseTestCase):
             result = connection.execute("select id from highlevel where mbid = %s", (self.test_mbid,))
             self.assertEqual(result.rowcount, 1)
 
+    def test_high_level_documents(self):
+        ll = {"data": "one",
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        ver = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        hl = {"highlevel": {"model1": {"x": "y"}, "model2": {"a": "b"}},
+              "metadata": {"meta": "here",
+                           "version": {"highlevel": ver}
+                           }
+              }
+        db.data.add_model("model1", "v1", "show")
+        db.data.add_model("model2", "v1", "show")
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id_from_mbid(self.test_mbid)[0]
+        db.data.write_high_level(self.test_mbid, ll_id, hl, "test")
+
+        hl_expected = copy.deepcopy(hl)
+        for mname in ["model1", "model2"]:
+            hl_expected["highlevel"][mname]["version"] = ver
+
+        # write_high_level writes the materialised document, which is loaded instead of the models
+        self.assertEqual([], db.data.get_stale_high_level_document_ids())
+        with mock.patch("db.data._assemble_many_high_level") as assemble, \
+                mock.patch("db.data._assemble_many_high_level_json") as assemble_json:
+            self.assertEqual(hl_expected, db.data.load_high_level(self.test_mbid))
+            self.assertEqual(hl_expected, json.loads(db.data.load_high_level_json(self.test_mbid)))
+            assemble.assert_not_called()
+            assemble_json.assert_not_called()
+
+        # After a model is hidden the document is out of date, and it is put together from the models
+        db.data.set_model_status("model2", "v1", db.data.STATUS_HIDDEN)
+        del hl_expected["highlevel"]["model2"]
+        self.assertEqual([ll_id], db.data.get_stale_high_level_document_ids())
+        self.assertEqual(hl_expected, db.data.load_high_level(self.test_mbid))
+        self.assertEqual(hl_expected, json.loads(db.data.load_high_level_json(self.test_mbid)))
+
+        self.assertEqual([1], list(db.data.rebuild_high_level_documents()))
+        self.assertEqual([], db.data.get_stale_high_level_document_ids())
+        with mock.patch("db.data._assemble_many_high_level") as assemble:
+            self.assertEqual(hl_expected, db.data.load_high_level(self.test_mbid))
+            assemble.assert_not_called()
+
+    def test_rebuild_high_level_documents_batches(self):
+        db.data.add_model("model1", "v1", "show")
+        ver = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        for i in range(3):
+            ll = copy.deepcopy(self.test_lowlevel_data)
+            ll["metadata"]["tags"]["album"] = ["Album %d" % i]
+            db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        ll_ids = sorted(self._get_ll_id_from_mbid(self.test_mbid))
+        for ll_id in ll_ids:
+            hl = {"highlevel": {"model1": {"x": ll_id}}, "metadata": {"version": {"highlevel": ver}}}
+            db.data.write_high_level(self.test_mbid, ll_id, hl, "test")
+        with db.engine.begin() as connection:
+            connection.execute("DELETE FROM highlevel_document")
+
+        self.assertEqual(ll_ids, db.data.get_stale_high_level_document_ids())
+        self.assertEqual(ll_ids[1:], db.data.get_stale_high_level_document_ids(after=ll_ids[0]))
+        self.assertEqual([2, 1], list(db.data.rebuild_high_level_documents(batch_size=2)))
+        self.assertEqual([], db.data.get_stale_high_level_document_ids())
+
     def test_load_high_level_offset(self):
         # If there are two lowlevel items, but only one highlevel, we should raise NoDataFound
         second_data = copy.deepcopy(self.test_lowlevel_data)
@@ -554,6 +833,13 @@ class DataDBTestCase(DatabaseTestCase):
         }
         self.assertEqual(expected, db.data.load_many_high_level(list(recordings)))
 
+        hl_json = db.data.load_many_high_level_json(list(recordings))
+        self.assertEqual(expected, {mbid: {offset: json.loads(data_json) for offset, data_json in offsets.items()}
+                                    for mbid, offsets in hl_json.items()})
+        self.assertEqual(hl1_expected, json.loads(db.data.load_high_level_json(self.test_mbid)))
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.load_high_level_json(self.test_mbid, 3)
+
     def test_load_high_level_map_class_names(self):
         recordings = [(self.test_mbid, 0)]
 
@@ -586,6 +872,8 @@ class DataDBTestCase(DatabaseTestCase):
             connection.execute(
                 sqlalchemy.text("""UPDATE model set class_mapping = '{"one": "Class One", "two": "Class Two"}'::jsonb""")
             )
+        # Models are read from the model registry, which must be told about changes in the database
+        db.model_registry.invalidate()
 
         # Now with the mapping, the values in the expected values have been changed
         hl1_expected = copy.deepcopy(hl1)
@@ -598,6 +886,43 @@ class DataDBTestCase(DatabaseTestCase):
         }
         self.assertEqual(expected, db.data.load_many_high_level(list(recordings), map_classes=True))
 
+        # Documents are mapped in the same way when iterating, without the document cache
+        with mock.patch("db.data.db.document_cache") as document_cache:
+            documents = list(db.data.iter_high_level_json(recordings, map_classes=True))
+        self.assertEqual(expected, {mbid: {str(offset): json.loads(data_json)} for mbid, offset, data_json in documents})
+        self.assertEqual([], document_cache.mock_calls)
+
+    def test_get_many_submissions(self):
+        self.assertEqual({}, db.data.get_many_submissions([self.test_mbid]))
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.get_submissions(self.test_mbid)
+
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        second_data = copy.deepcopy(self.test_lowlevel_data)
+        second_data["metadata"]["audio_properties"].update({"codec": "flac", "bit_rate": None, "lossless": True})
+        db.data.submit_many_low_level_data([(self.test_mbid, second_data)], gid_types.GID_TYPE_MBID)
+        ll_ids = sorted(self._get_ll_id_from_mbid(self.test_mbid))
+        db.data.write_high_level(self.test_mbid, ll_ids[0], {"metadata": {"meta": "here"}}, "sha")
+        # A failed high-level submission has no metadata
+        db.data.write_high_level(self.test_mbid, ll_ids[1], {}, "sha")
+
+        submissions = db.data.get_submissions(self.test_mbid.upper())
+        self.assertEqual([0, 1], [submission["offset"] for submission in submissions])
+        self.assertEqual([("mp3", 236240, False), ("flac", None, True)],
+                         [(s["codec"], s["bit_rate"], s["lossless"]) for s in submissions])
+        self.assertEqual([True, False], [submission["highlevel"] for submission in submissions])
+        self.assertEqual({self.test_mbid: submissions},
+                         db.data.get_many_submissions([self.test_mbid, self.test_mbid_two]))
+
+    def test_get_codec_and_bit_rate(self):
+        def audio_properties(**properties):
+            return {"metadata": {"audio_properties": properties}}
+        self.assertEqual(("mp3", 320000), db.data._get_codec_and_bit_rate(audio_properties(codec="mp3", bit_rate=320000)))
+        self.assertEqual(("aac", 128000), db.data._get_codec_and_bit_rate(audio_properties(codec="aac", bit_rate=128000.4)))
+        self.assertEqual((None, None), db.data._get_codec_and_bit_rate(audio_properties(codec=None, bit_rate=None)))
+        self.assertEqual((None, None), db.data._get_codec_and_bit_rate(audio_properties(codec=1, bit_rate="x")))
+        self.assertEqual((None, None), db.data._get_codec_and_bit_rate(audio_properties(bit_rate=2 ** 40)))
+
     def test_count_lowlevel(self):
         db.data.submit_low_level_data(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
         self.assertEqual(1, db.data.count_lowlevel(self.test_mbid))
@@ -632,6 +957,133 @@ class DataDBTestCase(DatabaseTestCase):
         self.assertEqual(len(rows), 1)
         self.assertEqual(rows[0]["gid"], self.test_mbid)
 
+    def test_get_unprocessed_highlevel_documents(self):
+        ll = {"data": "one",
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        ll_two = dict(ll, data="two")
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        db.data.write_many_low_level([(self.test_mbid_two, ll_two)], gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id_from_mbid(self.test_mbid)[0]
+        ll_id_two = self._get_ll_id_from_mbid(self.test_mbid_two)[0]
+
+        # New submissions are queued, oldest first
+        docs = db.data.get_unprocessed_highlevel_documents()
+        self.assertEqual([(self.test_mbid, ll_id), (self.test_mbid_two, ll_id_two)],
+                         [(mbid, id) for mbid, doc, id in docs])
+        self.assertEqual(ll, json.loads(docs[0][1]))
+
+        # Writing high-level data removes a submission from the queue
+        db.data.write_high_level(self.test_mbid, ll_id, {}, "test")
+        self.assertEqual([ll_id_two], [id for mbid, doc, id in db.data.get_unprocessed_highlevel_documents()])
+
+        # A failed submission is queued again when it is removed
+        db.data.remove_failed_highlevel_submissions()
+        self.assertEqual([ll_id, ll_id_two], [id for mbid, doc, id in db.data.get_unprocessed_highlevel_documents()])
+
+        # Submissions which are not in the queue are added by the backfill
+        db.data.write_high_level(self.test_mbid, ll_id, {}, "test")
+        with db.engine.begin() as connection:
+            connection.execute("DELETE FROM highlevel_pending")
+        self.assertEqual([], db.data.get_unprocessed_highlevel_documents())
+        self.assertEqual([(1, ll_id_two)], list(db.data.enqueue_unprocessed_highlevel_documents()))
+        self.assertEqual([ll_id_two], [id for mbid, doc, id in db.data.get_unprocessed_highlevel_documents()])
+
+    def test_get_unprocessed_highlevel_documents_for_model(self):
+        ll = {"data": "one",
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        db.data.write_low_level(self.test_mbid_two, dict(ll, data="two"), gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id_from_mbid(self.test_mbid)[0]
+        ll_id_two = self._get_ll_id_from_mbid(self.test_mbid_two)[0]
+        model_id = db.data.add_model("model1", "v1", "show")
+
+        docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id)
+        self.assertEqual([ll_id, ll_id_two], [id for mbid, doc, id in docs])
+        docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id, within=[self.test_mbid_two])
+        self.assertEqual([ll_id_two], [id for mbid, doc, id in docs])
+        docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id, after=ll_id)
+        self.assertEqual([ll_id_two], [id for mbid, doc, id in docs])
+
+        hl = {"highlevel": {"model1": {"x": "y"}},
+              "metadata": {"version": {"highlevel": {"hlversion": "123", "models_essentia_git_sha": "v1"}}}}
+        db.data.write_high_level(self.test_mbid, ll_id, hl, "test")
+        docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id)
+        self.assertEqual([ll_id_two], [id for mbid, doc, id in docs])
+
+    def test_claim_highlevel_documents(self):
+        ll = {"data": "one",
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        ll_two = dict(ll, data="two")
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        db.data.write_low_level(self.test_mbid_two, ll_two, gid_types.GID_TYPE_MBID)
+
+        claimed1 = db.data.claim_highlevel_documents("worker1", limit=1)
+        self.assertEqual(1, len(claimed1))
+        mbid, ll_id = claimed1[0]
+        self.assertEqual(self._get_ll_id_from_mbid(mbid), [ll_id])
+        self.assertIn(json.loads(db.data.load_low_level_json_by_id(ll_id)), [ll, ll_two])
+
+        # Documents claimed by a worker are not claimed by another one
+        claimed2 = db.data.claim_highlevel_documents("worker2")
+        self.assertEqual(1, len(claimed2))
+        self.assertNotEqual(ll_id, claimed2[0][1])
+        self.assertEqual([], db.data.claim_highlevel_documents("worker3"))
+
+        # Until the lease expires
+        with db.engine.begin() as connection:
+            connection.execute("UPDATE highlevel_lease SET expires = NOW() - interval '1 second' WHERE worker = 'worker1'")
+        self.assertEqual([ll_id], [row[1] for row in db.data.claim_highlevel_documents("worker3")])
+
+        # Or the worker releases it
+        self.assertEqual(1, db.data.release_highlevel_documents("worker2"))
+        self.assertEqual([claimed2[0][1]], [row[1] for row in db.data.claim_highlevel_documents("worker1")])
+
+        # Documents with high-level data are not claimed again
+        db.data.write_high_level(mbid, ll_id, {}, "test")
+        with db.engine.connect() as connection:
+            self.assertEqual(0, connection.execute("SELECT COUNT(*) FROM highlevel_lease WHERE id = %s",
+                                                   (ll_id,)).fetchone()[0])
+        db.data.release_highlevel_documents("worker1")
+        self.assertEqual([claimed2[0][1]], [row[1] for row in db.data.claim_highlevel_documents("worker2")])
+
+    def test_highlevel_lease_ownership(self):
+        ll = {"data": "one",
+              "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        hl = {"highlevel": {"model1": {"x": "y"}},
+              "metadata": {"version": {"highlevel": {"hlversion": "123", "models_essentia_git_sha": "v1"}}}}
+        db.data.write_low_level(self.test_mbid, ll, gid_types.GID_TYPE_MBID)
+        [(mbid, ll_id)] = db.data.claim_highlevel_documents("worker1", lease_duration=60)
+
+        # A renewed lease is not claimed by another worker after its first duration
+        self.assertEqual({ll_id}, db.data.renew_highlevel_leases("worker1", [ll_id], lease_duration=3600))
+        self.assertEqual(set(), db.data.renew_highlevel_leases("worker2", [ll_id]))
+        with db.engine.connect() as connection:
+            self.assertEqual(1, connection.execute("""SELECT COUNT(*) FROM highlevel_lease
+                                                       WHERE expires > NOW() + interval '30 minutes'""").fetchone()[0])
+
+        # When the lease expired and was claimed by another worker, the first one can't write
+        with db.engine.begin() as connection:
+            connection.execute("UPDATE highlevel_lease SET expires = NOW() - interval '1 second'")
+        self.assertEqual([ll_id], [row[1] for row in db.data.claim_highlevel_documents("worker2")])
+        self.assertEqual(set(), db.data.renew_highlevel_leases("worker1", [ll_id]))
+        self.assertFalse(db.data.write_high_level(mbid, ll_id, hl, "test", "worker1"))
+        self.assertTrue(db.data.write_high_level(mbid, ll_id, hl, "test", "worker2"))
+
+        # Data which was already written is not written again
+        with db.engine.begin() as connection:
+            connection.execute("""INSERT INTO highlevel_lease (id, worker, expires)
+                                       VALUES (%s, 'worker1', NOW())""", (ll_id,))
+        self.assertFalse(db.data.write_high_level(mbid, ll_id, hl, "test", "worker1"))
+        with db.engine.connect() as connection:
+            self.assertEqual(1, connection.execute("SELECT COUNT(*) FROM highlevel_model").fetchone()[0])
+
+    def test_load_low_level_json_by_id(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id_from_mbid(self.test_mbid)[0]
+        self.assertEqual(self.test_lowlevel_data, json.loads(db.data.load_low_level_json_by_id(ll_id)))
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.load_low_level_json_by_id(ll_id + 1)
+
     def test_get_active_models(self):
         models = db.data.get_active_models()
         self.assertEqual(len(models), 0)
@@ -0,0 +1,197 @@
+import mock
+
+import db.data
+import db.document_cache
+import db.exceptions
+from db.testing import DatabaseTestCase, gid_types
+
+
+class DocumentCacheTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(DocumentCacheTestCase, self).setUp()
+        db.document_cache.init(enabled=True)
+        self.test_mbid = "0dad432b-16cc-4bf0-8961-fd31d124b01b"
+        self.ll = {"data": "one",
+                   "metadata": {"audio_properties": {"lossless": True}, "version": {"essentia_build_sha": "x"}}}
+        self.ver = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        self.hl = {"highlevel": {"model1": {"x": "y"}},
+                   "metadata": {"meta": "here", "version": {"highlevel": self.ver}}}
+
+    def tearDown(self):
+        super(DocumentCacheTestCase, self).tearDown()
+        db.document_cache.init(enabled=False)
+
+    def _delete_lowlevel_json(self):
+        with db.engine.begin() as connection:
+            connection.execute("DELETE FROM lowlevel_json")
+
+    def _get_ll_id(self):
+        with db.engine.connect() as connection:
+            return connection.execute("SELECT id FROM lowlevel WHERE gid = %s", (self.test_mbid,)).fetchone()[0]
+
+    def test_load_low_level(self):
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        self.assertEqual({}, db.document_cache.get_many_lowlevel([(self.test_mbid, 0)]))
+        self.assertEqual(self.ll, db.data.load_low_level(self.test_mbid))
+        self.assertIn((self.test_mbid, 0), db.document_cache.get_many_lowlevel([(self.test_mbid, 0)]))
+
+        # Loaded from the cache, not the database
+        self._delete_lowlevel_json()
+        self.assertEqual(self.ll, db.data.load_low_level(self.test_mbid))
+        self.assertEqual({self.test_mbid: {"0": self.ll}},
+                         db.data.load_many_low_level([(self.test_mbid, 0), (self.test_mbid, 1)]))
+
+        db.document_cache.clear()
+        self.assertEqual({}, db.data.load_many_low_level([(self.test_mbid, 0)]))
+
+    def test_load_high_level(self):
+        db.data.add_model("model1", "v1", "show")
+        db.data.add_model("model2", "v1", "show")
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        ll_id = self._get_ll_id()
+        db.data.write_high_level(self.test_mbid, ll_id, self.hl, "test")
+
+        expected = {"model1": {"x": "y", "version": self.ver}}
+        self.assertEqual(expected, db.data.load_high_level(self.test_mbid)["highlevel"])
+        self.assertIn((self.test_mbid, 0), db.document_cache.get_many_highlevel([(self.test_mbid, 0)], False))
+        # Documents with mapped class names are cached separately
+        self.assertEqual({}, db.document_cache.get_many_highlevel([(self.test_mbid, 0)], True))
+
+        # A new model for the same submission removes it from the cache
+        with db.engine.begin() as connection:
+            version_id = db.data.insert_version(connection, self.ver, db.data.VERSION_TYPE_HIGHLEVEL)
+            db.data.write_high_level_item(connection, "model2", "v1", ll_id, version_id, {"a": "b"})
+        self.assertEqual(expected, db.data.load_high_level(self.test_mbid)["highlevel"])
+        db.data.write_high_level(self.test_mbid, ll_id, {"highlevel": {}, "metadata": {}}, "test")
+        expected["model2"] = {"a": "b", "version": self.ver}
+        self.assertEqual(expected, db.data.load_high_level(self.test_mbid)["highlevel"])
+
+        # Changing the status of a model invalidates all high-level documents
+        db.data.set_model_status("model2", "v1", db.data.STATUS_HIDDEN)
+        del expected["model2"]
+        self.assertEqual(expected, db.data.load_high_level(self.test_mbid)["highlevel"])
+
+    def test_low_level_misses(self):
+        db.document_cache.reset_stats()
+        recordings = [(self.test_mbid, 0)]
+        self.assertEqual({}, db.data.load_many_low_level(recordings))
+        self.assertEqual(set(recordings), db.document_cache.get_lowlevel_misses(recordings))
+
+        # The miss is answered from the cache
+        with mock.patch("db.data._load_and_cache_many_low_level_json") as load:
+            self.assertEqual({}, db.data.load_many_low_level_json(recordings))
+            load.assert_not_called()
+        self.assertEqual({"negative_hits": 1, "negative_sets": 1}, db.document_cache.get_stats())
+
+        # A submission for the recording removes the miss
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        self.assertEqual(set(), db.document_cache.get_lowlevel_misses(recordings))
+        self.assertEqual(self.ll, db.data.load_low_level(self.test_mbid))
+
+        # Offsets which are not submitted yet are still misses
+        self.assertEqual({}, db.data.load_many_low_level([(self.test_mbid, 1)]))
+        db.data.write_many_low_level([(self.test_mbid, dict(self.ll, data="two"))], gid_types.GID_TYPE_MBID)
+        self.assertEqual(set(), db.document_cache.get_lowlevel_misses([(self.test_mbid, 1)]))
+
+    def test_negative_timeout(self):
+        db.document_cache.init(enabled=True, negative_timeout=0)
+        recordings = [(self.test_mbid, 0)]
+        self.assertEqual({}, db.data.load_many_low_level(recordings))
+        self.assertEqual(set(), db.document_cache.get_lowlevel_misses(recordings))
+
+    def test_high_level_misses(self):
+        db.data.add_model("model1", "v1", "show")
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        recordings = [(self.test_mbid, 0)]
+        self.assertEqual({}, db.data.load_many_high_level_json(recordings))
+        self.assertEqual(set(recordings), db.document_cache.get_highlevel_misses(recordings))
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.load_high_level(self.test_mbid)
+
+        # Writing the high-level document removes the miss
+        db.data.write_high_level(self.test_mbid, self._get_ll_id(), self.hl, "test")
+        self.assertEqual(set(), db.document_cache.get_highlevel_misses(recordings))
+        self.assertEqual({"model1": {"x": "y", "version": self.ver}},
+                         db.data.load_high_level(self.test_mbid)["highlevel"])
+
+    def test_digests(self):
+        db.data.add_model("model1", "v1", "show")
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        recordings = [(self.test_mbid, 0)]
+        # Loading a low-level document also caches its sha256
+        db.data.load_low_level_json(self.test_mbid)
+        sha256s = db.document_cache.get_many_lowlevel_sha256(recordings)
+        self.assertEqual(sha256s, db.data.get_many_low_level_sha256(recordings))
+
+        self.assertEqual({}, db.document_cache.get_many_highlevel_digest(recordings))
+        db.data.write_high_level(self.test_mbid, self._get_ll_id(), self.hl, "test")
+        digest = db.data.get_high_level_digest(self.test_mbid)
+        mapped_digest = db.data.get_high_level_digest(self.test_mbid, map_classes=True)
+        self.assertIn((self.test_mbid, 0), db.document_cache.get_many_highlevel_digest(recordings))
+
+        # Digests are read from the cache, not the database
+        with mock.patch("db.data.db.connect") as connect:
+            self.assertEqual(sha256s[(self.test_mbid, 0)], db.data.get_low_level_sha256(self.test_mbid))
+            self.assertEqual(digest, db.data.get_high_level_digest(self.test_mbid))
+            self.assertEqual(mapped_digest, db.data.get_high_level_digest(self.test_mbid, map_classes=True))
+            connect.assert_not_called()
+
+        # Writing high-level data removes the digest, and so does changing the models
+        db.data.write_high_level(self.test_mbid, self._get_ll_id(), {"highlevel": {}, "metadata": {}}, "test")
+        self.assertEqual({}, db.document_cache.get_many_highlevel_digest(recordings))
+        self.assertEqual(digest, db.data.get_high_level_digest(self.test_mbid))
+        db.data.set_model_status("model1", "v1", db.data.STATUS_HIDDEN)
+        self.assertEqual({}, db.document_cache.get_many_highlevel_digest(recordings))
+        self.assertNotEqual(digest, db.data.get_high_level_digest(self.test_mbid))
+
+    def test_digest_misses(self):
+        """A repeated lookup of a missing document is answered from the cache"""
+        db.document_cache.reset_stats()
+        recordings = [(self.test_mbid, 0)]
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.get_low_level_sha256(self.test_mbid)
+        with self.assertRaises(db.exceptions.NoDataFoundException):
+            db.data.get_high_level_digest(self.test_mbid)
+        self.assertEqual(set(recordings), db.document_cache.get_lowlevel_misses(recordings))
+        self.assertEqual(set(recordings), db.document_cache.get_highlevel_misses(recordings))
+
+        with mock.patch("db.data.db.connect") as connect:
+            with self.assertRaises(db.exceptions.NoDataFoundException):
+                db.data.get_low_level_sha256(self.test_mbid)
+            with self.assertRaises(db.exceptions.NoDataFoundException):
+                db.data.get_high_level_digest(self.test_mbid, map_classes=True)
+            self.assertEqual({}, db.data.load_many_low_level_json(recordings))
+            connect.assert_not_called()
+
+        # A submission for the recording removes the miss
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        self.assertIn((self.test_mbid, 0), db.data.get_many_low_level_sha256(recordings))
+
+    def test_stale_high_level(self):
+        """A document which was loaded before it was changed is not cached"""
+        db.data.add_model("model1", "v1", "show")
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        recordings = [(self.test_mbid, 0)]
+        generations = db.document_cache.get_highlevel_generations(recordings)
+
+        # High-level data is written while another request is loading the document
+        db.data.write_high_level(self.test_mbid, self._get_ll_id(), self.hl, "test")
+        db.document_cache.set_highlevel_misses(recordings, generations)
+        db.document_cache.set_many_highlevel({(self.test_mbid, 0): '{"stale": true}'}, False, generations)
+        db.document_cache.set_many_highlevel_digest({(self.test_mbid, 0): "stale"}, generations)
+        self.assertEqual(set(), db.document_cache.get_highlevel_misses(recordings))
+        self.assertEqual({}, db.document_cache.get_many_highlevel(recordings, False))
+        self.assertEqual({}, db.document_cache.get_many_highlevel_digest(recordings))
+        self.assertEqual({"model1": {"x": "y", "version": self.ver}},
+                         db.data.load_high_level(self.test_mbid)["highlevel"])
+        self.assertIn((self.test_mbid, 0), db.document_cache.get_many_highlevel(recordings, False))
+
+    def test_stale_low_level_miss(self):
+        """A miss of a recording which was submitted while it was being looked up is not remembered"""
+        recordings = [(self.test_mbid, 0)]
+        generations = db.document_cache.get_lowlevel_generations(recordings)
+        db.data.write_low_level(self.test_mbid, self.ll, gid_types.GID_TYPE_MBID)
+        db.document_cache.set_lowlevel_misses(recordings, generations)
+        self.assertEqual(set(), db.document_cache.get_lowlevel_misses(recordings))
+        self.assertEqual(self.ll, db.data.load_low_level(self.test_mbid))
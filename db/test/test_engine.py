@@ -0,0 +1,120 @@
+import os
+
+import mock
+
+import db
+from db.testing import DatabaseTestCase
+
+
+class EngineTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(EngineTestCase, self).setUp()
+        db.init_db_engine(self.app.config["SQLALCHEMY_DATABASE_URI"], pool_size=2)
+        db.reset_pool_stats()
+
+    def tearDown(self):
+        db.init_db_engine(self.app.config["SQLALCHEMY_DATABASE_URI"])
+        super(EngineTestCase, self).tearDown()
+
+    def _query(self):
+        with db.engine.connect() as connection:
+            return connection.execute("SELECT 1").scalar()
+
+    def test_pooled_connections_are_reused(self):
+        for _ in range(5):
+            self.assertEqual(1, self._query())
+        stats = db.get_pool_stats()
+        self.assertEqual(1, stats["connects"])
+        self.assertEqual(5, stats["checkouts"])
+        self.assertEqual(5, stats["checkins"])
+
+    def test_unpooled_connections(self):
+        db.init_db_engine(self.app.config["SQLALCHEMY_DATABASE_URI"])
+        db.reset_pool_stats()
+        for _ in range(3):
+            self._query()
+        self.assertEqual(3, db.get_pool_stats()["connects"])
+
+    def test_connections_are_not_shared_after_fork(self):
+        self._query()
+        # A connection opened by the parent process is not used by a child process
+        with mock.patch("db.os.getpid", return_value=os.getpid() + 1):
+            self.assertEqual(1, self._query())
+        stats = db.get_pool_stats()
+        self.assertEqual(1, stats["fork_discards"])
+        self.assertEqual(2, stats["connects"])
+
+    def test_pgbouncer(self):
+        db.init_db_engine(self.app.config["SQLALCHEMY_DATABASE_URI"], pool_size=2, pgbouncer=True)
+        self.assertTrue(db.engine.pool._pre_ping)
+        self.assertEqual(db.DEFAULT_PGBOUNCER_POOL_RECYCLE, db.engine.pool._recycle)
+        self.assertEqual(1, self._query())
+
+    def test_connection_scope(self):
+        with db.connection_scope():
+            with db.connect() as connection1:
+                pass
+            with db.begin() as connection2:
+                connection2.execute("CREATE TABLE scope_test (id INTEGER)")
+            self.assertIs(connection1, connection2)
+            self.assertFalse(connection1.closed)
+            with db.connection_scope():
+                with db.connect() as connection3:
+                    self.assertIs(connection1, connection3)
+        self.assertTrue(connection1.closed)
+        self.assertEqual(1, db.get_pool_stats()["checkouts"])
+
+        # The transaction was committed
+        with db.connect() as connection:
+            self.assertEqual(0, connection.execute("SELECT count(*) FROM scope_test").scalar())
+            connection.execute("DROP TABLE scope_test")
+
+    def test_connection_scope_rollback(self):
+        with db.connection_scope():
+            with db.begin() as connection:
+                connection.execute("CREATE TABLE scope_test (id INTEGER)")
+            with self.assertRaises(ValueError):
+                with db.begin() as connection:
+                    connection.execute("INSERT INTO scope_test (id) VALUES (1)")
+                    raise ValueError
+            with db.connect() as connection:
+                self.assertEqual(0, connection.execute("SELECT count(*) FROM scope_test").scalar())
+                connection.execute("DROP TABLE scope_test")
+
+    def test_nested_begin(self):
+        callback = mock.Mock()
+        with db.connection_scope():
+            with db.begin() as connection:
+                connection.execute("CREATE TABLE scope_test (id INTEGER)")
+                with db.begin() as connection:
+                    connection.execute("INSERT INTO scope_test (id) VALUES (1)")
+                    db.after_commit(connection, callback)
+                # Not called before the outer transaction is committed
+                callback.assert_not_called()
+                # An exception in a nested block only rolls back that block
+                with self.assertRaises(ValueError):
+                    with db.begin() as connection:
+                        connection.execute("INSERT INTO scope_test (id) VALUES (2)")
+                        raise ValueError
+            callback.assert_called_once_with()
+            with db.connect() as connection:
+                self.assertEqual([1], [row[0] for row in connection.execute("SELECT id FROM scope_test")])
+
+            # Nothing is called if the transaction is rolled back
+            callback.reset_mock()
+            with self.assertRaises(ValueError):
+                with db.begin() as connection:
+                    db.after_commit(connection, callback)
+                    raise ValueError
+            with db.begin() as connection:
+                connection.execute("DROP TABLE scope_test")
+            callback.assert_not_called()
+
+    def test_no_connection_scope(self):
+        with db.connect() as connection1:
+            pass
+        with db.connect() as connection2:
+            pass
+        self.assertIsNot(connection1, connection2)
+        self.assertEqual(2, db.get_pool_stats()["checkouts"])
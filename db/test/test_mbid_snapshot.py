@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+
+import mock
+
+import db.mbid_snapshot
+from db.testing import DatabaseTestCase
+
+
+class MbidSnapshotTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(MbidSnapshotTestCase, self).setUp()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.snapshot_dir, "mbids")
+        self.mbids = ["f8ab4e36-c33c-4d4e-8a92-87e5fa8b0d43",
+                      "0dad432b-16cc-4bf0-8961-fd31d124b01b",
+                      "e8afe383-1478-497e-90b1-7885c7f37f6e"]
+
+    def tearDown(self):
+        super(MbidSnapshotTestCase, self).tearDown()
+        db.mbid_snapshot.init()
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_build(self):
+        for mbid in self.mbids + self.mbids[:1]:
+            self.submit_fake_low_level_data(mbid)
+        self.assertEqual(3, db.mbid_snapshot.build(self.snapshot_path))
+
+        snapshot = db.mbid_snapshot.MbidSnapshot.load(self.snapshot_path)
+        self.assertEqual(3, snapshot.count)
+        self.assertEqual(sorted(self.mbids), list(snapshot))
+        for mbid in self.mbids:
+            self.assertIn(mbid, snapshot)
+        self.assertNotIn("00000000-0000-0000-0000-000000000000", snapshot)
+        self.assertNotIn("ffffffff-ffff-ffff-ffff-ffffffffffff", snapshot)
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute("SELECT MAX(id) FROM lowlevel").fetchone()[0],
+                             snapshot.last_lowlevel_id)
+
+    def test_build_empty(self):
+        self.assertEqual(0, db.mbid_snapshot.build(self.snapshot_path))
+        snapshot = db.mbid_snapshot.MbidSnapshot.load(self.snapshot_path)
+        self.assertEqual(0, snapshot.count)
+        self.assertNotIn(self.mbids[0], snapshot)
+
+    def test_load_bad_snapshot(self):
+        with open(self.snapshot_path, "wb") as f:
+            f.write(b"not a snapshot")
+        with self.assertRaises(ValueError):
+            db.mbid_snapshot.MbidSnapshot.load(self.snapshot_path)
+
+    def test_get_existing(self):
+        self.submit_fake_low_level_data(self.mbids[0])
+        # Without a snapshot, MBIDs are looked up in the database
+        self.assertEqual({self.mbids[0]}, db.mbid_snapshot.get_existing(self.mbids))
+
+        db.mbid_snapshot.build(self.snapshot_path)
+        db.mbid_snapshot.init(self.snapshot_path)
+        self.submit_fake_low_level_data(self.mbids[1])
+        # Recordings submitted after the snapshot was built are found in the database
+        self.assertEqual({self.mbids[0], self.mbids[1]}, db.mbid_snapshot.get_existing(self.mbids))
+        with mock.patch("db.mbid_snapshot.db.connect") as connect:
+            self.assertEqual({self.mbids[0]}, db.mbid_snapshot.get_existing(self.mbids[:1]))
+            connect.assert_not_called()
+
+    def test_get_existing_chunks(self):
+        for mbid in self.mbids[:2]:
+            self.submit_fake_low_level_data(mbid)
+        with mock.patch("db.mbid_snapshot.LOOKUP_CHUNK_SIZE", 1):
+            self.assertEqual(set(self.mbids[:2]), db.mbid_snapshot.get_existing(self.mbids))
+
+    def test_reload(self):
+        db.mbid_snapshot.build(self.snapshot_path)
+        db.mbid_snapshot.init(self.snapshot_path)
+        self.assertEqual(0, db.mbid_snapshot.get_snapshot().count)
+
+        self.submit_fake_low_level_data(self.mbids[0])
+        db.mbid_snapshot.build(self.snapshot_path)
+        os.utime(self.snapshot_path, (0, 0))
+        # The file is only checked every CHECK_INTERVAL seconds
+        self.assertEqual(0, db.mbid_snapshot.get_snapshot().count)
+        with mock.patch("db.mbid_snapshot.CHECK_INTERVAL", 0):
+            self.assertEqual(1, db.mbid_snapshot.get_snapshot().count)
@@ -0,0 +1,77 @@
+import json
+
+import mock
+from brainzutils import cache
+
+import db.data
+import db.model_registry
+from db.testing import DatabaseTestCase
+
+
+class ModelRegistryTestCase(DatabaseTestCase):
+
+    def test_active_models(self):
+        self.assertEqual([], db.model_registry.get_active_models())
+        model1 = db.data.add_model("model1", "v1", db.data.STATUS_SHOW)
+        model2 = db.data.add_model("model2", "v1", db.data.STATUS_HIDDEN)
+        self.assertEqual([model1], [model["id"] for model in db.model_registry.get_active_models()])
+        self.assertEqual(set([model1, model2]), set(db.model_registry.get_models().keys()))
+        fingerprint = db.model_registry.get_fingerprint()
+
+        db.data.set_model_status("model2", "v1", db.data.STATUS_SHOW)
+        self.assertEqual(set([model1, model2]), set(db.model_registry.get_active_models_by_id().keys()))
+        self.assertNotEqual(fingerprint, db.model_registry.get_fingerprint())
+
+    def test_models_are_kept(self):
+        db.data.add_model("model1", "v1", db.data.STATUS_SHOW)
+        self.assertEqual(1, len(db.model_registry.get_active_models()))
+
+        # A change in the database is only seen once the registry is invalidated
+        with db.engine.begin() as connection:
+            connection.execute("UPDATE model SET status = 'hidden'")
+        with mock.patch("db.model_registry._load_models") as load_models:
+            self.assertEqual(1, len(db.model_registry.get_active_models()))
+            load_models.assert_not_called()
+        db.model_registry.invalidate()
+        self.assertEqual([], db.model_registry.get_active_models())
+
+    def test_shared(self):
+        # The registry is shared in the web server, see webserver.create_app
+        db.data.add_model("model1", "v1", db.data.STATUS_SHOW)
+        self.assertEqual(1, len(db.model_registry.get_active_models()))
+
+        # Another process changes the models and invalidates the registry
+        with db.engine.begin() as connection:
+            connection.execute("UPDATE model SET status = 'hidden'")
+        cache.set(db.model_registry.GENERATION_KEY, "other", namespace=db.model_registry.NAMESPACE)
+        with mock.patch("db.model_registry.CHECK_INTERVAL", 0):
+            self.assertEqual([], db.model_registry.get_active_models())
+
+    def test_get_versions(self):
+        data = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        with db.engine.begin() as connection:
+            version_id = db.data.insert_version(connection, data, db.data.VERSION_TYPE_HIGHLEVEL)
+        versions = db.model_registry.get_versions([version_id, version_id])
+        self.assertEqual({version_id: data}, {key: json.loads(value) for key, value in versions.items()})
+
+        # Versions don't change, so they are only loaded once
+        with mock.patch("db.model_registry.db.engine") as engine:
+            self.assertEqual(versions, db.model_registry.get_versions([version_id]))
+            engine.connect.assert_not_called()
+
+    def test_invalidate_while_loading(self):
+        """Models which were loaded before an invalidation are not kept"""
+        db.data.add_model("model1", "v1", db.data.STATUS_SHOW)
+        load_models = db.model_registry._load_models
+
+        def load_then_change():
+            models = load_models()
+            # The models are changed and invalidated after they were read
+            with db.engine.begin() as connection:
+                connection.execute("UPDATE model SET status = 'hidden'")
+            db.model_registry.invalidate()
+            return models
+
+        with mock.patch("db.model_registry._load_models", side_effect=load_then_change):
+            self.assertEqual(1, len(db.model_registry.get_active_models()))
+        self.assertEqual([], db.model_registry.get_active_models())
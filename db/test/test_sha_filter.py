@@ -0,0 +1,110 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+import db.data
+import db.sha_filter
+from db.testing import DatabaseTestCase, TEST_DATA_PATH, gid_types
+
+
+class ShaFilterTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(ShaFilterTestCase, self).setUp()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.test_mbid = "0dad432b-16cc-4bf0-8961-fd31d124b01b"
+        with open(os.path.join(TEST_DATA_PATH, self.test_mbid + ".json")) as f:
+            self.test_lowlevel_data = json.load(f)
+
+    def tearDown(self):
+        super(ShaFilterTestCase, self).tearDown()
+        db.sha_filter.init(enabled=False)
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_filter(self):
+        f = db.sha_filter.ShaFilter.for_capacity(1000, 0.01)
+        self.assertNotIn("a" * 64, f)
+        f.add("a" * 64)
+        self.assertIn("a" * 64, f)
+        self.assertEqual(1, f.count)
+        self.assertLess(f.measure_false_positive_rate(1000), 0.05)
+
+    def test_save_load(self):
+        f = db.sha_filter.ShaFilter.for_capacity(1000, 0.01)
+        f.add("b" * 64)
+        path = os.path.join(self.snapshot_dir, "filter")
+        f.save(path)
+        loaded = db.sha_filter.ShaFilter.load(path)
+        self.assertEqual((f.num_bits, f.num_hashes, f.count), (loaded.num_bits, loaded.num_hashes, loaded.count))
+        self.assertIn("b" * 64, loaded)
+
+    def test_build(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        with db.engine.connect() as connection:
+            data_sha256 = connection.execute("SELECT data_sha256 FROM lowlevel_json").fetchone()[0]
+        f = db.sha_filter.build(capacity=1000)
+        self.assertEqual(1, f.count)
+        self.assertIn(data_sha256, f)
+
+    def test_load(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        with db.engine.connect() as connection:
+            data_sha256 = connection.execute("SELECT data_sha256 FROM lowlevel_json").fetchone()[0]
+
+        # The filter is never built when it is used
+        db.sha_filter.init(enabled=True, capacity=1000)
+        with mock.patch("db.sha_filter.build") as build:
+            self.assertIsNone(db.sha_filter.get_filter())
+            self.assertTrue(db.sha_filter.might_contain("c" * 64))
+            build.assert_not_called()
+
+        db.sha_filter.load()
+        self.assertIn(data_sha256, db.sha_filter.get_filter())
+        self.assertFalse(db.sha_filter.might_contain("c" * 64))
+
+        # A snapshot is loaded instead of scanning the database
+        path = os.path.join(self.snapshot_dir, "filter")
+        db.sha_filter.get_filter().save(path)
+        db.sha_filter.init(enabled=True, snapshot_path=path)
+        with mock.patch("db.sha_filter.build") as build:
+            db.sha_filter.load()
+            build.assert_not_called()
+        self.assertIn(data_sha256, db.sha_filter.get_filter())
+
+    def test_write_low_level_stale_filter(self):
+        """A document which is in the database but not in the filter is still detected as a duplicate"""
+        self.assertTrue(db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID))
+
+        db.sha_filter.init(enabled=True, capacity=1000)
+        # An empty filter, as if the document had been written by another process
+        db.sha_filter._filter = db.sha_filter.ShaFilter.for_capacity(1000)
+        with mock.patch("db.data.text", wraps=db.data.text) as text:
+            self.assertFalse(db.data.write_low_level(self.test_mbid, self.test_lowlevel_data,
+                                                     gid_types.GID_TYPE_MBID))
+            self.assertFalse(any("FROM lowlevel_json" in call[0][0] and "WHERE data_sha256 =" in call[0][0]
+                                 for call in text.call_args_list))
+        self.assertEqual(1, db.data.count_lowlevel(self.test_mbid))
+
+        # Once the document is written it is added to the filter
+        other = copy.deepcopy(self.test_lowlevel_data)
+        other["metadata"]["tags"]["file_name"] = "other.flac"
+        self.assertTrue(db.data.write_low_level(self.test_mbid, other, gid_types.GID_TYPE_MBID))
+        self.assertEqual(2, db.data.count_lowlevel(self.test_mbid))
+        self.assertFalse(db.data.write_low_level(self.test_mbid, other, gid_types.GID_TYPE_MBID))
+
+    def test_write_many_low_level_stale_filter(self):
+        db.data.write_low_level(self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        db.sha_filter.init(enabled=True, capacity=1000)
+        db.sha_filter._filter = db.sha_filter.ShaFilter.for_capacity(1000)
+
+        other = copy.deepcopy(self.test_lowlevel_data)
+        other["metadata"]["tags"]["file_name"] = "other.flac"
+        statuses = db.data.write_many_low_level([(self.test_mbid, self.test_lowlevel_data),
+                                                 (self.test_mbid, other)], gid_types.GID_TYPE_MBID)
+        self.assertEqual([s["status"] for s in statuses], [db.data.SUBMISSION_STATUS_DUPLICATE,
+                                                           db.data.SUBMISSION_STATUS_OK])
+        self.assertEqual(2, db.data.count_lowlevel(self.test_mbid))
@@ -0,0 +1,52 @@
+import threading
+import unittest
+
+import db.single_flight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def setUp(self):
+        db.single_flight.reset_stats()
+
+    def test_do(self):
+        self.assertEqual(1, db.single_flight.do("key", lambda: 1))
+        self.assertEqual(2, db.single_flight.do("key", lambda: 2))
+        self.assertEqual({"calls": 2, "shared": 0}, db.single_flight.get_stats())
+
+    def test_concurrent_calls_are_shared(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(db.single_flight.do("key", load)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(db.single_flight.do("key", load)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while db.single_flight.get_stats()["shared"] < 3:
+            pass
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(["result"] * 4, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual({"calls": 1, "shared": 3}, db.single_flight.get_stats())
+
+    def test_errors(self):
+        def load():
+            raise ValueError("error")
+        with self.assertRaises(ValueError):
+            db.single_flight.do("key", load)
+        # A failed call is not remembered
+        self.assertEqual(1, db.single_flight.do("key", lambda: 1))
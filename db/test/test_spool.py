@@ -0,0 +1,88 @@
+import copy
+import fcntl
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+import db.data
+import db.spool
+from db.testing import DatabaseTestCase, TEST_DATA_PATH, gid_types
+
+
+class SpoolTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        super(SpoolTestCase, self).setUp()
+        self.spool_dir = tempfile.mkdtemp()
+        self.test_mbid = "0dad432b-16cc-4bf0-8961-fd31d124b01b"
+        with open(os.path.join(TEST_DATA_PATH, self.test_mbid + ".json")) as f:
+            self.test_lowlevel_data = json.load(f)
+
+    def tearDown(self):
+        super(SpoolTestCase, self).tearDown()
+        shutil.rmtree(self.spool_dir)
+
+    def test_seal_active_segment(self):
+        # Nothing to seal
+        self.assertIsNone(db.spool.seal_active_segment(self.spool_dir))
+
+        db.spool.append(self.spool_dir, self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        sealed = db.spool.seal_active_segment(self.spool_dir)
+        self.assertEqual([sealed], db.spool.list_sealed_segments(self.spool_dir))
+        self.assertFalse(os.path.exists(os.path.join(self.spool_dir, db.spool.ACTIVE_SEGMENT_NAME)))
+
+        # New submissions go to a new active segment
+        db.spool.append(self.spool_dir, self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        items = list(db.spool.read_segment(sealed))
+        self.assertEqual(1, len(items))
+        self.assertEqual(self.test_mbid, items[0]["mbid"])
+        self.assertEqual(self.test_lowlevel_data, items[0]["data"])
+
+    def test_read_segment_bad_line(self):
+        db.spool.append(self.spool_dir, self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        with open(os.path.join(self.spool_dir, db.spool.ACTIVE_SEGMENT_NAME), "a") as f:
+            f.write('{"mbid": "partial')
+        sealed = db.spool.seal_active_segment(self.spool_dir)
+        self.assertEqual(1, len(list(db.spool.read_segment(sealed))))
+
+    def test_drain(self):
+        second_data = copy.deepcopy(self.test_lowlevel_data)
+        second_data["metadata"]["tags"]["album"] = ["Another album"]
+        db.spool.append_many(self.spool_dir,
+                             [(self.test_mbid, self.test_lowlevel_data),
+                              (self.test_mbid, second_data),
+                              (self.test_mbid, self.test_lowlevel_data)],
+                             gid_types.GID_TYPE_MBID)
+        self.assertEqual(3, db.spool.get_status(self.spool_dir)["submissions"])
+
+        counts = db.spool.drain(self.spool_dir, batch_size=2)
+        self.assertEqual(2, counts[db.data.SUBMISSION_STATUS_OK])
+        self.assertEqual(1, counts[db.data.SUBMISSION_STATUS_DUPLICATE])
+        self.assertEqual([], db.spool.list_sealed_segments(self.spool_dir))
+        self.assertEqual(0, db.spool.get_status(self.spool_dir)["submissions"])
+
+        # Offsets follow the order of the spool
+        self.assertEqual(self.test_lowlevel_data, db.data.load_low_level(self.test_mbid, 0))
+        self.assertEqual(second_data, db.data.load_low_level(self.test_mbid, 1))
+
+        # Draining a segment again only finds duplicates
+        db.spool.append(self.spool_dir, self.test_mbid, second_data, gid_types.GID_TYPE_MBID)
+        counts = db.spool.drain(self.spool_dir)
+        self.assertEqual(1, counts[db.data.SUBMISSION_STATUS_DUPLICATE])
+        self.assertEqual(2, db.data.count_lowlevel(self.test_mbid))
+
+    def test_drain_locked_segment(self):
+        """A segment which is being drained by another worker is skipped"""
+        db.spool.append(self.spool_dir, self.test_mbid, self.test_lowlevel_data, gid_types.GID_TYPE_MBID)
+        sealed = db.spool.seal_active_segment(self.spool_dir)
+        with open(sealed) as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            self.assertIsNone(db.spool.drain_segment(self.spool_dir, sealed))
+            self.assertEqual(0, db.spool.drain(self.spool_dir)[db.data.SUBMISSION_STATUS_OK])
+        self.assertEqual([sealed], db.spool.list_sealed_segments(self.spool_dir))
+
+        self.assertEqual(1, db.spool.drain_segment(self.spool_dir, sealed)[db.data.SUBMISSION_STATUS_OK])
+        # A segment which was drained in the meantime is skipped too
+        self.assertIsNone(db.spool.drain_segment(self.spool_dir, sealed))
@@ -1,5 +1,7 @@
 import db
 import db.data
+import db.document_cache
+import db.model_registry
 import json
 import os
 import random
@@ -33,6 +35,9 @@ class DatabaseTestCase(TestCase):
         self.drop_tables()
         self.drop_types()
         self.init_db()
+        db.data.clear_version_cache()
+        db.document_cache.clear()
+        db.model_registry.clear()
 
     def init_db(self):
         db.run_sql_script(os.path.join(ADMIN_SQL_DIR, 'create_types.sql'))
@@ -44,12 +49,16 @@ class DatabaseTestCase(TestCase):
     def drop_tables(self):
         with db.engine.connect() as connection:
             # TODO(roman): See if there's a better way to drop all tables.
+            connection.execute('DROP TABLE IF EXISTS highlevel_document   CASCADE;')
+            connection.execute('DROP TABLE IF EXISTS highlevel_pending    CASCADE;')
+            connection.execute('DROP TABLE IF EXISTS highlevel_lease      CASCADE;')
             connection.execute('DROP TABLE IF EXISTS highlevel_model      CASCADE;')
             connection.execute('DROP TABLE IF EXISTS highlevel_meta       CASCADE;')
             connection.execute('DROP TABLE IF EXISTS highlevel            CASCADE;')
             connection.execute('DROP TABLE IF EXISTS model                CASCADE;')
             connection.execute('DROP TABLE IF EXISTS lowlevel_json        CASCADE;')
             connection.execute('DROP TABLE IF EXISTS lowlevel             CASCADE;')
+            connection.execute('DROP TABLE IF EXISTS submission_offset_counter CASCADE;')
             connection.execute('DROP TABLE IF EXISTS version              CASCADE;')
             connection.execute('DROP TABLE IF EXISTS statistics           CASCADE;')
             connection.execute('DROP TABLE IF EXISTS incremental_dumps    CASCADE;')
@@ -7,7 +7,7 @@ ALL_USER_COLUMNS = ", ".join(['"user".%s' % c for c in USER_COLUMNS])
 
 
 def create(musicbrainz_id):
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(
             """INSERT INTO "user" (musicbrainz_id)
                     VALUES (%s)
@@ -18,7 +18,7 @@ def create(musicbrainz_id):
 
 def get(id):
     """Get user with a specified ID (integer)."""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT %s
               FROM "user"
@@ -32,7 +32,7 @@ def get_by_api_key(apikey):
     """Get the user with the specified active API key.
        If the API key doesn't exist, or if it is inactive,
        return None"""
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         query = sqlalchemy.text("""
             SELECT %s
               FROM "user"
@@ -49,7 +49,7 @@ def get_by_mb_id(musicbrainz_id):
     """Get user with a specified MusicBrainz ID (username).
     Usernames are case-insensitive matched.
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute(sqlalchemy.text("""
             SELECT %s
               FROM "user"
@@ -71,7 +71,7 @@ def get_or_create(musicbrainz_id):
 
 
 def get_admins():
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         result = connection.execute("""
             SELECT %s
               FROM "user"
@@ -97,7 +97,7 @@ def set_admin(musicbrainz_id, admin, force=False):
                 "Can't change admin status of %s because this user "
                 "doesn't exist." % musicbrainz_id
             )
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         connection.execute(sqlalchemy.text("""
             UPDATE "user"
                SET admin = :admin
@@ -114,7 +114,7 @@ def agree_to_gdpr(musicbrainz_id):
     Args:
         musicbrainz_id (str): the MusicBrainz ID of the user
     """
-    with db.engine.connect() as connection:
+    with db.connect() as connection:
         try:
             connection.execute(sqlalchemy.text("""
                 UPDATE "user"
@@ -0,0 +1,62 @@
+"""High-level extraction with the Essentia python bindings.
+
+The extractor binary loads all of the SVM models of the profile each time it is
+run, which takes longer than classifying a document. If Essentia was built
+with its python bindings (``./waf configure --with-python --with-gaia``), a
+worker process of the high-level extractor can load the models once with
+:class:`SvmExtractor` and then classify any number of documents.
+"""
+import yaml
+
+try:
+    import essentia
+    import essentia.standard
+except ImportError:
+    essentia = None
+
+
+def is_available():
+    """Check if the Essentia python bindings are installed."""
+    return essentia is not None
+
+
+def _flatten(values, prefix=""):
+    """Turn nested dictionaries into a list of (dotted key, value) pairs."""
+    items = []
+    for key, value in values.items():
+        if isinstance(value, dict):
+            items.extend(_flatten(value, prefix + key + "."))
+        elif value is not None:
+            items.append((prefix + key, value))
+    return items
+
+
+class SvmExtractor(object):
+    """Classifies low-level documents with the SVM models of a profile, like the
+    extractor binary does."""
+
+    def __init__(self, profile):
+        """Load the models of a profile, see :func:`hl_extractor.hl_calc.create_profile`.
+
+        Raises:
+            RuntimeError: if the Essentia python bindings are not installed, or a
+                model can't be loaded
+        """
+        if not is_available():
+            raise RuntimeError("The Essentia python bindings are not installed")
+        with open(profile) as f:
+            doc = yaml.load(f)
+        self._svm = essentia.standard.MusicExtractorSVM(svms=doc["highlevel"]["svm_models"])
+        self._merge_values = [(key, str(value)) for key, value in _flatten(doc.get("mergeValues") or {})]
+
+    def extract(self, in_file, out_file):
+        """Classify the low-level document in `in_file` and write the high-level document to `out_file`.
+
+        Raises:
+            RuntimeError: if the document can't be read or classified
+        """
+        ll_pool = essentia.standard.YamlInput(filename=in_file, format="json")()
+        hl_pool = self._svm(ll_pool)
+        for key, value in self._merge_values:
+            hl_pool.set(key, value)
+        essentia.standard.YamlOutput(filename=out_file, format="json", writeVersion=False)(hl_pool)
@@ -1,21 +1,31 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import Queue
+import collections
+import itertools
 import json
+import multiprocessing
 import os
+import shutil
+import signal
+import socket
 import subprocess
 import sys
 import tempfile
 from hashlib import sha1
-from threading import Thread
-from time import sleep
+from time import sleep, time
 
 import yaml
 
 import db
 import db.data
+import hl_extractor.essentia_svm
 
-DEFAULT_NUM_THREADS = 1
+# Number of claimed documents to keep ready for each worker process
+PREFETCH_PER_WORKER = 2
+# Number of times that leases are renewed within their duration while documents are waited for
+LEASE_RENEWALS = 3
 
 SLEEP_DURATION = 30  # number of seconds to wait between runs
 BASE_DIR = os.path.dirname(__file__)
@@ -26,74 +36,161 @@ PROFILE_CONF_TEMPLATE = os.path.join(BASE_DIR, "profile.conf.in")
 PROFILE_CONF = os.path.join(BASE_DIR, "profile.conf")
 
 
-class HighLevel(Thread):
-    """This thread class calculates the high-level data by calling the external
-    high-level calculator.
+def _run_binary(in_file, out_file):
+    """Run the extractor binary on one low-level file.
+
+    Raises:
+        subprocess.CalledProcessError, OSError: if the extractor fails or can't be run
     """
+    with open(os.devnull, 'w') as fnull:
+        subprocess.check_call([HIGH_LEVEL_EXTRACTOR_BINARY,
+                               in_file, out_file, PROFILE_CONF],
+                              stdout=fnull, stderr=fnull)
 
-    def __init__(self, mbid, ll_data, ll_id):
-        Thread.__init__(self)
-        self.mbid = mbid
-        self.ll_data = ll_data
-        self.hl_data = None
-        self.ll_id = ll_id
 
-    def _calculate(self):
-        """Invoke Essentia high-level extractor and return its JSON output."""
+class ScratchSlot(object):
+    """A directory with the input and output files of the extractor, which are
+    reused for each document instead of being created and removed each time.
 
-        try:
-            f = tempfile.NamedTemporaryFile(delete=False)
-            name = f.name
-            f.write(self.ll_data.encode("utf-8"))
-            f.close()
-        except IOError:
-            print("IO Error while writing temp file")
-            # If we return early, remove the ll file we created
-            os.unlink(name)
-            return "{}"
-
-        # Securely generate a temporary filename
-        tmp_file = tempfile.mkstemp()
-        out_file = tmp_file[1]
-        os.close(tmp_file[0])
-
-        fnull = open(os.devnull, 'w')
-        try:
-            subprocess.check_call([HIGH_LEVEL_EXTRACTOR_BINARY,
-                                   name, out_file, PROFILE_CONF],
-                                  stdout=fnull, stderr=fnull)
-        except (subprocess.CalledProcessError, OSError):
-            print("Cannot call high-level extractor")
-            # If we return early, make sure we remove the temp
-            # output file that we created
-            os.unlink(out_file)
-            return "{}"
-        finally:
-            # At this point we can remove the source file,
-            # regardless of if we failed or if we succeeded
-            fnull.close()
-            os.unlink(name)
+    A worker process calculates one document at a time, so each one has its own
+    slot. Put the slots in a RAM-backed directory (e.g. /dev/shm) so that the
+    documents are not written to disk at all.
+    """
 
-        try:
-            f = open(out_file)
-            hl_data = f.read()
-            f.close()
-        except IOError:
-            print("IO Error while removing temp file")
-            return "{}"
-        finally:
-            os.unlink(out_file)
+    def __init__(self, path):
+        self.path = path
+        self.in_file = os.path.join(path, "in.json")
+        self.out_file = os.path.join(path, "out.json")
+
+    @classmethod
+    def create(cls, scratch_dir=None):
+        """Create a slot in `scratch_dir`, or in the default temporary directory."""
+        return cls(tempfile.mkdtemp(prefix="hl_calc-", dir=scratch_dir))
 
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _extract(ll_data, extract, slot):
+    """Write a low-level document to the input file of a slot, run an extractor
+    on it and return its output.
+
+    Args:
+        ll_data: the low-level document, as serialised JSON
+        extract: a function which takes the names of the input and output files
+        slot: the :class:`ScratchSlot` to use
+
+    Returns:
+        the high-level document as serialised JSON, or "{}" if it couldn't be calculated
+
+    Raises:
+        any error raised by `extract`, other than errors of the extractor binary
+    """
+    try:
+        with open(slot.in_file, "wb") as f:
+            f.write(ll_data.encode("utf-8"))
+    except IOError:
+        print("IO Error while writing scratch file")
+        return "{}"
+
+    try:
+        extract(slot.in_file, slot.out_file)
+    except (subprocess.CalledProcessError, OSError):
+        print("Cannot call high-level extractor")
+        return "{}"
+
+    try:
+        with open(slot.out_file, "r+b") as f:
+            hl_data = f.read()
+            # Empty the file, so that the output of this document is never read
+            # for the next one if the extractor doesn't write anything
+            f.seek(0)
+            f.truncate()
         return hl_data
+    except IOError:
+        print("IO Error while reading scratch file")
+        return "{}"
 
-    def get_data(self):
-        return self.hl_data
 
-    def get_ll_id(self):
-        return self.ll_id
+def calculate_highlevel(ll_data, slot=None, scratch_dir=None):
+    """Invoke Essentia high-level extractor and return its JSON output.
 
-    def run(self):
-        self.hl_data = self._calculate()
+    Args:
+        ll_data: the low-level document, as serialised JSON
+        slot: the :class:`ScratchSlot` for the files of the extractor. If it's not
+            set, a slot is created in `scratch_dir` for this document and removed afterwards.
+        scratch_dir: the directory in which to create the slot
+
+    Returns:
+        the high-level document as serialised JSON, or "{}" if it couldn't be calculated
+    """
+    if slot is not None:
+        return _extract(ll_data, _run_binary, slot)
+    slot = ScratchSlot.create(scratch_dir)
+    try:
+        return _extract(ll_data, _run_binary, slot)
+    finally:
+        slot.remove()
+
+
+# The ScratchSlot of a worker process
+_slot = None
+# The SvmExtractor of a worker process, if it runs in batch mode
+_svm_extractor = None
+
+
+def _init_worker(batch_mode=False, scratch_dir=None):
+    """Set up a process of the worker pool.
+
+    Args:
+        batch_mode: if True, load the models of the profile so that they can be
+            used for all documents processed by this process, see :mod:`hl_extractor.essentia_svm`
+        scratch_dir: the directory in which to create the :class:`ScratchSlot` of this process
+    """
+    global _slot, _svm_extractor
+    # Interrupts are handled by the main process, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _slot = ScratchSlot.create(scratch_dir)
+    if batch_mode:
+        try:
+            _svm_extractor = hl_extractor.essentia_svm.SvmExtractor(PROFILE_CONF)
+        except Exception as e:
+            print("Cannot load the models of the profile, running the extractor binary for each document: %s" % e)
+            sys.stdout.flush()
+
+
+def _calculate_in_worker(job_id, batch):
+    """Calculate the high-level documents of a batch in a process of the worker pool.
+
+    If the models were loaded by :func:`_init_worker`, they are used for the documents
+    of the batch. If that fails, the extractor binary is run for each of the remaining
+    documents.
+
+    Args:
+        job_id: the id of this job in the main process
+        batch: a list of (ll_id, low-level document as serialised JSON)
+
+    Returns:
+        (job_id, a list of (ll_id, high-level document as serialised JSON)) with the
+        result of each document of the batch. Errors are turned into an empty document,
+        so that the result of every document is returned to the main process.
+    """
+    results = []
+    if _svm_extractor is not None:
+        try:
+            for ll_id, ll_data in batch:
+                results.append((ll_id, _extract(ll_data, _svm_extractor.extract, _slot)))
+        except Exception as e:
+            print("Error in batch, running the extractor binary for %d documents: %s" % (len(batch) - len(results), e))
+            sys.stdout.flush()
+
+    for ll_id, ll_data in batch[len(results):]:
+        try:
+            results.append((ll_id, calculate_highlevel(ll_data, _slot)))
+        except Exception as e:
+            print("Error while calculating high-level data: %s" % e)
+            results.append((ll_id, "{}"))
+    return job_id, results
 
 
 def create_profile(in_file, out_file, sha1):
@@ -141,75 +238,179 @@ def get_build_sha1(binary):
     return sha1(bin).hexdigest()
 
 
-def main(num_threads):
-    print("High-level extractor daemon starting with %d threads" % num_threads)
+def get_worker_id():
+    """An identifier of this process which is unique across all machines running the extractor."""
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def main(num_workers=None, lease_duration=db.data.HIGHLEVEL_LEASE_DURATION, batch_size=1, scratch_dir=None):
+    num_workers = num_workers or multiprocessing.cpu_count()
+    worker = get_worker_id()
+    print("High-level extractor daemon %s starting with %d workers" % (worker, num_workers))
+    if batch_size > 1:
+        print("Batch mode: %d documents per job, %s" % (batch_size, "using the Essentia python bindings"
+              if hl_extractor.essentia_svm.is_available() else "Essentia python bindings not found"))
     sys.stdout.flush()
     build_sha1 = get_build_sha1(HIGH_LEVEL_EXTRACTOR_BINARY)
     create_profile(PROFILE_CONF_TEMPLATE, PROFILE_CONF, build_sha1)
 
+    # The scratch slots of the workers are created in a directory of this extractor,
+    # which is removed when it stops
+    scratch_dir = tempfile.mkdtemp(prefix="hl_calc-", dir=scratch_dir)
+    try:
+        while True:
+            pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                        initargs=(batch_size > 1, scratch_dir))
+            try:
+                run(pool, worker, num_workers, lease_duration, build_sha1, batch_size)
+            finally:
+                pool.terminate()
+                pool.join()
+            # The processes of the pool were stuck, start new ones
+            print("Restarting the worker pool")
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        # Let other extractors take over the documents that we didn't finish
+        db.data.release_highlevel_documents(worker)
+
+
+def run(pool, worker, num_workers, lease_duration, build_sha1, batch_size=1):
+    """Calculate high-level data with a pool of worker processes until interrupted,
+    or until all of its processes are stuck.
+
+    Documents are sent to the pool in batches of up to `batch_size`. Only the ids
+    of claimed submissions are kept in memory until they are sent, with up to
+    PREFETCH_PER_WORKER batches of them for each worker. Low-level documents are
+    loaded right before they are sent, and there are never more than `num_workers`
+    jobs in the pool, so there are never more than `num_workers` batches of them
+    in memory at a time. Results are written by this process as they are returned
+    by the workers.
+
+    The leases of the claimed documents are renewed while they wait to be sent
+    and while they are calculated, so that they are not claimed by another
+    extractor. If a job doesn't return its result in `lease_duration` seconds,
+    its documents are released. The job still counts against the `num_workers`
+    jobs in the pool until its result arrives, because its process may still
+    be working on it.
+
+    Args:
+        pool: a multiprocessing.Pool with `num_workers` processes
+        worker: the identifier of this extractor, see :func:`get_worker_id`
+        num_workers: the number of batches to calculate at a time
+        lease_duration: the number of seconds before claimed documents can be claimed
+            by another extractor if this one stops
+        build_sha1: the SHA1 of the extractor binary
+        batch_size: the number of documents in each job of the pool
+    """
     num_processed = 0
+    prefetch_size = num_workers * batch_size * PREFETCH_PER_WORKER
+
+    claimed = collections.deque()
+    # The jobs in the pool, {job id: (start time, {ll_id: mbid})}
+    jobs = {}
+    # The ids of jobs that we gave up on, which may still occupy a process of the pool
+    abandoned = set()
+    job_ids = itertools.count()
+    # The results of the workers are put in this queue by the result handler thread of the pool
+    results = Queue.Queue()
 
-    pool = {}
-    docs = []
     while True:
-        # Check to see if we need more database rows
-        if len(docs) == 0:
-            # Fetch more rows from the DB
-            docs = db.data.get_unprocessed_highlevel_documents()
-
-            # We will fetch some rows that are already in progress. Remove those.
-            in_progress = pool.keys()
-            filtered = []
-            for mbid, doc, id in docs:
-                if mbid not in in_progress:
-                    filtered.append((mbid, doc, id))
-            docs = filtered
-
-        if len(docs):
-            # Start one document
-            mbid, doc, id = docs.pop()
-            th = HighLevel(mbid, doc, id)
-            th.start()
-            print("start %s" % mbid)
+        # Keep enough documents claimed to give each worker its next batch straight away.
+        # Documents in progress here or in other extractors are claimed by them, so they are not returned
+        if len(claimed) < num_workers * batch_size:
+            claimed.extend(db.data.claim_highlevel_documents(worker, limit=prefetch_size - len(claimed),
+                                                             lease_duration=lease_duration))
+
+        while claimed and len(jobs) + len(abandoned) < num_workers:
+            job_id = next(job_ids)
+            batch = []
+            documents = {}
+            while claimed and len(batch) < batch_size:
+                mbid, ll_id = claimed.popleft()
+                batch.append((ll_id, db.data.load_low_level_json_by_id(ll_id)))
+                documents[ll_id] = mbid
+                print("start %s" % mbid)
+            jobs[job_id] = (time(), documents)
+            pool.apply_async(_calculate_in_worker, (job_id, batch), callback=results.put)
             sys.stdout.flush()
-            pool[mbid] = th
+        # Don't keep the last documents in memory while we wait
+        batch = None
+
+        # Other extractors can claim the documents that we haven't finished once their leases expire
+        in_progress = [ll_id for _, documents in jobs.values() for ll_id in documents]
+        held = db.data.renew_highlevel_leases(worker, [ll_id for _, ll_id in claimed] + in_progress,
+                                              lease_duration=lease_duration)
+        if len(held) < len(claimed) + len(in_progress):
+            claimed = collections.deque((mbid, ll_id) for mbid, ll_id in claimed if ll_id in held)
+
+        if not jobs:
+            if num_processed > 0:
+                print("processed %s documents, none remain. Sleeping." % num_processed)
+                print("version cache: %(hits)s hits, %(shared_hits)s shared hits, %(misses)s misses"
+                      % db.data.get_version_cache_stats())
+                print("database: %(connects)s connections opened for %(checkouts)s uses" % db.get_pool_stats())
+                sys.stdout.flush()
+            num_processed = 0
+            # Let's be nice and not keep any connections to the DB open while we nap
+            # TODO: Close connections when we're sleeping
+            sleep(SLEEP_DURATION)
+            continue
+
+        # Wait for the next batch to be done, renewing the leases in between
+        try:
+            job_id, done = results.get(timeout=lease_duration / float(LEASE_RENEWALS))
+        except Queue.Empty:
+            _abandon_stuck_jobs(jobs, abandoned, worker, lease_duration)
+            if len(abandoned) >= num_workers:
+                print("All %d worker processes are stuck" % num_workers)
+                sys.stdout.flush()
+                db.data.release_highlevel_documents(worker, [ll_id for _, ll_id in claimed])
+                return
+            continue
+
+        if job_id in abandoned:
+            # A late result of documents that we gave up on. They may have been
+            # claimed by another extractor, so they are not written
+            abandoned.discard(job_id)
+            continue
+
+        _, documents = jobs.pop(job_id)
+        for ll_id, hl_data in done:
+            mbid = documents[ll_id]
+            try:
+                jdata = json.loads(hl_data)
+            except ValueError:
+                print("error %s: Cannot parse result document" % mbid)
+                print(hl_data)
+                sys.stdout.flush()
+                jdata = {}
+
+            if not db.data.write_high_level(mbid, ll_id, jdata, build_sha1, worker):
+                print("skip  %s: claimed by another extractor" % mbid)
+                sys.stdout.flush()
+                continue
+
+            print("done  %s" % mbid)
+            sys.stdout.flush()
+            num_processed += 1
 
-        # If we're at max threads, wait for one to complete
-        while True:
-            if len(pool) == 0 and len(docs) == 0:
-                if num_processed > 0:
-                    print("processed %s documents, none remain. Sleeping." % num_processed)
-                    sys.stdout.flush()
-                num_processed = 0
-                # Let's be nice and not keep any connections to the DB open while we nap
-                # TODO: Close connections when we're sleeping
-                sleep(SLEEP_DURATION)
-
-            for mbid in pool.keys():
-                if not pool[mbid].is_alive():
-
-                    # Fetch the data and clean up the thread object
-                    hl_data = pool[mbid].get_data()
-                    ll_id = pool[mbid].get_ll_id()
-                    pool[mbid].join()
-                    del pool[mbid]
-
-                    try:
-                        jdata = json.loads(hl_data)
-                    except ValueError:
-                        print("error %s: Cannot parse result document" % mbid)
-                        print(hl_data)
-                        sys.stdout.flush()
-                        jdata = {}
-
-                    db.data.write_high_level(mbid, ll_id, jdata, build_sha1)
-
-                    print("done  %s" % mbid)
-                    sys.stdout.flush()
-                    num_processed += 1
-
-            if len(pool) == num_threads:
-                # tranquilo!
-                sleep(.1)
-            else:
-                break
+
+def _abandon_stuck_jobs(jobs, abandoned, worker, lease_duration):
+    """Give up on the jobs which have run for more than `lease_duration` seconds,
+    and release their documents so that other extractors can claim them.
+
+    Args:
+        jobs: the jobs in the pool, see :func:`run`. Stuck jobs are removed from it.
+        abandoned: the set of abandoned job ids, to which the stuck jobs are added
+    """
+    now = time()
+    for job_id, (started, documents) in list(jobs.items()):
+        if now - started < lease_duration:
+            continue
+        print("No result from job %d in %s seconds, giving up on %d documents" % (job_id, lease_duration,
+                                                                                 len(documents)))
+        sys.stdout.flush()
+        db.data.release_highlevel_documents(worker, list(documents))
+        del jobs[job_id]
+        abandoned.add(job_id)
@@ -4,9 +4,7 @@ from __future__ import print_function
 import argparse
 import json
 import os
-import subprocess
 import sys
-import tempfile
 from hashlib import sha1
 from setproctitle import setproctitle
 from threading import Thread
@@ -18,6 +16,7 @@ import db
 import db.data
 import db.dataset
 import db.dataset_eval
+import hl_extractor.hl_calc
 
 DEFAULT_NUM_THREADS = 1
 
@@ -35,52 +34,17 @@ class HighLevel(Thread):
     high-level calculator.
     """
 
-    def __init__(self, mbid, ll_data, ll_id):
+    def __init__(self, mbid, ll_data, ll_id, scratch_dir=None):
         Thread.__init__(self)
         self.mbid = mbid
         self.ll_data = ll_data
+        self.scratch_dir = scratch_dir
         self.hl_data = None
         self.ll_id = ll_id
 
     def _calculate(self):
         """Invoke Essentia high-level extractor and return its JSON output."""
-
-        try:
-            f = tempfile.NamedTemporaryFile(delete=False)
-            name = f.name
-            f.write(self.ll_data.encode("utf-8"))
-            f.close()
-        except IOError:
-            print("IO Error while writing temp file")
-            return "{}"
-
-        # Securely generate a temporary filename
-        tmp_file = tempfile.mkstemp()
-        out_file = tmp_file[1]
-        os.close(tmp_file[0])
-
-        fnull = open(os.devnull, 'w')
-        try:
-            subprocess.check_call([HIGH_LEVEL_EXTRACTOR_BINARY,
-                                   name, out_file, PROFILE_CONF],
-                                  stdout=fnull, stderr=fnull)
-        except subprocess.CalledProcessError:
-            print("Cannot call high-level extractor")
-            return "{}"
-
-        fnull.close()
-        os.unlink(name)
-
-        try:
-            f = open(out_file)
-            hl_data = f.read()
-            f.close()
-            os.unlink(out_file)
-        except IOError:
-            print("IO Error while removing temp file")
-            return "{}"
-
-        return hl_data
+        return hl_extractor.hl_calc.calculate_highlevel(self.ll_data, scratch_dir=self.scratch_dir)
 
     def get_data(self):
         return self.hl_data
@@ -156,7 +120,7 @@ def get_model_from_eval(jobid):
     return model_id
 
 
-def main(num_threads, profile, dataset_job_id):
+def main(num_threads, profile, dataset_job_id, scratch_dir=None):
     print("High-level extractor daemon starting with %d threads" % num_threads)
     sys.stdout.flush()
     build_sha1 = get_build_sha1(HIGH_LEVEL_EXTRACTOR_BINARY)
@@ -169,11 +133,14 @@ def main(num_threads, profile, dataset_job_id):
 
     pool = {}
     docs = []
+    after = 0
     while True:
         # Check to see if we need more database rows
         if len(docs) == 0:
-            # Fetch more rows from the DB
-            docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id, includes)
+            # Fetch more rows from the DB, continuing after the last batch. Once we
+            # reach the end, start again to pick up rows which are still missing
+            docs = db.data.get_unprocessed_highlevel_documents_for_model(model_id, includes, after)
+            after = max(id for mbid, doc, id in docs) if docs else 0
 
             # We will fetch some rows that are already in progress. Remove those.
             in_progress = pool.keys()
@@ -186,7 +153,7 @@ def main(num_threads, profile, dataset_job_id):
         if len(docs):
             # Start one document
             mbid, doc, id = docs.pop()
-            th = HighLevel(mbid, doc, id)
+            th = HighLevel(mbid, doc, id, scratch_dir)
             th.start()
             print("start %s" % id)
             sys.stdout.flush()
@@ -238,5 +205,7 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--threads", help="Number of threads to start", default=DEFAULT_NUM_THREADS, type=int)
     parser.add_argument("profile", help="Profile file with highlevel models to generate", type=str)
     parser.add_argument("job", help="Job to evaluate", type=str)
+    parser.add_argument("-s", "--scratch-dir", help="Directory for the input and output files of the extractor, "
+                        "e.g. a RAM-backed directory such as /dev/shm", default=None, type=str)
     args = parser.parse_args()
-    main(args.threads, args.profile, args.job)
+    main(args.threads, args.profile, args.job, args.scratch_dir)
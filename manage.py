@@ -13,9 +13,14 @@ from shutil import copyfile
 
 import db
 import db.data
+import db.document_cache
 import db.dump
 import db.dump_manage
 import db.exceptions
+import db.mbid_snapshot
+import db.model_registry
+import db.sha_filter
+import db.spool
 import db.stats
 import db.user
 import webserver
@@ -187,6 +192,18 @@ def clear_cache():
     cache.flush_all()
 
 
+@cli.command(name='invalidate_highlevel_cache')
+def invalidate_highlevel_cache():
+    """Remove all high-level documents from the document cache, and reload models.
+
+    Run this after changing the class mapping of a model in the database.
+    Materialised documents don't need to be rebuilt, because class names are
+    mapped when they are loaded."""
+    db.model_registry.invalidate()
+    db.document_cache.invalidate_models()
+    click.echo("High-level document cache invalidated.")
+
+
 @cli.command(name='add_admin')
 @click.argument("username")
 @click.option("--force", "-f", is_flag=True, help="Create user if doesn't exist.")
@@ -278,6 +295,163 @@ def remove_failed_rows():
         sys.exit(1)
 
 
+@highlevel.command(name="rebuild_documents")
+@click.option("--batch-size", "-b", default=db.data.HIGH_LEVEL_DOCUMENT_BATCH_SIZE, type=click.IntRange(1, None),
+              help="Number of documents to write in each transaction.")
+def rebuild_documents(batch_size):
+    """Write materialised high-level documents which are missing or out of date
+
+    Run this after the status of a model changes, and after importing a database dump.
+    Until then the documents are put together from the highlevel_model table on each request.
+    """
+    total = 0
+    for count in db.data.rebuild_high_level_documents(batch_size):
+        total += count
+        click.echo("Written %s documents" % total)
+    click.echo("done")
+
+
+@highlevel.command(name="enqueue_pending")
+@click.option("--batch-size", "-b", default=db.data.HIGHLEVEL_PENDING_BATCH_SIZE, type=click.IntRange(1, None),
+              help="Number of submissions to look at in each transaction.")
+def enqueue_pending(batch_size):
+    """Add submissions which have no highlevel data to the queue of the highlevel extractor
+
+    New submissions are added to the queue when they are made. Run this after
+    creating the queue and after importing a database dump.
+    """
+    total = 0
+    for count, last_id in db.data.enqueue_unprocessed_highlevel_documents(batch_size):
+        total += count
+        click.echo("Added %s submissions (up to id %s)" % (total, last_id))
+    click.echo("done")
+
+
+@cli.group()
+@click.pass_context
+def spool(ctx):
+    """Manage the low-level submission spool"""
+    pass
+
+
+@spool.command(name="drain")
+@click.option("--batch-size", "-b", default=db.spool.DEFAULT_DRAIN_BATCH_SIZE, type=click.IntRange(1, None),
+              help="Number of submissions to write to the database in each transaction.")
+@click.option("--once", is_flag=True, help="Drain the spool once and exit instead of running continuously.")
+@click.option("--sleep", "-s", "sleep_duration", default=5, type=click.IntRange(1, None),
+              help="Number of seconds to wait between runs.")
+def drain_spool(batch_size, once, sleep_duration):
+    """Write spooled low-level submissions to the database"""
+    import time
+    spool_dir = current_app.config.get("SUBMISSION_SPOOL_DIR")
+    if not spool_dir:
+        click.echo("Error: SUBMISSION_SPOOL_DIR is not set", err=True)
+        sys.exit(1)
+
+    while True:
+        counts = db.spool.drain(spool_dir, batch_size)
+        if any(counts.values()):
+            click.echo("Saved %s, duplicate %s, rejected %s" % (counts[db.data.SUBMISSION_STATUS_OK],
+                                                                counts[db.data.SUBMISSION_STATUS_DUPLICATE],
+                                                                counts[db.data.SUBMISSION_STATUS_ERROR]))
+        if once:
+            break
+        time.sleep(sleep_duration)
+
+
+@spool.command(name="status")
+def spool_status():
+    """Show the number of submissions waiting in the spool"""
+    spool_dir = current_app.config.get("SUBMISSION_SPOOL_DIR")
+    if not spool_dir:
+        click.echo("Error: SUBMISSION_SPOOL_DIR is not set", err=True)
+        sys.exit(1)
+    status = db.spool.get_status(spool_dir)
+    click.echo("%(submissions)s submissions in %(segments)s segments (%(bytes)s bytes)" % status)
+
+
+@cli.group()
+@click.pass_context
+def sha_filter(ctx):
+    """Manage the sha256 filter used to detect duplicate submissions"""
+    pass
+
+
+@sha_filter.command(name="build")
+@click.option("--snapshot", "-s", "snapshot_path", type=click.Path(),
+              help="Snapshot file to write. Defaults to SHA_FILTER_SNAPSHOT_PATH.")
+@click.option("--capacity", "-c", type=click.IntRange(1, None),
+              help="Number of items to size the filter for. Defaults to twice the number of documents.")
+@click.option("--error-rate", "-e", default=db.sha_filter.DEFAULT_ERROR_RATE, type=float,
+              help="False positive rate of the filter when it is full.")
+def build_sha_filter(snapshot_path, capacity, error_rate):
+    """Build the filter from the database and save a snapshot"""
+    snapshot_path = snapshot_path or current_app.config.get("SHA_FILTER_SNAPSHOT_PATH")
+    if not snapshot_path:
+        click.echo("Error: no snapshot path given and SHA_FILTER_SNAPSHOT_PATH is not set", err=True)
+        sys.exit(1)
+    capacity = capacity or current_app.config.get("SHA_FILTER_CAPACITY")
+    f = db.sha_filter.build(capacity, error_rate)
+    f.save(snapshot_path)
+    click.echo("Saved filter with %d items to %s" % (f.count, snapshot_path))
+    _print_sha_filter_info(f)
+
+
+@sha_filter.command(name="info")
+@click.argument("snapshot_path", type=click.Path(exists=True), required=False)
+@click.option("--samples", "-n", default=100000, type=click.IntRange(1, None),
+              help="Number of random hashes to look up when measuring the false positive rate.")
+def sha_filter_info(snapshot_path, samples):
+    """Show the size and false positive rate of a filter snapshot"""
+    snapshot_path = snapshot_path or current_app.config.get("SHA_FILTER_SNAPSHOT_PATH")
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        click.echo("Error: no snapshot found", err=True)
+        sys.exit(1)
+    _print_sha_filter_info(db.sha_filter.ShaFilter.load(snapshot_path), samples)
+
+
+def _print_sha_filter_info(f, samples=100000):
+    click.echo("%d items, %d bits (%d KB), %d hashes" % (f.count, f.num_bits, len(f.bits) // 1024, f.num_hashes))
+    click.echo("Estimated false positive rate: %.4f%%" % (f.estimated_false_positive_rate() * 100))
+    click.echo("Measured false positive rate: %.4f%% (%d samples)" % (f.measure_false_positive_rate(samples) * 100,
+                                                                     samples))
+
+
+@cli.group()
+@click.pass_context
+def mbid_snapshot(ctx):
+    """Manage the snapshot of recording MBIDs which have low-level data"""
+    pass
+
+
+@mbid_snapshot.command(name="build")
+@click.option("--snapshot", "-s", "snapshot_path", type=click.Path(),
+              help="Snapshot file to write. Defaults to MBID_SNAPSHOT_PATH.")
+def build_mbid_snapshot(snapshot_path):
+    """Write a snapshot of all MBIDs in the database. Run this periodically,
+    the web server loads the new snapshot when the file is replaced."""
+    snapshot_path = snapshot_path or current_app.config.get("MBID_SNAPSHOT_PATH")
+    if not snapshot_path:
+        click.echo("Error: no snapshot path given and MBID_SNAPSHOT_PATH is not set", err=True)
+        sys.exit(1)
+    count = db.mbid_snapshot.build(snapshot_path)
+    click.echo("Saved %d MBIDs to %s" % (count, snapshot_path))
+
+
+@mbid_snapshot.command(name="info")
+@click.argument("snapshot_path", type=click.Path(exists=True), required=False)
+def mbid_snapshot_info(snapshot_path):
+    """Show the size and age of a snapshot"""
+    snapshot_path = snapshot_path or current_app.config.get("MBID_SNAPSHOT_PATH")
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        click.echo("Error: no snapshot found", err=True)
+        sys.exit(1)
+    snapshot = db.mbid_snapshot.MbidSnapshot.load(snapshot_path)
+    click.echo("%d MBIDs (%d KB), up to lowlevel id %d, built %s" % (
+        snapshot.count, os.path.getsize(snapshot_path) // 1024, snapshot.last_lowlevel_id,
+        snapshot.built.isoformat()))
+
+
 @cli.command(name='set_rate_limits')
 @click.argument('per_ip', type=click.IntRange(1, None), required=False)
 @click.argument('window_size', type=click.IntRange(1, None), required=False)
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
-from webserver import create_app
+from webserver import create_app, load_sha_filter
 import argparse
 
 application = create_app()
+load_sha_filter(application)
 
 
 if __name__ == '__main__':
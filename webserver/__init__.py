@@ -62,8 +62,23 @@ def create_app(debug=None):
                      )
 
     # Database connection
-    from db import init_db_engine
-    init_db_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    import db
+    db.init_db_engine(app.config['SQLALCHEMY_DATABASE_URI'],
+                      pool_size=app.config.get('SQLALCHEMY_POOL_SIZE'),
+                      max_overflow=app.config.get('SQLALCHEMY_MAX_OVERFLOW', db.DEFAULT_POOL_MAX_OVERFLOW),
+                      pool_timeout=app.config.get('SQLALCHEMY_POOL_TIMEOUT', db.DEFAULT_POOL_TIMEOUT),
+                      pool_recycle=app.config.get('SQLALCHEMY_POOL_RECYCLE'),
+                      pool_pre_ping=app.config.get('SQLALCHEMY_POOL_PRE_PING', False),
+                      pgbouncer=app.config.get('SQLALCHEMY_PGBOUNCER', False))
+
+    # All database functions which are called in a request use the same connection
+    @app.before_request
+    def start_connection_scope():
+        db.start_connection_scope()
+
+    @app.teardown_request
+    def end_connection_scope(exception):
+        db.end_connection_scope()
 
     # Cache
     if 'REDIS_HOST' in app.config and\
@@ -82,6 +97,31 @@ def create_app(debug=None):
     else:
         raise Exception('One or more redis cache configuration options are missing from config.py')
 
+    # Submission spool
+    if app.config.get('SUBMISSION_SPOOL_DIR') and not os.path.exists(app.config['SUBMISSION_SPOOL_DIR']):
+        os.makedirs(app.config['SUBMISSION_SPOOL_DIR'])
+
+    import db.data
+    db.data.init_version_cache(size=app.config.get('VERSION_CACHE_SIZE', db.data.VERSION_CACHE_DEFAULT_SIZE),
+                               shared=app.config.get('VERSION_CACHE_SHARED', False))
+
+    import db.document_cache
+    db.document_cache.init(enabled=app.config.get('DOCUMENT_CACHE_ENABLED', False),
+                           timeout=app.config.get('DOCUMENT_CACHE_TIMEOUT', db.document_cache.DEFAULT_TIMEOUT),
+                           negative_timeout=app.config.get('DOCUMENT_CACHE_NEGATIVE_TIMEOUT',
+                                                           db.document_cache.DEFAULT_NEGATIVE_TIMEOUT))
+
+    import db.model_registry
+    db.model_registry.init(shared=True)
+
+    import db.sha_filter
+    db.sha_filter.init(enabled=app.config.get('SHA_FILTER_ENABLED', False),
+                       snapshot_path=app.config.get('SHA_FILTER_SNAPSHOT_PATH'),
+                       capacity=app.config.get('SHA_FILTER_CAPACITY'))
+
+    import db.mbid_snapshot
+    db.mbid_snapshot.init(snapshot_path=app.config.get('MBID_SNAPSHOT_PATH'))
+
     # Add rate limiting support
     @app.after_request
     def after_request_callbacks(response):
@@ -156,6 +196,23 @@ def create_app(debug=None):
     return app
 
 
+def load_sha_filter(app):
+    """Load the filter of submission hashes of the web server, see :mod:`db.sha_filter`.
+
+    This is called by the web server (server.py) instead of :func:`create_app`, so that
+    commands and workers which create the app don't scan `lowlevel_json`. Under uWSGI it
+    runs in the master process, before the worker processes are forked, so they share
+    the memory of the filter.
+    """
+    if not app.config.get('SHA_FILTER_ENABLED', False):
+        return
+    import db
+    import db.sha_filter
+    db.sha_filter.load()
+    # Don't hand the connection that was used to build the filter over to the worker processes
+    db.engine.dispose()
+
+
 def create_app_sphinx():
     """Creates application for generating the documentation using Sphinx.
 
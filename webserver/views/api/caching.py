@@ -0,0 +1,51 @@
+"""HTTP caching of API responses.
+
+Documents are identified by an ETag which is computed from digests that are
+stored in the database (the sha256 of a low-level document, or the digest of a
+high-level document and its active models, see
+:func:`db.data.get_many_high_level_digest`), so a view can check the
+``If-None-Match`` header of a request and respond with ``304 Not Modified``
+without loading the document. The digests are kept in the document cache
+(:mod:`db.document_cache`), so the database is only queried when they are not
+in it.
+
+A low-level document for a given MBID and offset never changes, so responses
+for an explicit offset can be cached for a long time. Other responses must be
+revalidated by the client or proxy on each use.
+"""
+from hashlib import sha256
+
+from flask import current_app, make_response, request
+
+#: Cache-Control of responses which never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+#: Cache-Control of responses which can change, and must be revalidated with their ETag
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+
+def make_etag(*parts):
+    """Make an ETag from a list of strings which identify the content of a response."""
+    return sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def cached_response(etag, build_response, immutable=False):
+    """Make a response with an ETag and Cache-Control header.
+
+    Args:
+        etag: the ETag of the response, see :func:`make_etag`
+        build_response: a function which returns the response. It is only called if
+            the client doesn't already have a response with this ETag.
+        immutable: if the response never changes
+
+    Returns:
+        the response returned by `build_response`, or an empty ``304 Not Modified``
+        response if the ``If-None-Match`` header of the request matches the ETag.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build_response())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    return response
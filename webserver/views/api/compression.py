@@ -0,0 +1,98 @@
+"""Decompression of compressed request bodies.
+
+Clients can compress the body of a submission request and set the
+``Content-Encoding`` header to ``gzip`` or ``deflate``, or to ``zstd`` if the
+``zstandard`` package is installed on the server. The body is decompressed
+incrementally and the request is rejected as soon as the decompressed size is
+larger than the ``MAX_DECOMPRESSED_REQUEST_SIZE`` config value, so a small
+compressed body can't expand to fill up the memory of the server.
+"""
+import zlib
+
+from flask import current_app, request
+
+from webserver.views.api import exceptions
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DECOMPRESSION_ERRORS = (zlib.error,) if zstandard is None else (zlib.error, zstandard.ZstdError)
+
+#: The largest request body that a compressed request may decompress to, if not set in the config
+DEFAULT_MAX_DECOMPRESSED_REQUEST_SIZE = 64 * 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_zlib(stream, wbits):
+    decompressor = zlib.decompressobj(wbits)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        # Limit the size of each output block, and feed the rest of the input back in
+        while chunk:
+            yield decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _iter_gzip(stream):
+    return _iter_zlib(stream, 16 + zlib.MAX_WBITS)
+
+
+def _iter_deflate(stream):
+    return _iter_zlib(stream, zlib.MAX_WBITS)
+
+
+def _iter_zstd(stream):
+    reader = zstandard.ZstdDecompressor().stream_reader(stream)
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def get_decoders():
+    """Get the content encodings which are supported, and a function to decompress
+    a stream for each of them."""
+    decoders = {"gzip": _iter_gzip, "x-gzip": _iter_gzip, "deflate": _iter_deflate}
+    if zstandard is not None:
+        decoders["zstd"] = _iter_zstd
+    return decoders
+
+
+def get_request_data():
+    """Get the body of the current request, decompressing it if it has a
+    ``Content-Encoding`` header.
+
+    Raises:
+        APIUnsupportedMediaType: if the content encoding is not supported
+        APIRequestEntityTooLarge: if the decompressed body is larger than MAX_DECOMPRESSED_REQUEST_SIZE
+        APIBadRequest: if the body can't be decompressed
+    """
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+    if encoding in ("", "identity"):
+        return request.get_data()
+
+    decoders = get_decoders()
+    if encoding not in decoders:
+        raise exceptions.APIUnsupportedMediaType(
+            "Unsupported Content-Encoding '%s'. Supported encodings are: %s" % (encoding, ", ".join(sorted(decoders))))
+
+    max_size = current_app.config.get("MAX_DECOMPRESSED_REQUEST_SIZE", DEFAULT_MAX_DECOMPRESSED_REQUEST_SIZE)
+    chunks = []
+    size = 0
+    try:
+        for chunk in decoders[encoding](request.stream):
+            size += len(chunk)
+            if size > max_size:
+                raise exceptions.APIRequestEntityTooLarge(
+                    "Decompressed request body is larger than %d bytes" % max_size)
+            chunks.append(chunk)
+    except DECOMPRESSION_ERRORS as e:
+        raise exceptions.APIBadRequest("Cannot decompress request body: %s" % e)
+    return b"".join(chunks)
@@ -28,3 +28,13 @@ class APIUnauthorized(APIError):
 class APIBadRequest(APIError):
     def __init__(self, message, payload=None):
         super(APIBadRequest, self).__init__(message, 400, payload)
+
+
+class APIRequestEntityTooLarge(APIError):
+    def __init__(self, message, payload=None):
+        super(APIRequestEntityTooLarge, self).__init__(message, 413, payload)
+
+
+class APIUnsupportedMediaType(APIError):
+    def __init__(self, message, payload=None):
+        super(APIUnsupportedMediaType, self).__init__(message, 415, payload)
@@ -5,6 +5,7 @@ from db.data import count_lowlevel, submit_low_level_data
 from db.exceptions import NoDataFoundException, BadDataException
 from webserver.decorators import crossdomain
 from webserver.views.api import exceptions
+from webserver.views.api.compression import get_request_data
 import db.data
 import json
 import uuid
@@ -57,7 +58,7 @@ def get_high_level(mbid):
 @api_legacy_bp.route("/<uuid:mbid>/low-level", methods=["POST"])
 def submit_low_level(mbid):
     """Endpoint for submitting low-level information to AcousticBrainz."""
-    raw_data = request.get_data()
+    raw_data = get_request_data()
     try:
         data = json.loads(raw_data.decode("utf-8"))
     except ValueError as e:
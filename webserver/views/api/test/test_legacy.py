@@ -7,6 +7,7 @@ from webserver.testing import ServerTestCase
 from db.testing import TEST_DATA_PATH
 from flask import url_for
 import os
+import zlib
 
 
 class LegacyViewsTestCase(ServerTestCase):
@@ -25,6 +26,19 @@ class LegacyViewsTestCase(ServerTestCase):
         resp = self.client.get("/api/v1/%s/low-level" % mbid)
         self.assertEqual(resp.status_code, 200)
 
+    def test_submit_low_level_compressed(self):
+        mbid = '0dad432b-16cc-4bf0-8961-fd31d124b01b'
+
+        with open(os.path.join(TEST_DATA_PATH, mbid + '.json')) as json_file:
+            sub_resp = self.client.post("/%s/low-level" % mbid,
+                                        data=zlib.compress(json_file.read()),
+                                        content_type='application/json',
+                                        headers={'Content-Encoding': 'deflate'})
+            self.assertEqual(sub_resp.status_code, 200)
+
+        resp = self.client.get("/api/v1/%s/low-level" % mbid)
+        self.assertEqual(resp.status_code, 200)
+
     def test_get_low_level(self):
         mbid = '0dad432b-16cc-4bf0-8961-fd31d124b01b'
         resp = self.client.get(url_for('api.get_low_level', mbid=mbid))
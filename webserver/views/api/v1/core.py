@@ -1,15 +1,20 @@
 from __future__ import absolute_import
 
 import json
+import os
 import uuid
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, send_file, stream_with_context
 
 import db.data
+import db.mbid_snapshot
+import db.spool
 import webserver.views.api.exceptions
 from db.data import submit_low_level_data, count_lowlevel
 from db.exceptions import NoDataFoundException, BadDataException
 from webserver.decorators import crossdomain
+from webserver.views.api.caching import cached_response, make_etag, REVALIDATE_CACHE_CONTROL
+from webserver.views.api.compression import get_request_data
 from brainzutils.ratelimit import ratelimit
 
 bp_core = Blueprint('api_v1_core', __name__)
@@ -24,6 +29,15 @@ bp_core = Blueprint('api_v1_core', __name__)
 #: The maximum number of items that you can pass as a recording_ids parameter to bulk lookup endpoints
 MAX_ITEMS_PER_BULK_REQUEST = 25
 
+#: The maximum number of recordings that you can send in the body of a POST request to bulk lookup endpoints
+MAX_ITEMS_PER_STREAMING_REQUEST = 100000
+
+#: The maximum number of documents that you can submit in one request to the bulk submission endpoint
+MAX_ITEMS_PER_BULK_SUBMISSION = 100
+
+#: The maximum number of paths that you can pass as a features parameter to low-level endpoints
+MAX_FEATURES_PER_REQUEST = 50
+
 
 @bp_core.route("/<uuid(strict=False):mbid>/count", methods=["GET"])
 @crossdomain()
@@ -51,6 +65,52 @@ def count(mbid):
     })
 
 
+@bp_core.route("/<uuid(strict=False):mbid>/submissions", methods=["GET"])
+@crossdomain()
+@ratelimit()
+def get_submissions(mbid):
+    """Get information about the low-level submissions for a recording with a given
+    MBID, without their documents.
+
+    This can be used to choose which submission to get with the ``/<mbid>/low-level``
+    and ``/<mbid>/high-level`` endpoints, for example one from a lossless file.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+        {"mbid": "mbid",
+         "submissions": [{"offset": 0,
+                          "submitted": "2018-11-20T14:00:00.123456+00:00",
+                          "lossless": false,
+                          "build_sha1": "cead25079874084f62182a551b7393616cd33d87",
+                          "codec": "mp3",
+                          "bit_rate": 320000,
+                          "highlevel": true}]}
+
+    Submissions are sorted by offset. ``highlevel`` is true if the submission has
+    high-level data. ``codec`` and ``bit_rate`` are null if they are unknown.
+
+    MBID values are always lower-case, even if the provided recording MBID is upper-case or mixed case.
+
+    :resheader Content-Type: *application/json*
+    """
+    try:
+        submissions = db.data.get_submissions(str(mbid))
+    except NoDataFoundException:
+        raise webserver.views.api.exceptions.APINotFound("Not found")
+    return jsonify({
+        'mbid': mbid,
+        'submissions': [_format_submission(submission) for submission in submissions],
+    })
+
+
+def _format_submission(submission):
+    submission = dict(submission)
+    submission["submitted"] = submission["submitted"].isoformat()
+    return submission
+
+
 @bp_core.route("/<uuid(strict=False):mbid>/low-level", methods=["GET"])
 @crossdomain()
 @ratelimit()
@@ -64,13 +124,47 @@ def get_low_level(mbid):
     You can the get total number of low-level submissions using the ``/<mbid>/count``
     endpoint.
 
+    If you only need some of the descriptors, list them in the ``features`` parameter
+    and only those parts of the document are returned. For example,
+    ``features=rhythm.bpm,tonal.key_key`` returns:
+
+    .. sourcecode:: json
+
+        {"rhythm": {"bpm": 120.5},
+         "tonal": {"key_key": "C"}}
+
+    Features which don't exist in the document are left out. A path can only
+    select keys of objects, not items of lists: a path with a number as a key,
+    like ``lowlevel.mfcc.mean.1``, is rejected. Select the whole list
+    (``lowlevel.mfcc.mean``) instead.
+
+    The response has an ``ETag``, and if the ``If-None-Match`` header of a request
+    matches it the server responds with ``304 Not Modified`` and no body. A document
+    never changes, so a response for a request with an offset ``n`` can be cached
+    forever.
+
     :query n: *Optional.* Integer specifying an offset for a document.
+    :query features: *Optional.* A comma-separated list of paths in the document, with
+      keys separated by ``.``. You can specify up to
+      :py:const:`~webserver.views.api.v1.core.MAX_FEATURES_PER_REQUEST` paths.
+
+    :reqheader If-None-Match: *Optional.* The ``ETag`` of a response that you already have
 
     :resheader Content-Type: *application/json*
+    :resheader ETag: An identifier of the returned document
+    :resheader Cache-Control: How long the response can be cached
     """
     offset = _validate_offset(request.args.get("n"))
+    features = _validate_features(request.args.get("features"))
+
+    def build_response():
+        if features:
+            return jsonify(db.data.load_low_level(str(mbid), offset, features))
+        return _json_response(db.data.load_low_level_json(str(mbid), offset))
+
     try:
-        return jsonify(db.data.load_low_level(str(mbid), offset))
+        etag = make_etag(db.data.get_low_level_sha256(str(mbid), offset), _features_etag_part(features))
+        return cached_response(etag, build_response, immutable=request.args.get("n") is not None)
     except NoDataFoundException:
         raise webserver.views.api.exceptions.APINotFound("Not found")
 
@@ -89,15 +183,30 @@ def get_high_level(mbid):
     You can get the total number of low-level submissions using ``/<mbid>/count``
     endpoint.
 
+    The response has an ``ETag``, and if the ``If-None-Match`` header of a request
+    matches it the server responds with ``304 Not Modified`` and no body. High-level
+    documents change when new models are added, so responses must be revalidated.
+
     :query n: *Optional.* Integer specifying an offset for a document.
     :query map_classes: *Optional.* If set to 'true', map class names to human-readable values
 
+    :reqheader If-None-Match: *Optional.* The ``ETag`` of a response that you already have
+
     :resheader Content-Type: *application/json*
+    :resheader ETag: An identifier of the returned document
     """
     offset = _validate_offset(request.args.get("n"))
     map_classes = _validate_map_classes(request.args.get("map_classes"))
+
+    def build_response():
+        if map_classes:
+            return jsonify(db.data.load_high_level(str(mbid), offset, map_classes))
+        return _json_response(db.data.load_high_level_json(str(mbid), offset))
+
     try:
-        return jsonify(db.data.load_high_level(str(mbid), offset, map_classes))
+        etag = make_etag(db.data.get_high_level_digest(str(mbid), offset, map_classes),
+                         _map_classes_etag_part(map_classes))
+        return cached_response(etag, build_response)
     except NoDataFoundException:
         raise webserver.views.api.exceptions.APINotFound("Not found")
 
@@ -107,23 +216,159 @@ def get_high_level(mbid):
 def submit_low_level(mbid):
     """Submit low-level data to AcousticBrainz.
 
+    If the server queues submissions, the document is checked and the response
+    has the status code 202 with the message ``queued``. The document is saved
+    to the database shortly after.
+
+    The request body can be compressed, see :ref:`compressed submissions <compressed-submissions>`.
+
     :reqheader Content-Type: *application/json*
+    :reqheader Content-Encoding: *Optional.* ``gzip``, ``deflate`` or ``zstd``
 
     :resheader Content-Type: *application/json*
     """
-    raw_data = request.get_data()
+    raw_data = get_request_data()
     try:
         data = json.loads(raw_data.decode("utf-8"))
     except ValueError as e:
         raise webserver.views.api.exceptions.APIBadRequest("Cannot parse JSON document: %s" % e)
 
+    spool_dir = current_app.config.get("SUBMISSION_SPOOL_DIR")
     try:
+        if spool_dir:
+            data = db.data.validate_low_level_data(str(mbid), data)
+            db.spool.append(spool_dir, str(mbid), data, 'mbid')
+            return jsonify({"message": "queued"}), 202
         submit_low_level_data(str(mbid), data, 'mbid')
     except BadDataException as e:
         raise webserver.views.api.exceptions.APIBadRequest("%s" % e)
     return jsonify({"message": "ok"})
 
 
+@bp_core.route("/low-level/submit", methods=["POST"])
+@ratelimit()
+def submit_many_low_level():
+    """Submit many low-level documents to AcousticBrainz in one request.
+
+    The request body is either a JSON array, or newline-delimited JSON (one
+    item per line) if the content type is ``application/x-ndjson``. Each item
+    is an object containing the MBID of a recording and its low-level document:
+
+    .. sourcecode:: json
+
+        [{"mbid": "mbid1", "data": {document}},
+         {"mbid": "mbid2", "data": {document}}]
+
+    Every document is checked individually, and the response contains a status
+    for each item in the same order as the request. The status is ``ok`` if the
+    document was saved, ``duplicate`` if the exact same document has already been
+    submitted, or ``error`` if the document was rejected, in which case a
+    ``message`` explains why. If the server queues submissions, valid documents
+    have the status ``queued`` and are saved to the database shortly after.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+        {"message": "ok",
+         "submissions": [{"mbid": "mbid1", "status": "ok"},
+                         {"mbid": "mbid2", "status": "error", "message": "..."}]
+        }
+
+    You can submit up to :py:const:`~webserver.views.api.v1.core.MAX_ITEMS_PER_BULK_SUBMISSION`
+    documents in a request. The request body can be compressed, see
+    :ref:`compressed submissions <compressed-submissions>`.
+
+    :reqheader Content-Type: *application/json* or *application/x-ndjson*
+    :reqheader Content-Encoding: *Optional.* ``gzip``, ``deflate`` or ``zstd``
+
+    :resheader Content-Type: *application/json*
+    """
+    items = _parse_bulk_submission(get_request_data(), request.mimetype)
+
+    statuses = [None] * len(items)
+    submissions = []
+    positions = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or "mbid" not in item or "data" not in item:
+            statuses[i] = {"mbid": None, "status": db.data.SUBMISSION_STATUS_ERROR,
+                           "message": "Each item must have an `mbid` and a `data` key"}
+            continue
+        try:
+            mbid = str(uuid.UUID(str(item["mbid"])))
+        except ValueError:
+            statuses[i] = {"mbid": item["mbid"], "status": db.data.SUBMISSION_STATUS_ERROR,
+                           "message": "'%s' is not a valid UUID" % item["mbid"]}
+            continue
+        submissions.append((mbid, item["data"]))
+        positions.append(i)
+
+    if submissions:
+        spool_dir = current_app.config.get("SUBMISSION_SPOOL_DIR")
+        if spool_dir:
+            submission_statuses = _spool_many_low_level(spool_dir, submissions)
+        else:
+            submission_statuses = db.data.submit_many_low_level_data(submissions, 'mbid')
+        for i, status in zip(positions, submission_statuses):
+            statuses[i] = status
+
+    return jsonify({"message": "ok", "submissions": statuses})
+
+
+def _spool_many_low_level(spool_dir, submissions):
+    """Validate submissions and add the valid ones to the submission spool.
+
+    Returns:
+        a list of statuses in the format of :func:`db.data.submit_many_low_level_data`
+    """
+    statuses = []
+    valid = []
+    for mbid, data in submissions:
+        try:
+            valid.append((mbid, db.data.validate_low_level_data(mbid, data)))
+            statuses.append({"mbid": mbid, "status": db.data.SUBMISSION_STATUS_QUEUED})
+        except BadDataException as e:
+            statuses.append({"mbid": mbid, "status": db.data.SUBMISSION_STATUS_ERROR, "message": str(e)})
+        except (KeyError, TypeError, AttributeError):
+            statuses.append({"mbid": mbid, "status": db.data.SUBMISSION_STATUS_ERROR,
+                             "message": "data is badly formed"})
+    if valid:
+        db.spool.append_many(spool_dir, valid, 'mbid')
+    return statuses
+
+
+def _parse_bulk_submission(raw_data, mimetype):
+    """Parse the body of a bulk submission request into a list of items.
+
+    Arguments:
+        raw_data (str): the request body
+        mimetype (str): the content type of the request. If it is ``application/x-ndjson``
+          the body is read as one JSON document per line, otherwise as a JSON array.
+
+    Raises:
+        APIBadRequest: if the body can't be parsed, isn't a list, is empty, or has more than
+          MAX_ITEMS_PER_BULK_SUBMISSION items
+    """
+    try:
+        raw_data = raw_data.decode("utf-8")
+        if mimetype == "application/x-ndjson":
+            items = [json.loads(line) for line in raw_data.splitlines() if line.strip()]
+        else:
+            items = json.loads(raw_data)
+    except ValueError as e:
+        raise webserver.views.api.exceptions.APIBadRequest("Cannot parse JSON document: %s" % e)
+
+    if not isinstance(items, list):
+        raise webserver.views.api.exceptions.APIBadRequest("Request body must be a list of submissions")
+    if not items:
+        raise webserver.views.api.exceptions.APIBadRequest("No submissions in request")
+    if len(items) > MAX_ITEMS_PER_BULK_SUBMISSION:
+        raise webserver.views.api.exceptions.APIBadRequest(
+            "More than %s submissions not allowed per request" % MAX_ITEMS_PER_BULK_SUBMISSION)
+
+    return items
+
+
 def _validate_map_classes(map_classes):
     """Validate the map_classes parameter
 
@@ -136,6 +381,38 @@ def _validate_map_classes(map_classes):
     return map_classes is not None and map_classes.lower() == 'true'
 
 
+def _validate_features(features):
+    """Validate the features parameter.
+
+    Arguments:
+        features (Optional[str]): the value of the query parameter, a comma-separated
+          list of dotted paths like ``rhythm.bpm,lowlevel.mfcc.mean``
+
+    Returns:
+        (Optional[list]): a list of paths, each a list of keys, or None if the parameter isn't set
+
+    Raises:
+        APIBadRequest: if a path is empty or has an empty or numeric key, or there are
+          more than MAX_FEATURES_PER_REQUEST paths
+    """
+    if features is None:
+        return None
+    paths = []
+    for feature in features.split(","):
+        path = feature.strip().split(".")
+        if not all(path):
+            raise webserver.views.api.exceptions.APIBadRequest("'%s' is not a valid feature path" % feature)
+        # Selecting a single item of a list isn't supported
+        if any(key.isdigit() for key in path):
+            raise webserver.views.api.exceptions.APIBadRequest(
+                "'%s' is not a valid feature path, list items can't be selected" % feature)
+        paths.append(path)
+    if len(paths) > MAX_FEATURES_PER_REQUEST:
+        raise webserver.views.api.exceptions.APIBadRequest(
+            "More than %s features not allowed per request" % MAX_FEATURES_PER_REQUEST)
+    return paths
+
+
 def _validate_offset(offset):
     """Validate the offset.
 
@@ -166,10 +443,16 @@ def _parse_bulk_params(params):
 
     Returns a list of tuples (mbid, offset). MBIDs are converted to lower-case
     """
+    return _parse_recording_ids(params.split(";"))
 
+
+def _parse_recording_ids(recording_ids):
+    """Validate and parse a list of recording ids of the form mbid[:offset],
+    see :func:`_parse_bulk_params`.
+    """
     ret = []
 
-    for recording in params.split(";"):
+    for recording in recording_ids:
         parts = str(recording).split(":")
         recording_id = parts[0]
         try:
@@ -195,6 +478,84 @@ def _parse_bulk_params(params):
     return [x for x in ret if not (x in seen or seen.add(x))]
 
 
+def _parse_streaming_lookup():
+    """Read the recordings from the body of a POST request to a bulk lookup endpoint.
+
+    The body is a JSON object with a list of ``recording_ids`` of the form mbid[:offset].
+
+    Raises:
+        APIBadRequest: if the body can't be parsed, has no recordings or has more than
+          MAX_ITEMS_PER_STREAMING_REQUEST recordings
+    """
+    try:
+        body = json.loads(get_request_data().decode("utf-8"))
+    except ValueError as e:
+        raise webserver.views.api.exceptions.APIBadRequest("Cannot parse JSON document: %s" % e)
+
+    if not isinstance(body, dict) or not isinstance(body.get("recording_ids"), list):
+        raise webserver.views.api.exceptions.APIBadRequest("Request body must be an object with a list of `recording_ids`")
+    recording_ids = body["recording_ids"]
+    if not recording_ids:
+        raise webserver.views.api.exceptions.APIBadRequest("No recording_ids in request")
+    if len(recording_ids) > MAX_ITEMS_PER_STREAMING_REQUEST:
+        raise webserver.views.api.exceptions.APIBadRequest(
+            "More than %s recordings not allowed per request" % MAX_ITEMS_PER_STREAMING_REQUEST)
+
+    return _parse_recording_ids(recording_ids)
+
+
+def _ndjson_response(lines):
+    """Make a response which streams the lines from a generator as they are made."""
+    return current_app.response_class(stream_with_context(lines), mimetype="application/x-ndjson")
+
+
+def _document_lines(documents):
+    """Make NDJSON lines from (mbid, offset, serialised document) tuples."""
+    for mbid, offset, data_json in documents:
+        yield '{"mbid": %s, "offset": %d, "document": %s}\n' % (json.dumps(mbid), offset, data_json)
+
+
+def _json_response(data_json):
+    """Make a response from a serialised JSON body."""
+    return current_app.response_class(data_json, mimetype="application/json")
+
+
+def _join_documents(documents):
+    """Put serialised documents into the {mbid: {offset: document}} structure of
+    the bulk endpoints, without decoding them.
+
+    Args:
+        documents: {mbid: {offset: serialised document}}, as returned by
+            :func:`db.data.load_many_low_level_json`
+
+    Returns:
+        the serialised JSON of the whole response
+    """
+    return "{%s}" % ", ".join(
+        "%s: {%s}" % (json.dumps(mbid), ", ".join("%s: %s" % (json.dumps(offset), data_json)
+                                                 for offset, data_json in sorted(offsets.items())))
+        for mbid, offsets in sorted(documents.items()))
+
+
+def _features_etag_part(features):
+    """The part of an ETag which identifies the features of a low-level response."""
+    return "features=%s" % ",".join(".".join(path) for path in features or [])
+
+
+def _map_classes_etag_part(map_classes):
+    """The part of an ETag which identifies if class names of a high-level response are mapped."""
+    return "map_classes=%d" % bool(map_classes)
+
+
+def _recordings_etag_parts(digests):
+    """The parts of an ETag which identify the documents of a bulk response.
+
+    Args:
+        digests: {(mbid, offset): digest} of the documents in the response
+    """
+    return ["%s:%s:%s" % (mbid, offset, digest) for (mbid, offset), digest in sorted(digests.items())]
+
+
 def check_bad_request_for_multiple_recordings():
     """
     Check if a request for multiple recording ids is valid. The ?recording_ids parameter
@@ -254,12 +615,25 @@ def get_many_lowlevel():
 
       You can specify up to :py:const:`~webserver.views.api.v1.core.MAX_ITEMS_PER_BULK_REQUEST` MBIDs in a request.
 
+    :query features: *Optional.* Only return these parts of each document, see ``/<mbid>/low-level``
+
+    :reqheader If-None-Match: *Optional.* The ``ETag`` of a response that you already have,
+      see ``/<mbid>/low-level``
+
     :resheader Content-Type: *application/json*
+    :resheader ETag: An identifier of the returned documents
     """
     recordings = check_bad_request_for_multiple_recordings()
-    recording_details = db.data.load_many_low_level(recordings)
+    features = _validate_features(request.args.get("features"))
+
+    def build_response():
+        if features:
+            return jsonify(db.data.load_many_low_level(recordings, features))
+        return _json_response(_join_documents(db.data.load_many_low_level_json(recordings)))
 
-    return jsonify(recording_details)
+    etag = make_etag(_features_etag_part(features),
+                     *_recordings_etag_parts(db.data.get_many_low_level_sha256(recordings)))
+    return cached_response(etag, build_response)
 
 
 @bp_core.route("/high-level", methods=["GET"])
@@ -295,13 +669,213 @@ def get_many_highlevel():
 
     :query map_classes: *Optional.* If set to 'true', map class names to human-readable values
 
+    :reqheader If-None-Match: *Optional.* The ``ETag`` of a response that you already have,
+      see ``/<mbid>/high-level``
+
     :resheader Content-Type: *application/json*
+    :resheader ETag: An identifier of the returned documents
     """
     map_classes = _validate_map_classes(request.args.get("map_classes"))
     recordings = check_bad_request_for_multiple_recordings()
-    recording_details = db.data.load_many_high_level(recordings, map_classes)
 
-    return jsonify(recording_details)
+    def build_response():
+        if map_classes:
+            return jsonify(db.data.load_many_high_level(recordings, map_classes))
+        return _json_response(_join_documents(db.data.load_many_high_level_json(recordings)))
+
+    etag = make_etag(_map_classes_etag_part(map_classes),
+                     *_recordings_etag_parts(db.data.get_many_high_level_digest(recordings, map_classes)))
+    return cached_response(etag, build_response)
+
+
+@bp_core.route("/low-level", methods=["POST"])
+@crossdomain()
+@ratelimit()
+def stream_many_lowlevel():
+    """Get low-level data for a large number of recordings at once.
+
+    The recordings are sent in the body of the request instead of the query string,
+    so a request can have up to
+    :py:const:`~webserver.views.api.v1.core.MAX_ITEMS_PER_STREAMING_REQUEST` recordings.
+    The request body can be compressed, see :ref:`compressed submissions <compressed-submissions>`.
+
+    **Example request**:
+
+    .. sourcecode:: json
+
+       {"recording_ids": ["mbid1", "mbid2:1"]}
+
+    The documents are streamed as they are read from the database, as newline-delimited
+    JSON with one document per line, in no particular order. Recordings which are not
+    present in the database are left out.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+       {"mbid": "mbid1", "offset": 0, "document": {document}}
+       {"mbid": "mbid2", "offset": 1, "document": {document}}
+
+    :query features: *Optional.* Only return these parts of each document, see ``/<mbid>/low-level``
+
+    :reqheader Content-Type: *application/json*
+    :reqheader Content-Encoding: *Optional.* ``gzip``, ``deflate`` or ``zstd``
+
+    :resheader Content-Type: *application/x-ndjson*
+    """
+    recordings = _parse_streaming_lookup()
+    features = _validate_features(request.args.get("features"))
+    return _ndjson_response(_document_lines(db.data.iter_low_level_json(recordings, features)))
+
+
+@bp_core.route("/high-level", methods=["POST"])
+@crossdomain()
+@ratelimit()
+def stream_many_highlevel():
+    """Get high-level data for a large number of recordings at once.
+
+    The request and response are the same as for ``POST /low-level``.
+
+    :query map_classes: *Optional.* If set to 'true', map class names to human-readable values
+
+    :reqheader Content-Type: *application/json*
+
+    :resheader Content-Type: *application/x-ndjson*
+    """
+    map_classes = _validate_map_classes(request.args.get("map_classes"))
+    recordings = _parse_streaming_lookup()
+    return _ndjson_response(_document_lines(db.data.iter_high_level_json(recordings, map_classes)))
+
+
+@bp_core.route("/count", methods=["POST"])
+@crossdomain()
+@ratelimit()
+def stream_many_count():
+    """Get low-level count for a large number of recordings at once.
+
+    The request is the same as for ``POST /low-level``, and offsets are ignored.
+    MBIDs not found in the database are left out.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+       {"mbid": "mbid1", "count": 3}
+       {"mbid": "mbid2", "count": 1}
+
+    :reqheader Content-Type: *application/json*
+
+    :resheader Content-Type: *application/x-ndjson*
+    """
+    recordings = _parse_streaming_lookup()
+    seen = set()
+    mbids = [mbid for (mbid, offset) in recordings if not (mbid in seen or seen.add(mbid))]
+
+    def lines():
+        for mbid, count in db.data.iter_count_lowlevel(mbids):
+            yield '{"mbid": %s, "count": %d}\n' % (json.dumps(mbid), count)
+    return _ndjson_response(lines())
+
+
+@bp_core.route("/exists", methods=["POST"])
+@crossdomain()
+@ratelimit()
+def get_many_exists():
+    """Check which of a large number of recordings have low-level data.
+
+    The request is the same as for ``POST /low-level``, and offsets are ignored.
+    To check all of the recordings of a large library at once, download the
+    snapshot from ``/exists/snapshot`` instead.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+       {"mbid1": true,
+        "mbid2": false
+       }
+
+    MBID keys are always lower-case, even if the provided recording MBIDs are upper-case or mixed case.
+
+    :reqheader Content-Type: *application/json*
+
+    :resheader Content-Type: *application/json*
+    """
+    recordings = _parse_streaming_lookup()
+    mbids = list(set(mbid for (mbid, offset) in recordings))
+    existing = db.mbid_snapshot.get_existing(mbids)
+    return jsonify({mbid: mbid in existing for mbid in mbids})
+
+
+@bp_core.route("/exists/snapshot", methods=["GET"])
+@crossdomain()
+@ratelimit()
+def get_exists_snapshot():
+    """Download the MBIDs of all recordings which have low-level data.
+
+    The snapshot is rebuilt periodically, so it doesn't contain the most recent
+    submissions. It is a binary file with a header and the sorted MBIDs:
+
+    - 8 bytes: the string ``ABMBID01``
+    - 8 bytes: the number of MBIDs, as a big-endian unsigned integer
+    - 8 bytes: an identifier of the last submission in the snapshot, as a big-endian unsigned integer
+    - 16 bytes for each MBID, the bytes of the UUID, in ascending byte order
+
+    The response has an ``ETag`` header, see :ref:`caching <caching>`. Send it back
+    in the ``If-None-Match`` header to only download the snapshot when it has been rebuilt.
+
+    :statuscode 200: The snapshot.
+    :statuscode 404: There is no snapshot on this server.
+
+    :resheader Content-Type: *application/octet-stream*
+    """
+    snapshot_path = db.mbid_snapshot.get_snapshot_path()
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        raise webserver.views.api.exceptions.APINotFound("No snapshot available")
+    response = send_file(snapshot_path, mimetype="application/octet-stream", as_attachment=True,
+                         attachment_filename="mbids.bin", conditional=True)
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
+
+
+@bp_core.route("/submissions", methods=["GET"])
+@crossdomain()
+@ratelimit()
+def get_many_submissions():
+    """Get information about the low-level submissions of many recordings at once,
+    see ``/<mbid>/submissions``. MBIDs not found in the database are omitted in
+    the response.
+
+    **Example response**:
+
+    .. sourcecode:: json
+
+       {"mbid1": [{"offset": 0,
+                   "submitted": "2018-11-20T14:00:00.123456+00:00",
+                   "lossless": true,
+                   "build_sha1": "cead25079874084f62182a551b7393616cd33d87",
+                   "codec": "flac",
+                   "bit_rate": 0,
+                   "highlevel": false}],
+        "mbid2": [...]
+       }
+
+    MBID keys are always lower-case, even if the provided recording MBIDs are upper-case or mixed case.
+
+    :query recording_ids: *Required.* A list of recording MBIDs to retrieve
+
+      Takes the form `mbid;mbid`. Offsets are ignored.
+
+    You can specify up to :py:const:`~webserver.views.api.v1.core.MAX_ITEMS_PER_BULK_REQUEST` MBIDs in a request.
+
+    :resheader Content-Type: *application/json*
+    """
+    recordings = check_bad_request_for_multiple_recordings()
+
+    mbids = [mbid for (mbid, offset) in recordings]
+    submissions = db.data.get_many_submissions(mbids)
+    return jsonify({mbid: [_format_submission(submission) for submission in mbid_submissions]
+                    for mbid, mbid_submissions in submissions.items()})
 
 
 @bp_core.route("/count", methods=["GET"])
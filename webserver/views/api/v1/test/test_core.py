@@ -4,12 +4,20 @@ from webserver.testing import ServerTestCase
 from webserver.views.api.v1 import core
 import webserver.views.api.exceptions
 from db.testing import TEST_DATA_PATH
+import db.data
+import db.document_cache
 import db.exceptions
+import db.mbid_snapshot
+import db.spool
 import mock
 import uuid
 import os
 import json
 import collections
+import copy
+import shutil
+import tempfile
+import zlib
 
 
 class CoreViewsTestCase(ServerTestCase):
@@ -57,6 +65,120 @@ class CoreViewsTestCase(ServerTestCase):
         resp = self.client.get("/api/v1/%s/low-level" % mbid)
         self.assertEqual(resp.status_code, 200)
 
+    def test_submit_many_low_level(self):
+        data_two = copy.deepcopy(self.test_recording1_data)
+        data_two["metadata"]["tags"]["album"] = ["Another album"]
+        submissions = [{"mbid": self.test_recording1_mbid, "data": self.test_recording1_data},
+                       {"mbid": self.test_recording1_mbid, "data": data_two},
+                       {"mbid": self.test_recording1_mbid, "data": self.test_recording1_data},
+                       {"mbid": "not-an-mbid", "data": {}},
+                       {"data": {}}]
+
+        resp = self.client.post("/api/v1/low-level/submit", data=json.dumps(submissions),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        statuses = [s["status"] for s in resp.json["submissions"]]
+        self.assertEqual(statuses, ["ok", "ok", "duplicate", "error", "error"])
+        self.assertEqual(resp.json["submissions"][3]["message"], "'not-an-mbid' is not a valid UUID")
+
+        resp = self.client.get("/api/v1/%s/low-level?n=1" % self.test_recording1_mbid)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_submit_many_low_level_ndjson(self):
+        submissions = [{"mbid": self.test_recording1_mbid, "data": self.test_recording1_data},
+                       {"mbid": self.test_recording2_mbid, "data": self.test_recording2_data}]
+        body = "\n".join(json.dumps(s) for s in submissions)
+
+        resp = self.client.post("/api/v1/low-level/submit", data=body, content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([s["mbid"] for s in resp.json["submissions"]],
+                         [self.test_recording1_mbid, self.test_recording2_mbid])
+        self.assertEqual([s["status"] for s in resp.json["submissions"]], ["ok", "ok"])
+
+    def test_submit_many_low_level_bad_request(self):
+        resp = self.client.post("/api/v1/low-level/submit", data="{not json", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.client.post("/api/v1/low-level/submit", data=json.dumps({"mbid": self.uuid}),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json["message"], "Request body must be a list of submissions")
+
+        submissions = [{"mbid": self.uuid, "data": {}}] * (core.MAX_ITEMS_PER_BULK_SUBMISSION + 1)
+        resp = self.client.post("/api/v1/low-level/submit", data=json.dumps(submissions),
+                                content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json["message"], "More than %s submissions not allowed per request"
+                         % core.MAX_ITEMS_PER_BULK_SUBMISSION)
+
+    def _gzip(self, data):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def test_submit_low_level_compressed(self):
+        resp = self.client.post("/api/v1/%s/low-level" % self.test_recording1_mbid,
+                                data=self._gzip(self.test_recording1_data_json),
+                                content_type="application/json", headers={"Content-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post("/api/v1/%s/low-level" % self.test_recording2_mbid,
+                                data=zlib.compress(self.test_recording2_data_json),
+                                content_type="application/json", headers={"Content-Encoding": "deflate"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(1, db.data.count_lowlevel(self.test_recording1_mbid))
+        self.assertEqual(1, db.data.count_lowlevel(self.test_recording2_mbid))
+
+    def test_submit_many_low_level_compressed(self):
+        submissions = [{"mbid": self.test_recording1_mbid, "data": self.test_recording1_data},
+                       {"mbid": self.test_recording2_mbid, "data": self.test_recording2_data}]
+        body = "\n".join(json.dumps(s) for s in submissions)
+        resp = self.client.post("/api/v1/low-level/submit", data=self._gzip(body),
+                                content_type="application/x-ndjson", headers={"Content-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([s["status"] for s in resp.json["submissions"]], ["ok", "ok"])
+
+    def test_submit_low_level_compressed_errors(self):
+        url = "/api/v1/%s/low-level" % self.test_recording1_mbid
+        resp = self.client.post(url, data=self.test_recording1_data_json, content_type="application/json",
+                                headers={"Content-Encoding": "br"})
+        self.assertEqual(resp.status_code, 415)
+
+        resp = self.client.post(url, data="not compressed", content_type="application/json",
+                                headers={"Content-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 400)
+
+        # A small body which decompresses to more than the limit
+        self.app.config["MAX_DECOMPRESSED_REQUEST_SIZE"] = 1024 * 1024
+        resp = self.client.post(url, data=self._gzip(" " * (2 * 1024 * 1024)), content_type="application/json",
+                                headers={"Content-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 413)
+        self.assertEqual(0, db.data.count_lowlevel(self.test_recording1_mbid))
+
+    def test_submit_low_level_spool(self):
+        spool_dir = tempfile.mkdtemp()
+        self.app.config["SUBMISSION_SPOOL_DIR"] = spool_dir
+        try:
+            resp = self.client.post("/api/v1/%s/low-level" % self.test_recording1_mbid,
+                                    data=self.test_recording1_data_json,
+                                    content_type="application/json")
+            self.assertEqual(resp.status_code, 202)
+            self.assertEqual(resp.json, {"message": "queued"})
+
+            # Invalid data is rejected before it is spooled
+            resp = self.client.post("/api/v1/%s/low-level" % self.uuid,
+                                    data=self.test_recording1_data_json,
+                                    content_type="application/json")
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(1, db.spool.get_status(spool_dir)["submissions"])
+
+            # Not saved until the spool is drained
+            self.assertEqual(0, db.data.count_lowlevel(self.test_recording1_mbid))
+            db.spool.drain(spool_dir)
+            self.assertEqual(1, db.data.count_lowlevel(self.test_recording1_mbid))
+        finally:
+            self.app.config["SUBMISSION_SPOOL_DIR"] = None
+            shutil.rmtree(spool_dir)
+
     def test_cors_headers(self):
         mbid = "0dad432b-16cc-4bf0-8961-fd31d124b01b"
         self.load_low_level_data(mbid)
@@ -67,7 +189,7 @@ class CoreViewsTestCase(ServerTestCase):
 
         # TODO: Test in get_high_level.
 
-    @mock.patch("db.data.load_low_level")
+    @mock.patch("db.data.load_low_level_json")
     def test_ll_bad_uuid_404(self, load_low_level):
         """ URL Endpoint returns 404 because url-part doesn't match UUID.
             This error is raised by Flask, but we special-case to json.
@@ -79,8 +201,9 @@ class CoreViewsTestCase(ServerTestCase):
         expected_result = {"message": "The requested URL was not found on the server. If you entered the URL manually please check your spelling and try again."}
         self.assertEqual(resp.json, expected_result)
 
-    @mock.patch("db.data.load_low_level")
-    def test_ll_internal_server_error(self, load_low_level):
+    @mock.patch("db.data.get_low_level_sha256", return_value="0" * 64)
+    @mock.patch("db.data.load_low_level_json")
+    def test_ll_internal_server_error(self, load_low_level, get_low_level_sha256):
 
         # Flask will propagate exceptions instead of calling an error handler
         # if either DEBUG *or* TESTING is True. In order to actually test
@@ -97,52 +220,192 @@ class CoreViewsTestCase(ServerTestCase):
         self.assertDictEqual(resp.json, expected_result)
         self.app.config['PROPAGATE_EXCEPTIONS'] = old_propagate_exceptions
 
-    @mock.patch("db.data.load_low_level")
-    def test_ll_no_offset(self, ll):
-        ll.return_value = {}
+    @mock.patch("db.data.get_low_level_sha256", return_value="0" * 64)
+    @mock.patch("db.data.load_low_level_json")
+    def test_ll_no_offset(self, ll, get_low_level_sha256):
+        ll.return_value = "{}"
         resp = self.client.get("/api/v1/%s/low-level" % self.uuid)
         self.assertEqual(200, resp.status_code)
         ll.assert_called_with(self.uuid, 0)
 
-    @mock.patch("db.data.load_low_level")
-    def test_ll_numerical_offset(self, ll):
-        ll.return_value = {}
+    @mock.patch("db.data.get_low_level_sha256", return_value="0" * 64)
+    @mock.patch("db.data.load_low_level_json")
+    def test_ll_numerical_offset(self, ll, get_low_level_sha256):
+        ll.return_value = "{}"
         resp = self.client.get("/api/v1/%s/low-level?n=3" % self.uuid)
         self.assertEqual(200, resp.status_code)
         ll.assert_called_with(self.uuid, 3)
 
+    @mock.patch("db.data.get_low_level_sha256", return_value="0" * 64)
     @mock.patch("db.data.load_low_level")
+    def test_ll_features(self, ll, get_low_level_sha256):
+        ll.return_value = {}
+        resp = self.client.get("/api/v1/%s/low-level?features=rhythm.bpm,lowlevel.mfcc.mean" % self.uuid)
+        self.assertEqual(200, resp.status_code)
+        ll.assert_called_with(self.uuid, 0, [["rhythm", "bpm"], ["lowlevel", "mfcc", "mean"]])
+
+        resp = self.client.get("/api/v1/%s/low-level?features=rhythm..bpm" % self.uuid)
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual(resp.json["message"], "'rhythm..bpm' is not a valid feature path")
+
+        resp = self.client.get("/api/v1/%s/low-level?features=lowlevel.mfcc.mean.1" % self.uuid)
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual(resp.json["message"],
+                         "'lowlevel.mfcc.mean.1' is not a valid feature path, list items can't be selected")
+
+        features = ",".join(["rhythm.bpm"] * (core.MAX_FEATURES_PER_REQUEST + 1))
+        resp = self.client.get("/api/v1/%s/low-level?features=%s" % (self.uuid, features))
+        self.assertEqual(400, resp.status_code)
+
+    def test_ll_features_data(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        resp = self.client.get("/api/v1/%s/low-level?features=rhythm.bpm,tonal.key_key,lowlevel.not_a_feature"
+                               % self.test_recording1_mbid)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(resp.json, {"rhythm": {"bpm": self.test_recording1_data["rhythm"]["bpm"]},
+                                     "tonal": {"key_key": self.test_recording1_data["tonal"]["key_key"]}})
+
+        resp = self.client.get("/api/v1/low-level?recording_ids=%s&features=metadata.audio_properties.codec"
+                               % self.test_recording1_mbid)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(resp.json, {self.test_recording1_mbid: {"0": {"metadata": {"audio_properties": {
+            "codec": self.test_recording1_data["metadata"]["audio_properties"]["codec"]}}}}})
+
+    def test_ll_data(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        expected = db.data.load_low_level(self.test_recording1_mbid)
+        resp = self.client.get("/api/v1/%s/low-level" % self.test_recording1_mbid)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("application/json", resp.mimetype)
+        self.assertEqual(resp.json, expected)
+
+        resp = self.client.get("/api/v1/low-level?recording_ids=%s;%s" % (self.test_recording1_mbid, self.uuid))
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(resp.json, {self.test_recording1_mbid: {"0": expected}})
+
+    def test_join_documents(self):
+        documents = {"b": {"1": '{"x": 1}', "0": "[]"}, "a": {"0": '{"y": "\u00e9"}'}}
+        self.assertEqual({"a": {"0": {"y": u"\u00e9"}}, "b": {"0": [], "1": {"x": 1}}},
+                         json.loads(core._join_documents(documents)))
+        self.assertEqual({}, json.loads(core._join_documents({})))
+
+    def test_ll_etag(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        url = "/api/v1/%s/low-level" % self.test_recording1_mbid
+        resp = self.client.get(url)
+        self.assertEqual(200, resp.status_code)
+        etag = resp.headers["ETag"]
+        self.assertEqual("public, no-cache", resp.headers["Cache-Control"])
+
+        # A response for an explicit offset never changes
+        resp = self.client.get(url + "?n=0")
+        self.assertEqual(etag, resp.headers["ETag"])
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+
+        # Different features are a different response
+        resp = self.client.get(url + "?features=rhythm.bpm")
+        self.assertNotEqual(etag, resp.headers["ETag"])
+
+        with mock.patch("db.data.load_low_level_json") as load_low_level_json:
+            resp = self.client.get(url + "?n=0", headers={"If-None-Match": etag})
+            load_low_level_json.assert_not_called()
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual(b"", resp.data)
+        self.assertEqual(etag, resp.headers["ETag"])
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertEqual("*", resp.headers["Access-Control-Allow-Origin"])
+        self.assertIn("X-RateLimit-Remaining", resp.headers)
+
+        resp = self.client.get(url, headers={"If-None-Match": '"other"'})
+        self.assertEqual(200, resp.status_code)
+
+        resp = self.client.get("/api/v1/low-level?recording_ids=%s" % self.test_recording1_mbid)
+        self.assertEqual(200, resp.status_code)
+        resp = self.client.get("/api/v1/low-level?recording_ids=%s" % self.test_recording1_mbid,
+                               headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(304, resp.status_code)
+
+        # A missing document is still not found
+        resp = self.client.get("/api/v1/%s/low-level" % self.uuid, headers={"If-None-Match": etag})
+        self.assertEqual(404, resp.status_code)
+
+    def test_not_found_cached(self):
+        """A repeated request for a missing document doesn't query the database"""
+        db.document_cache.init(enabled=True)
+        try:
+            for endpoint in ("low-level", "high-level"):
+                url = "/api/v1/%s/%s" % (self.uuid, endpoint)
+                self.assertEqual(404, self.client.get(url).status_code)
+                with mock.patch("db.data.db.connect") as connect:
+                    self.assertEqual(404, self.client.get(url).status_code)
+                    connect.assert_not_called()
+        finally:
+            db.document_cache.init(enabled=False)
+
+    def test_hl_etag(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        with db.engine.connect() as connection:
+            ll_id = connection.execute("SELECT id FROM lowlevel WHERE gid = %s",
+                                       (self.test_recording1_mbid,)).fetchone()[0]
+        db.data.add_model("model1", "v1", "show")
+        db.data.add_model("model2", "v1", "show")
+        ver = {"hlversion": "123", "models_essentia_git_sha": "v1"}
+        db.data.write_high_level(self.test_recording1_mbid, ll_id,
+                                 {"highlevel": {"model1": {"x": "y"}, "model2": {"a": "b"}},
+                                  "metadata": {"version": {"highlevel": ver}}}, "sha")
+
+        url = "/api/v1/%s/high-level" % self.test_recording1_mbid
+        resp = self.client.get(url)
+        self.assertEqual(200, resp.status_code)
+        etag = resp.headers["ETag"]
+        self.assertEqual("public, no-cache", resp.headers["Cache-Control"])
+        self.assertNotEqual(etag, self.client.get(url + "?map_classes=true").headers["ETag"])
+
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(304, resp.status_code)
+        self.assertEqual("*", resp.headers["Access-Control-Allow-Origin"])
+
+        # The document changes when the models that are shown change
+        db.data.set_model_status("model2", "v1", db.data.STATUS_HIDDEN)
+        resp = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(200, resp.status_code)
+        self.assertNotIn("model2", resp.json["highlevel"])
+        self.assertNotEqual(etag, resp.headers["ETag"])
+
+    @mock.patch("db.data.load_low_level_json")
     def test_ll_bad_offset(self, ll):
         resp = self.client.get("/api/v1/%s/low-level?n=x" % self.uuid)
         self.assertEqual(400, resp.status_code)
 
-    @mock.patch("db.data.load_low_level")
+    @mock.patch("db.data.load_low_level_json")
     def test_ll_no_item(self, ll):
         ll.side_effect = db.exceptions.NoDataFoundException
         resp = self.client.get("/api/v1/%s/low-level" % self.uuid)
         self.assertEqual(404, resp.status_code)
         self.assertEqual("Not found", resp.json["message"])
 
-    @mock.patch("db.data.load_high_level")
-    def test_get_high_level(self, hl):
-        hl.return_value = {}
+    @mock.patch("db.data.get_high_level_digest", return_value="0" * 64)
+    @mock.patch("db.data.load_high_level_json")
+    def test_get_high_level(self, hl, get_high_level_digest):
+        hl.return_value = "{}"
         resp = self.client.get("/api/v1/%s/high-level" % self.uuid)
         self.assertEqual(200, resp.status_code)
-        hl.assert_called_with(self.uuid, 0, False)
+        hl.assert_called_with(self.uuid, 0)
 
         # upper-case
         resp = self.client.get("/api/v1/%s/high-level" % self.uuid.upper())
         self.assertEqual(200, resp.status_code)
-        hl.assert_called_with(self.uuid, 0, False)
+        hl.assert_called_with(self.uuid, 0)
 
-    @mock.patch("db.data.load_high_level")
-    def test_hl_numerical_offset(self, hl):
-        hl.return_value = {}
+    @mock.patch("db.data.get_high_level_digest", return_value="0" * 64)
+    @mock.patch("db.data.load_high_level_json")
+    def test_hl_numerical_offset(self, hl, get_high_level_digest):
+        hl.return_value = "{}"
         resp = self.client.get("/api/v1/%s/high-level?n=3" % self.uuid)
         self.assertEqual(200, resp.status_code)
-        hl.assert_called_with(self.uuid, 3, False)
+        hl.assert_called_with(self.uuid, 3)
 
-    @mock.patch('db.data.load_many_low_level')
+    @mock.patch('db.data.load_many_low_level_json')
     def test_get_bulk_ll_no_param(self, load_many_low_level):
         # No parameter in bulk lookup results in an error
         resp = self.client.get('api/v1/low-level')
@@ -151,7 +414,7 @@ class CoreViewsTestCase(ServerTestCase):
         expected_result = {"message": "Missing `recording_ids` parameter"}
         self.assertEqual(resp.json, expected_result)
 
-    @mock.patch('db.data.load_many_low_level')
+    @mock.patch('db.data.load_many_low_level_json')
     def test_get_bulk_ll(self, load_many_low_level):
         # Check that many items are returned, including two offsets of the
         # same mbid
@@ -164,9 +427,9 @@ class CoreViewsTestCase(ServerTestCase):
         rec_40_3 = {"recording": "405a5ff4-7ee2-436b-95c1-90ce8a83b359:3"}
 
         load_many_low_level.return_value = {
-            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5},
-            "7f27d7a9-27f0-4663-9d20-2c9c40200e6d": {"3": rec_7f},
-            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": rec_40_2, "3": rec_40_3}
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)},
+            "7f27d7a9-27f0-4663-9d20-2c9c40200e6d": {"3": json.dumps(rec_7f)},
+            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": json.dumps(rec_40_2), "3": json.dumps(rec_40_3)}
         }
 
         resp = self.client.get('api/v1/low-level?recording_ids=' + params)
@@ -190,7 +453,9 @@ class CoreViewsTestCase(ServerTestCase):
         expected_result = {
             "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5}
         }
-        load_many_low_level.return_value = expected_result
+        load_many_low_level.return_value = {
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)}
+        }
         resp = self.client.get('api/v1/low-level?recording_ids=' + params)
         self.assertEqual(resp.status_code, 200)
 
@@ -200,7 +465,7 @@ class CoreViewsTestCase(ServerTestCase):
         recordings = [("c5f4909e-1d7b-4f15-a6f6-1af376bc01c9", 0)]
         load_many_low_level.assert_called_with(recordings)
 
-    @mock.patch('db.data.load_many_low_level')
+    @mock.patch('db.data.load_many_low_level_json')
     def test_get_bulk_ll_absent_mbid(self, load_many_low_level):
         # Check that within a set of mbid parameters, the ones absent
         # from the database are ignored.
@@ -211,8 +476,8 @@ class CoreViewsTestCase(ServerTestCase):
         rec_40_2 = {"recording": "405a5ff4-7ee2-436b-95c1-90ce8a83b359:2"}
 
         load_many_low_level.return_value = {
-            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5},
-            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": rec_40_2}
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)},
+            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": json.dumps(rec_40_2)}
         }
 
         resp = self.client.get('api/v1/low-level?recording_ids=' + params)
@@ -246,7 +511,7 @@ class CoreViewsTestCase(ServerTestCase):
         expected_result = {"message": "Missing `recording_ids` parameter"}
         self.assertDictEqual(resp.json, expected_result)
 
-    @mock.patch('db.data.load_many_high_level')
+    @mock.patch('db.data.load_many_high_level_json')
     def test_get_bulk_hl(self, load_many_high_level):
         # Check that many items are returned, including two offsets of the
         # same mbid
@@ -259,9 +524,9 @@ class CoreViewsTestCase(ServerTestCase):
         rec_40_3 = {"recording": "405a5ff4-7ee2-436b-95c1-90ce8a83b359:3"}
 
         load_many_high_level.return_value = {
-            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5},
-            "7f27d7a9-27f0-4663-9d20-2c9c40200e6d": {"3": rec_7f},
-            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": rec_40_2, "3": rec_40_3}
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)},
+            "7f27d7a9-27f0-4663-9d20-2c9c40200e6d": {"3": json.dumps(rec_7f)},
+            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": json.dumps(rec_40_2), "3": json.dumps(rec_40_3)}
         }
 
         resp = self.client.get('api/v1/high-level?recording_ids=' + params)
@@ -278,10 +543,11 @@ class CoreViewsTestCase(ServerTestCase):
                       ("7f27d7a9-27f0-4663-9d20-2c9c40200e6d", 3),
                       ("405a5ff4-7ee2-436b-95c1-90ce8a83b359", 2),
                       ("405a5ff4-7ee2-436b-95c1-90ce8a83b359", 3)]
-        load_many_high_level.assert_called_with(recordings, False)
+        load_many_high_level.assert_called_with(recordings)
 
+    @mock.patch('db.data.load_many_high_level_json')
     @mock.patch('db.data.load_many_high_level')
-    def test_get_bulk_hl_map_classes(self, load_many_high_level):
+    def test_get_bulk_hl_map_classes(self, load_many_high_level, load_many_high_level_json):
         # Check that many items are returned, including two offsets of the
         # same mbid
 
@@ -309,7 +575,9 @@ class CoreViewsTestCase(ServerTestCase):
         expected_result = {
             "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5}
         }
-        load_many_high_level.return_value = expected_result
+        load_many_high_level_json.return_value = {
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)}
+        }
         resp = self.client.get('api/v1/high-level?recording_ids=' + params)
         self.assert200(resp)
 
@@ -317,9 +585,9 @@ class CoreViewsTestCase(ServerTestCase):
         # to load_many_high_level is always lower-case regardless of what we pass in
         self.assertDictEqual(resp.json, expected_result)
         recordings = [("c5f4909e-1d7b-4f15-a6f6-1af376bc01c9", 0)]
-        load_many_high_level.assert_called_with(recordings, False)
+        load_many_high_level_json.assert_called_with(recordings)
 
-    @mock.patch('db.data.load_many_high_level')
+    @mock.patch('db.data.load_many_high_level_json')
     def test_get_bulk_hl_absent_mbid(self, load_many_high_level):
         # Check that within a set of mbid parameters, the ones absent
         # from the database are ignored.
@@ -330,8 +598,8 @@ class CoreViewsTestCase(ServerTestCase):
         rec_40_2 = {"recording": "405a5ff4-7ee2-436b-95c1-90ce8a83b359:2"}
 
         load_many_high_level.return_value = {
-            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": rec_c5},
-            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": rec_40_2}
+            "c5f4909e-1d7b-4f15-a6f6-1af376bc01c9": {"0": json.dumps(rec_c5)},
+            "405a5ff4-7ee2-436b-95c1-90ce8a83b359": {"2": json.dumps(rec_40_2)}
         }
 
         resp = self.client.get('api/v1/high-level?recording_ids=' + params)
@@ -346,7 +614,7 @@ class CoreViewsTestCase(ServerTestCase):
         recordings = [("c5f4909e-1d7b-4f15-a6f6-1af376bc01c9", 0),
                       ("7f27d7a9-27f0-4663-9d20-2c9c40200e6d", 3),
                       ("405a5ff4-7ee2-436b-95c1-90ce8a83b359", 2)]
-        load_many_high_level.assert_called_with(recordings, False)
+        load_many_high_level.assert_called_with(recordings)
 
     def test_get_bulk_hl_more_than_25(self):
         # Create many random uuids, because of parameter deduplication
@@ -418,6 +686,140 @@ class CoreViewsTestCase(ServerTestCase):
         self.assertEqual('More than 25 recordings not allowed per request',
                          resp.json['message'])
 
+    def test_get_submissions(self):
+        resp = self.client.get('api/v1/%s/submissions' % self.test_recording1_mbid)
+        self.assert404(resp)
+
+        self.load_low_level_data(self.test_recording1_mbid)
+        resp = self.client.get('api/v1/%s/submissions' % self.test_recording1_mbid.upper())
+        self.assert200(resp)
+        self.assertEqual(self.test_recording1_mbid, resp.json["mbid"])
+        self.assertEqual(1, len(resp.json["submissions"]))
+        submission = resp.json["submissions"][0]
+        audio_properties = self.test_recording1_data["metadata"]["audio_properties"]
+        self.assertEqual(0, submission["offset"])
+        self.assertEqual(audio_properties["lossless"], submission["lossless"])
+        self.assertEqual(audio_properties["codec"], submission["codec"])
+        self.assertEqual(audio_properties["bit_rate"], submission["bit_rate"])
+        self.assertEqual(self.test_recording1_data["metadata"]["version"]["essentia_build_sha"],
+                         submission["build_sha1"])
+        self.assertFalse(submission["highlevel"])
+        self.assertIn("submitted", submission)
+
+    def test_get_bulk_submissions(self):
+        mbids = self.submit_fake_data()
+        resp = self.client.get('api/v1/submissions?recording_ids=' + ';'.join(mbids).upper())
+        self.assert200(resp)
+        self.assertEqual({"7f27d7a9-27f0-4663-9d20-2c9c40200e6d": [0],
+                          "405a5ff4-7ee2-436b-95c1-90ce8a83b359": [0, 1]},
+                         {mbid: [submission["offset"] for submission in submissions]
+                          for mbid, submissions in resp.json.items()})
+
+        resp = self.client.get('api/v1/submissions')
+        self.assert400(resp)
+
+    def _post_recordings(self, url, recording_ids):
+        return self.client.post(url, data=json.dumps({"recording_ids": recording_ids}),
+                                content_type="application/json")
+
+    def test_stream_bulk_ll(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        self.load_low_level_data(self.test_recording2_mbid)
+        expected = {(self.test_recording1_mbid, 0): db.data.load_low_level(self.test_recording1_mbid),
+                    (self.test_recording2_mbid, 0): db.data.load_low_level(self.test_recording2_mbid)}
+
+        recording_ids = [self.test_recording1_mbid, self.test_recording2_mbid.upper() + ":0",
+                         self.test_recording2_mbid + ":1", self.uuid]
+        # Look up the recordings in more than one query
+        with mock.patch("db.data.ITER_CHUNK_SIZE", 1), mock.patch("db.data.ITER_FETCH_SIZE", 1):
+            resp = self._post_recordings("/api/v1/low-level", recording_ids)
+            # The response is streamed, so the documents are loaded when it is read
+            lines = [json.loads(line) for line in resp.data.decode("utf-8").splitlines()]
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("application/x-ndjson", resp.mimetype)
+        self.assertEqual(expected, {(line["mbid"], line["offset"]): line["document"] for line in lines})
+
+        resp = self.client.post("/api/v1/low-level?features=rhythm.bpm",
+                                data=json.dumps({"recording_ids": [self.test_recording1_mbid]}),
+                                content_type="application/json")
+        self.assertEqual([{"mbid": self.test_recording1_mbid, "offset": 0,
+                           "document": {"rhythm": {"bpm": self.test_recording1_data["rhythm"]["bpm"]}}}],
+                         [json.loads(line) for line in resp.data.decode("utf-8").splitlines()])
+
+    def test_stream_bulk_hl(self):
+        self.load_low_level_data(self.test_recording1_mbid)
+        with db.engine.connect() as connection:
+            ll_id = connection.execute("SELECT id FROM lowlevel WHERE gid = %s",
+                                       (self.test_recording1_mbid,)).fetchone()[0]
+        db.data.add_model("model1", "v1", "show")
+        hl = {"highlevel": {"model1": {"x": "y"}}, "metadata": {"version": {"highlevel": {"hlversion": "123"}}}}
+        db.data.write_high_level(self.test_recording1_mbid, ll_id, hl, "sha")
+
+        resp = self._post_recordings("/api/v1/high-level", [self.test_recording1_mbid, self.uuid])
+        self.assertEqual(200, resp.status_code)
+        lines = [json.loads(line) for line in resp.data.decode("utf-8").splitlines()]
+        self.assertEqual([{"mbid": self.test_recording1_mbid, "offset": 0,
+                           "document": db.data.load_high_level(self.test_recording1_mbid)}], lines)
+
+    def test_stream_bulk_count(self):
+        mbids = self.submit_fake_data()
+        resp = self._post_recordings("/api/v1/count", mbids + [mbids[2] + ":1"])
+        self.assertEqual(200, resp.status_code)
+        counts = {}
+        for line in resp.data.decode("utf-8").splitlines():
+            line = json.loads(line)
+            counts[line["mbid"]] = line["count"]
+        self.assertEqual({mbids[1]: 1, mbids[2]: 2}, counts)
+
+    def test_exists(self):
+        mbids = self.submit_fake_data()
+        resp = self._post_recordings("/api/v1/exists", [mbids[1].upper(), mbids[2] + ":1", self.uuid])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({mbids[1]: True, mbids[2]: True, self.uuid: False}, resp.json)
+
+        # Without a snapshot there is nothing to download
+        resp = self.client.get("/api/v1/exists/snapshot")
+        self.assertEqual(404, resp.status_code)
+
+        snapshot_dir = tempfile.mkdtemp()
+        try:
+            snapshot_path = os.path.join(snapshot_dir, "mbids")
+            db.mbid_snapshot.build(snapshot_path)
+            db.mbid_snapshot.init(snapshot_path)
+            resp = self._post_recordings("/api/v1/exists", [mbids[1], self.uuid])
+            self.assertEqual({mbids[1]: True, self.uuid: False}, resp.json)
+
+            resp = self.client.get("/api/v1/exists/snapshot")
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual("application/octet-stream", resp.mimetype)
+            with open(snapshot_path, "rb") as f:
+                self.assertEqual(f.read(), resp.data)
+            resp = self.client.get("/api/v1/exists/snapshot", headers={"If-None-Match": resp.headers["ETag"]})
+            self.assertEqual(304, resp.status_code)
+        finally:
+            db.mbid_snapshot.init()
+            shutil.rmtree(snapshot_dir)
+
+    def test_stream_bulk_bad_request(self):
+        resp = self.client.post("/api/v1/low-level", data="not json", content_type="application/json")
+        self.assertEqual(400, resp.status_code)
+
+        resp = self._post_recordings("/api/v1/low-level", [])
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual("No recording_ids in request", resp.json["message"])
+
+        resp = self.client.post("/api/v1/count", data=json.dumps([self.uuid]), content_type="application/json")
+        self.assertEqual(400, resp.status_code)
+
+        resp = self._post_recordings("/api/v1/high-level", ["not-a-uuid"])
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual("'not-a-uuid' is not a valid UUID", resp.json["message"])
+
+        with mock.patch("webserver.views.api.v1.core.MAX_ITEMS_PER_STREAMING_REQUEST", 2):
+            resp = self._post_recordings("/api/v1/low-level", [str(uuid.uuid4()) for _ in range(3)])
+        self.assertEqual(400, resp.status_code)
+        self.assertEqual("More than 2 recordings not allowed per request", resp.json["message"])
+
 
 class GetBulkValidationTest(unittest.TestCase):
     # Validation/parse methods don't need to spin up test server
@@ -4,6 +4,7 @@ import click
 from flask.cli import FlaskGroup
 
 import dataset_eval.evaluate
+import db.data
 import hl_extractor.hl_calc
 import webserver
 
@@ -11,10 +12,27 @@ cli = FlaskGroup(add_default_commands=False, create_app=webserver.create_app_fla
 
 
 @cli.command('hl_extractor')
-@click.option('--threads', '-t', default=1, type=int)
-def command_hl_extractor(threads=1):
-    """Compute high-level features from low-level data files."""
-    hl_extractor.hl_calc.main(threads)
+@click.option('--workers', '--threads', '-w', '-t', 'workers', type=click.IntRange(1, None),
+              help='Number of documents to compute at a time. Defaults to the number of CPUs.')
+@click.option('--lease-duration', default=db.data.HIGHLEVEL_LEASE_DURATION, type=click.IntRange(1, None),
+              help='Number of seconds before documents claimed by an extractor which stopped '
+                   'can be claimed by another one.')
+@click.option('--batch-size', '-b', default=1, type=click.IntRange(1, None),
+              help='Number of documents to send to a worker at a time. If greater than 1 and the Essentia '
+                   'python bindings are installed, each worker loads the models once instead of running '
+                   'the extractor binary for each document.')
+@click.option('--scratch-dir', '-s', type=click.Path(exists=True, file_okay=False, writable=True),
+              help='Directory for the input and output files of the extractor. Use a RAM-backed '
+                   'directory such as /dev/shm to not write documents to disk. Defaults to the '
+                   'temporary directory.')
+def command_hl_extractor(workers=None, lease_duration=db.data.HIGHLEVEL_LEASE_DURATION, batch_size=1,
+                         scratch_dir=None):
+    """Compute high-level features from low-level data files.
+
+    Any number of extractors can run on one or more machines, each document is
+    only processed by one of them.
+    """
+    hl_extractor.hl_calc.main(workers, lease_duration, batch_size, scratch_dir)
 
 
 @cli.command('dataset_evaluator')